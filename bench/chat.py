@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Time-to-first-token of the chat page's old flow against /chat.
+
+Starts the fake Google APIs, the fake Ollama and src/server_http.py, then
+asks each question two ways:
+  page  what chat_interface.html used to do: POST /call_tool, then
+        /api/generate with stream=false on a new connection; the first
+        text shows when the whole answer has arrived
+  chat  POST /chat and wait for the first "token" event
+With --cold the model is unloaded before every question, as after Ollama's
+default 5 minute keep_alive runs out.
+
+    python bench/chat.py --questions 10 --load-ms 2000 --cold
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from fake_google import FakeGoogle  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+from suite import HttpServer, _setup_dir  # noqa: E402
+
+QUESTIONS = (
+    ("What's on my calendar this week?", 'calendar_list_events'),
+    ("Show me my recent emails", 'gmail_list_messages'),
+)
+
+
+def _post(url, body):
+    return urllib.request.urlopen(urllib.request.Request(
+        url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'}
+    ), timeout=300)
+
+
+def page_flow(server, ollama, question, tool):
+    started = time.perf_counter()
+    with _post(server.url + '/call_tool', {
+        'name': tool, 'arguments': {'max_results': 10}, 'format': 'table', 'max_tokens': 800
+    }) as response:
+        data = json.load(response)['text']
+    prompt = f"You are a helpful assistant.\n\nUser: {question}\n\nHere is the relevant data:\n{data}\n\nAssistant:"
+    with _post(ollama.root + '/api/generate', {
+        'model': 'llama3.2:3b', 'prompt': prompt, 'stream': False
+    }) as response:
+        json.load(response)
+    return time.perf_counter() - started
+
+
+def chat_flow(server, question):
+    started = time.perf_counter()
+    first_token = None
+    with _post(server.url + '/chat', {'message': question}) as response:
+        event = None
+        for line in response:
+            line = line.decode().rstrip('\n')
+            if line.startswith('event: '):
+                event = line[7:]
+            elif line.startswith('data: ') and event == 'token' and first_token is None:
+                first_token = time.perf_counter() - started
+            elif line.startswith('data: ') and event == 'error':
+                raise RuntimeError(line[6:])
+    return first_token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=100, help='fake Google API latency')
+    parser.add_argument('--load-ms', type=float, default=2000, help='fake model load time')
+    parser.add_argument('--token-ms', type=float, default=20)
+    parser.add_argument('--tokens', type=int, default=60, help='tokens per answer')
+    parser.add_argument('--cold', action='store_true', help='unload the model before each question')
+    opts = parser.parse_args()
+
+    google = FakeGoogle(latency=opts.latency_ms / 1000)
+    google.start()
+    ollama = FakeOllama(opts.load_ms / 1000, token=opts.token_ms / 1000, tokens=opts.tokens)
+    ollama.start()
+    results = {'page': [], 'chat': []}
+    with tempfile.TemporaryDirectory(prefix='bench-chat-') as directory:
+        env = dict(
+            os.environ,
+            GOOGLE_TOKEN_DIR=directory,
+            GOOGLE_DISCOVERY_DIR=_setup_dir(google, directory),
+            OLLAMA_URL=ollama.root,
+            TOOL_CACHE='0',
+        )
+        server = HttpServer(env)
+        try:
+            for i in range(opts.questions):
+                question, tool = QUESTIONS[i % len(QUESTIONS)]
+                for flow in ('page', 'chat'):
+                    if opts.cold:
+                        ollama.unload()
+                    if flow == 'page':
+                        results[flow].append(page_flow(server, ollama, question, tool))
+                    else:
+                        results[flow].append(chat_flow(server, question))
+        finally:
+            server.stop()
+    report = {'config': vars(opts), 'ollama': ollama.stats()}
+    for flow, seconds in results.items():
+        report[flow] = {
+            'first_text_p50_ms': round(statistics.median(seconds) * 1000, 1),
+            'first_text_max_ms': round(max(seconds) * 1000, 1),
+        }
+    google.stop()
+    ollama.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
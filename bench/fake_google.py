@@ -0,0 +1,739 @@
+#!/usr/bin/env python3
+"""A local stand-in for the Gmail and Calendar REST APIs.
+
+Serves the endpoints the tools use (message list/get/send, attachments,
+batch, profile, thread list/get, drafts list/create/send, calendar list, event
+list/insert/get, free/busy, sync tokens, history, watch channels) plus the
+discovery documents, from a seeded mailbox and calendars. Messages are generated from their index on demand,
+so a 100k-message mailbox costs no more memory than a small one. Latency and
+429/503 errors can be injected, and so can lost answers to writes (applied,
+then answered with 503), to check that retried writes are not duplicated. Point the servers at it with
+GOOGLE_API_ROOT, or save its discovery documents into GOOGLE_DISCOVERY_DIR:
+
+    python bench/fake_google.py --port 8765 --messages 100000 --error-rate 0.05
+    GOOGLE_API_ROOT=http://127.0.0.1:8765/ python src/server_http.py
+
+New events and messages are pushed the way Google does it: a POST with
+X-Goog-* headers to every events.watch channel, and a Pub/Sub push message to
+--pubsub-push once users.watch named a topic. POST /_simulate/event and
+POST /_simulate/message add one as if another client had:
+
+    python bench/fake_google.py --pubsub-push 'http://127.0.0.1:8000/webhooks/gmail?token=s3cret'
+    curl -X POST localhost:8765/_simulate/message -d '{"subject": "Lunch?"}'
+
+GET /_stats returns the requests served so far, POST /_reset clears them.
+GET /_notifications counts the notifications posted.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from urllib.request import Request, urlopen
+
+GMAIL = '/gmail/v1/users/me'
+CALENDAR = '/calendar/v3/calendars/'
+DISCOVERY = re.compile(r'^/discovery/v1/apis/(\w+)/(\w+)/rest$')
+ERRORS = {
+    429: ('Too Many Requests', json.dumps({'error': {
+        'code': 429, 'message': 'Too many concurrent requests for user',
+        'errors': [{'reason': 'rateLimitExceeded', 'domain': 'usageLimits'}],
+    }})),
+    503: ('Service Unavailable', json.dumps({'error': {
+        'code': 503, 'message': 'The service is currently unavailable.',
+        'errors': [{'reason': 'backendError', 'domain': 'global'}],
+    }})),
+    404: ('Not Found', json.dumps({'error': {
+        'code': 404, 'message': 'Requested entity was not found.',
+    }})),
+    409: ('Conflict', json.dumps({'error': {
+        'code': 409, 'message': 'The requested identifier already exists.',
+        'errors': [{'reason': 'duplicate', 'domain': 'global'}],
+    }})),
+    410: ('Gone', json.dumps({'error': {
+        'code': 410, 'message': 'Sync token is no longer valid, a full sync is required.',
+        'errors': [{'reason': 'fullSyncRequired', 'domain': 'calendar'}],
+    }})),
+}
+# Every ATTACHMENT_EVERY-th message carries an attachment of ATTACHMENT_BYTES
+ATTACHMENT_EVERY = 10
+ATTACHMENT_BYTES = 256 * 1024
+# Messages 3t..3t+2 make up thread t; all but the oldest quote the one before
+THREAD_SIZE = 3
+# Every SHARED_EVENT_EVERY-th event is in all calendars, like a team meeting
+SHARED_EVENT_EVERY = 5
+# The mailbox's historyId before any change; older start IDs get 404
+FIRST_HISTORY_ID = 1000
+LABELS = ('INBOX', 'SENT', 'UNREAD', 'STARRED', 'IMPORTANT', 'SPAM', 'TRASH')
+WATCH_DAYS = 7
+
+_BATCH_PART = re.compile(
+    r'Content-ID:\s*<([^>]+)>.*?\r?\n\r?\n(GET|POST) (\S+) HTTP/1\.1\r?\n(.*?)\r?\n\r?\n',
+    re.IGNORECASE | re.DOTALL
+)
+_CONTENT_LENGTH = re.compile(r'^content-length:\s*(\d+)', re.IGNORECASE | re.MULTILINE)
+_WORDS = ('meeting notes agenda project update budget review launch customer team '
+          'report deadline schedule travel invoice contract design plan').split()
+
+
+def message_id(i):
+    """Gmail-style ID of the i-th message, newest first"""
+    return f'18f{i:013x}'
+
+
+def message_index(msg_id):
+    try:
+        return int(msg_id[3:], 16) if msg_id.startswith('18f') else None
+    except ValueError:
+        return None
+
+
+def thread_id(t):
+    return f'18f{t:013x}'
+
+
+def attachment_id(i):
+    return f'ANGjdJ{i:010d}'
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _header(name, value):
+    return {'name': name, 'value': value}
+
+
+class FakeGoogle:
+    """The fake's state: seeded data, fault injection and request counts"""
+
+    def __init__(self, messages=1000, events=50, latency=0.0, error_rate=0.0,
+                 server_error_rate=0.0, seed=0, calendars=3, lost_write_rate=0.0,
+                 pubsub_push=None):
+        self.message_count = messages
+        self.seed = seed
+        self.latency = latency
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.lost_write_rate = lost_write_rate
+        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        self.events = [self._event(i, now) for i in range(events)]
+        # The primary calendar first, the last one hidden in the Calendar UI
+        self.calendars = [
+            {'id': 'me@example.com', 'summary': 'me@example.com', 'primary': True, 'selected': True}
+        ] + [
+            {'id': f'team{c}@group.calendar.google.com', 'summary': f'Team {c}',
+             'selected': c < calendars - 1}
+            for c in range(1, calendars)
+        ]
+        # What the writes did: inserted events by ID, unsent drafts, sent raw emails
+        self.created_events = {}
+        self.drafts = {}
+        self.sent = []
+        # Changes since the seeded state: calendar events in order (a sync
+        # token is a position in it), new messages oldest first and their
+        # (historyId, message) entries
+        self.event_changes = []
+        self.added_messages = []
+        self.history = []
+        self.history_id = FIRST_HISTORY_ID
+        # Push: events.watch channels by ID, the users.watch topic and the
+        # endpoint its push subscription delivers to
+        self.channels = {}
+        self.gmail_topic = None
+        self.pubsub_push = pubsub_push
+        self.notifications = Counter()
+        self.requests = Counter()
+        self.root = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    # -- seeded data -------------------------------------------------------
+
+    def message(self, i, metadata_only=False):
+        rng = random.Random(self.seed * 1_000_003 + i)
+        subject = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+        sent = datetime(2026, 3, 1, tzinfo=timezone.utc) - timedelta(minutes=17 * i)
+        headers = [
+            _header('From', f'Person {i % 97} <person{i % 97}@example.com>'),
+            _header('To', 'me@example.com'),
+            _header('Subject', subject),
+            _header('Date', sent.strftime('%a, %d %b %Y %H:%M:%S +0000')),
+        ]
+        message = {
+            'id': message_id(i),
+            'threadId': thread_id(i // THREAD_SIZE),
+            'labelIds': ['INBOX'],
+            'snippet': subject,
+            'internalDate': str(int(sent.timestamp() * 1000)),
+        }
+        if metadata_only:
+            message['payload'] = {'mimeType': 'multipart/mixed', 'headers': headers}
+            return message
+
+        text = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(30, 600)))
+        if i % THREAD_SIZE != THREAD_SIZE - 1 and i + 1 < self.message_count:
+            quoted = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(30, 600)))
+            text += (f'\n\nOn {(sent - timedelta(minutes=17)):%a, %b %d, %Y at %H:%M} '
+                     f'Person {(i + 1) % 97} <person{(i + 1) % 97}@example.com> wrote:\n'
+                     + '\n'.join(f'> {quoted[n:n + 72]}' for n in range(0, len(quoted), 72)))
+        plain = {'partId': '0', 'mimeType': 'text/plain', 'headers': [],
+                 'body': {'size': len(text), 'data': _b64(text.encode())}}
+        if i % ATTACHMENT_EVERY == 0:
+            attachment = {
+                'partId': '1', 'mimeType': 'application/pdf', 'filename': f'report-{i}.pdf',
+                'headers': [_header('Content-Disposition', f'attachment; filename="report-{i}.pdf"')],
+                'body': {'size': ATTACHMENT_BYTES, 'attachmentId': attachment_id(i)},
+            }
+            payload = {'mimeType': 'multipart/mixed', 'parts': [plain, attachment]}
+        elif i % 4 == 1:
+            html = f'<html><body><p>{text}</p></body></html>'
+            payload = {'mimeType': 'multipart/alternative', 'parts': [plain, {
+                'partId': '1', 'mimeType': 'text/html', 'headers': [],
+                'body': {'size': len(html), 'data': _b64(html.encode())},
+            }]}
+        else:
+            payload = plain
+        message['payload'] = dict(payload, headers=headers, partId='')
+        message['sizeEstimate'] = len(text) + 500
+        return message
+
+    def thread(self, t, metadata_only=False):
+        """Thread t with its messages oldest first"""
+        last = min((t + 1) * THREAD_SIZE, self.message_count) - 1
+        return {
+            'id': thread_id(t),
+            'messages': [self.message(i, metadata_only) for i in range(last, t * THREAD_SIZE - 1, -1)],
+        }
+
+    def attachment(self, i):
+        data = bytes((i + n) % 251 for n in range(ATTACHMENT_BYTES))
+        return {'size': ATTACHMENT_BYTES, 'data': _b64(data)}
+
+    def _event(self, i, now):
+        start = now + timedelta(hours=2 * i + 1)
+        return {
+            'id': f'e{i:05d}',
+            'iCalUID': f'e{i:05d}@example.com',
+            'status': 'confirmed',
+            'summary': f'Meeting {i}',
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + timedelta(hours=1)).isoformat()},
+        }
+
+    def calendar_events(self, calendar_id, query):
+        """Events of one calendar overlapping timeMin/timeMax, or None if unknown"""
+        ids = [c['id'] for c in self.calendars]
+        index = 0 if calendar_id == 'primary' else ids.index(calendar_id) if calendar_id in ids else None
+        if index is None:
+            return None
+        time_min = query.get('timeMin', [None])[0]
+        time_max = query.get('timeMax', [None])[0]
+        events = [event for i, event in enumerate(self.events)
+                  if i % len(ids) == index or i % SHARED_EVENT_EVERY == 0]
+        if index == 0:
+            # Inserted all-day events are left out, the seeded ones are all timed
+            with self._lock:
+                created = [e for e in self.created_events.values() if 'dateTime' in e.get('start', {})]
+            events = sorted(events + created, key=lambda e: _time(e['start']['dateTime']))
+        return [
+            event for event in events
+            if (time_min is None or _time(event['end']['dateTime']) > _time(time_min))
+            and (time_max is None or _time(event['start']['dateTime']) < _time(time_max))
+        ]
+
+    def discovery_document(self, api, version):
+        from googleapiclient import discovery_cache
+        text = discovery_cache.get_static_doc(api, version)
+        if text is None:
+            return None
+        document = json.loads(text)
+        document['rootUrl'] = self.root
+        return document
+
+    # -- bookkeeping -------------------------------------------------------
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def injected_error(self):
+        """429, 503 or None, drawn from the configured rates"""
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.error_rate:
+            return 429
+        if roll < self.error_rate + self.server_error_rate:
+            return 503
+        return None
+
+    def lost_write(self):
+        """True when the answer to a write that was applied should be lost"""
+        with self._lock:
+            return self._random.random() < self.lost_write_rate
+
+    def stats(self):
+        with self._lock:
+            return dict(self.requests)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve on a daemon thread; returns the root URL"""
+        state = self
+
+        class Handler(_Handler):
+            fake = state
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.root = f'http://{host}:{self._server.server_port}/'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.root
+
+    def serve_forever(self, host, port):
+        print(f'Fake Google APIs on {self.start(host, port)}', flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    # -- API behaviour: (status, body) -------------------------------------
+
+    def handle(self, method, path, query, body):
+        if method == 'GET' and path == GMAIL + '/profile':
+            return 200, {'emailAddress': 'me@example.com',
+                         'messagesTotal': self.message_count + len(self.added_messages),
+                         'historyId': str(self.history_id)}
+        if method == 'GET' and path == GMAIL + '/history':
+            return self._history(query)
+        if method == 'GET' and path == GMAIL + '/labels':
+            return 200, {'labels': [{'id': label, 'name': label, 'type': 'system'} for label in LABELS]}
+        if method == 'POST' and path == GMAIL + '/watch':
+            self.gmail_topic = json.loads(body or b'{}').get('topicName')
+            return 200, {'historyId': str(self.history_id), 'expiration': _expiration(WATCH_DAYS * 86400)}
+        if method == 'POST' and path == GMAIL + '/stop':
+            self.gmail_topic = None
+            return 200, {}
+        if method == 'GET' and path == GMAIL + '/messages':
+            return 200, self._message_page(query)
+        match = re.fullmatch(GMAIL + r'/messages/([^/]+)/attachments/([^/]+)', path)
+        if method == 'GET' and match:
+            i = message_index(match.group(1))
+            if i is None or i >= self.message_count or match.group(2) != attachment_id(i):
+                return 404, None
+            return 200, self.attachment(i)
+        if method == 'GET' and path.startswith(GMAIL + '/messages/'):
+            i = message_index(path.rsplit('/', 1)[1])
+            if i is not None and 0 <= i - self.message_count < len(self.added_messages):
+                return 200, self.added_messages[i - self.message_count]
+            if i is None or i >= self.message_count:
+                return 404, None
+            return 200, self.message(i, query.get('format', ['full'])[0] == 'metadata')
+        if method == 'GET' and path == GMAIL + '/threads':
+            threads = -(-self.message_count // THREAD_SIZE)
+            return 200, self._page(_Range(threads, lambda t: {'id': thread_id(t)}), query, 'threads', 100)
+        if method == 'GET' and path.startswith(GMAIL + '/threads/'):
+            t = message_index(path.rsplit('/', 1)[1])
+            if t is None or t * THREAD_SIZE >= self.message_count:
+                return 404, None
+            return 200, self.thread(t, query.get('format', ['full'])[0] == 'metadata')
+        if method == 'POST' and path == GMAIL + '/messages/send':
+            return self._write(200, self._send(json.loads(body or b'{}').get('raw')))
+        if method == 'GET' and path == GMAIL + '/drafts':
+            wanted = query.get('q', [''])[0].replace('rfc822msgid:', '')
+            with self._lock:
+                drafts = [{'id': draft_id} for draft_id, raw in self.drafts.items()
+                          if not wanted or _message_id_header(raw) == wanted]
+            return 200, {'drafts': drafts} if drafts else {}
+        if method == 'POST' and path == GMAIL + '/drafts':
+            with self._lock:
+                draft_id = f'r{len(self.drafts) + len(self.sent)}'
+                self.drafts[draft_id] = json.loads(body or b'{}').get('message', {}).get('raw')
+            return self._write(200, {'id': draft_id, 'message': {'id': f'd{draft_id}'}})
+        if method == 'POST' and path == GMAIL + '/drafts/send':
+            with self._lock:
+                raw = self.drafts.pop(json.loads(body or b'{}').get('id'), None)
+            if raw is None:
+                return 404, None
+            return self._write(200, self._send(raw))
+        if method == 'GET' and path == '/calendar/v3/users/me/calendarList':
+            return 200, self._page(self.calendars, query, 'items', 100)
+        if method == 'POST' and path.startswith(CALENDAR) and path.endswith('/events/watch'):
+            return 200, self._watch(json.loads(body or b'{}'))
+        if method == 'POST' and path == '/calendar/v3/channels/stop':
+            with self._lock:
+                channel = self.channels.pop(json.loads(body or b'{}').get('id'), None)
+            return (200, {}) if channel else (404, None)
+        if path.startswith(CALENDAR) and path.endswith('/events'):
+            if method == 'POST':
+                return self._insert_event(json.loads(body or b'{}'))
+            if 'syncToken' in query:
+                return self._event_changes(query['syncToken'][0])
+            events = self.calendar_events(unquote(path[len(CALENDAR):-len('/events')]), query)
+            if events is None:
+                return 404, None
+            page = dict(self._page(events, query, 'items', 250), timeZone='UTC')
+            if 'nextPageToken' not in page:
+                page['nextSyncToken'] = str(len(self.event_changes))
+            return 200, page
+        match = re.fullmatch(CALENDAR + r'[^/]+/events/([^/]+)', path)
+        if method == 'GET' and match:
+            event = self.created_events.get(unquote(match.group(1)))
+            return (200, event) if event else (404, None)
+        if method == 'POST' and path == '/calendar/v3/freeBusy':
+            return 200, self._free_busy(json.loads(body or b'{}'))
+        return 404, None
+
+    def _write(self, status, result):
+        """The answer to a write that was applied, unless it is to be lost"""
+        if self.lost_write():
+            self.count('lost answers')
+            return 503, None
+        return status, result
+
+    def _insert_event(self, event):
+        event = self._add_event(event)
+        # Client-chosen IDs are unique, as in Calendar
+        return self._write(200, event) if event else (409, None)
+
+    def _add_event(self, event):
+        """Record an event and push the change; None if its ID is taken"""
+        with self._lock:
+            if event.get('id') in self.created_events:
+                return None
+            event_id = event.get('id') or f'new{len(self.events) + len(self.created_events)}'
+            event = dict(event, id=event_id, status='confirmed',
+                         htmlLink=f'https://calendar.example.com/event?eid={event_id}')
+            self.created_events[event_id] = event
+            self.event_changes.append(event)
+        self._notify_calendar()
+        return event
+
+    def _send(self, raw):
+        from email import message_from_bytes
+        with self._lock:
+            self.sent.append(raw)
+        sent = message_from_bytes(base64.urlsafe_b64decode(raw or ''))
+        message = self._add_message(sent.get('To', ''), 'me@example.com', sent.get('Subject', ''), ['SENT'])
+        return {'id': message['id'], 'labelIds': ['SENT']}
+
+    def _add_message(self, to, sender, subject, labels):
+        """Record a new message and its history entry, then push the change"""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            msg_id = message_id(self.message_count + len(self.added_messages))
+            message = {
+                'id': msg_id, 'threadId': msg_id, 'labelIds': labels, 'snippet': subject,
+                'internalDate': str(int(now.timestamp() * 1000)),
+                'payload': {'mimeType': 'text/plain', 'partId': '', 'body': {'size': 0}, 'headers': [
+                    _header('From', sender), _header('To', to), _header('Subject', subject),
+                    _header('Date', now.strftime('%a, %d %b %Y %H:%M:%S +0000')),
+                ]},
+            }
+            self.added_messages.append(message)
+            self.history_id += 1
+            self.history.append((self.history_id, message))
+            history_id = self.history_id
+        self._notify_gmail(history_id)
+        return message
+
+    def simulate_event(self, summary=None):
+        """Add an event starting in an hour, as another client would"""
+        start = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(hours=1)
+        with self._lock:
+            summary = summary or f'Simulated {len(self.event_changes)}'
+        return self._add_event({
+            'summary': summary,
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + timedelta(minutes=30)).isoformat()},
+        })
+
+    def simulate_message(self, subject=None):
+        """Deliver a message to the inbox, as a sender would"""
+        with self._lock:
+            subject = subject or f'Simulated {len(self.added_messages)}'
+        return self._add_message('me@example.com', 'Someone <someone@example.com>', subject,
+                                 ['INBOX', 'UNREAD'])
+
+    def _history(self, query):
+        start = int(query.get('startHistoryId', ['0'])[0])
+        if start < FIRST_HISTORY_ID:
+            return 404, None
+        with self._lock:
+            records = [
+                {'id': str(history_id), 'messagesAdded': [{'message': {
+                    'id': m['id'], 'threadId': m['threadId'], 'labelIds': m['labelIds']
+                }}]}
+                for history_id, m in self.history if history_id > start
+            ]
+            page = {'historyId': str(self.history_id)}
+        if records:
+            page['history'] = records
+        return 200, page
+
+    def _event_changes(self, token):
+        with self._lock:
+            if not token.isdigit() or int(token) > len(self.event_changes):
+                return 410, None
+            return 200, {'items': self.event_changes[int(token):],
+                         'nextSyncToken': str(len(self.event_changes)), 'timeZone': 'UTC'}
+
+    # -- push notifications ------------------------------------------------
+
+    def _watch(self, request):
+        ttl = int(request.get('params', {}).get('ttl', WATCH_DAYS * 86400))
+        channel = {
+            'kind': 'api#channel', 'id': request['id'], 'resourceId': 'primary-events',
+            'resourceUri': 'https://www.googleapis.com/calendar/v3/calendars/primary/events',
+            'token': request.get('token'), 'expiration': _expiration(ttl),
+        }
+        with self._lock:
+            self.channels[request['id']] = dict(channel, address=request['address'], number=0)
+        self._notify_calendar(request['id'], 'sync')
+        return channel
+
+    def _notify_calendar(self, only=None, state='exists'):
+        with self._lock:
+            posts = []
+            for channel in self.channels.values():
+                if only is not None and channel['id'] != only:
+                    continue
+                channel['number'] += 1
+                headers = {
+                    'X-Goog-Channel-ID': channel['id'],
+                    'X-Goog-Message-Number': str(channel['number']),
+                    'X-Goog-Resource-ID': channel['resourceId'],
+                    'X-Goog-Resource-URI': channel['resourceUri'],
+                    'X-Goog-Resource-State': state,
+                }
+                if channel['token']:
+                    headers['X-Goog-Channel-Token'] = channel['token']
+                posts.append((channel['address'], headers))
+        for address, headers in posts:
+            self._post('calendar', address, b'', headers)
+
+    def _notify_gmail(self, history_id):
+        if not (self.gmail_topic and self.pubsub_push):
+            return
+        data = json.dumps({'emailAddress': 'me@example.com', 'historyId': history_id})
+        body = json.dumps({'message': {
+            'data': base64.b64encode(data.encode()).decode(), 'messageId': str(history_id),
+            'publishTime': datetime.now(timezone.utc).isoformat(),
+        }, 'subscription': 'projects/fake/subscriptions/gmail-push'}).encode()
+        self._post('gmail', self.pubsub_push, body, {'Content-Type': 'application/json'})
+
+    def _post(self, api, url, body, headers):
+        """POST a notification from a thread of its own, as Google does"""
+        def send():
+            try:
+                urlopen(Request(url, data=body, headers=headers, method='POST'), timeout=10).close()
+                outcome = 'delivered'
+            except Exception:
+                outcome = 'failed'
+            with self._lock:
+                self.notifications[f'{api} {outcome}'] += 1
+
+        threading.Thread(target=send, daemon=True).start()
+
+    def _free_busy(self, request):
+        window = {'timeMin': [request['timeMin']], 'timeMax': [request['timeMax']]}
+        calendars = {}
+        for item in request.get('items', []):
+            events = self.calendar_events(item['id'], window)
+            if events is None:
+                calendars[item['id']] = {'errors': [{'domain': 'global', 'reason': 'notFound'}]}
+                continue
+            calendars[item['id']] = {'busy': [
+                {'start': e['start']['dateTime'], 'end': e['end']['dateTime']} for e in events
+            ]}
+        return {'kind': 'calendar#freeBusy', 'timeMin': request['timeMin'],
+                'timeMax': request['timeMax'], 'calendars': calendars}
+
+    def _message_page(self, query):
+        size = min(int(query.get('maxResults', ['100'])[0]), 500)
+        start = int(query.get('pageToken', ['0'])[0])
+        with self._lock:
+            added = [{'id': m['id'], 'threadId': m['threadId']} for m in reversed(self.added_messages)]
+        total = len(added) + self.message_count
+        end = min(start + size, total)
+        page = {
+            'messages': [added[p] if p < len(added) else
+                         {'id': message_id(p - len(added)),
+                          'threadId': thread_id((p - len(added)) // THREAD_SIZE)}
+                         for p in range(start, end)],
+            'resultSizeEstimate': total,
+        }
+        if end < total:
+            page['nextPageToken'] = str(end)
+        return page
+
+    def _page(self, items, query, key, default_size):
+        size = int(query.get('maxResults', [default_size])[0])
+        start = int(query.get('pageToken', ['0'])[0])
+        page = {key: items[start:start + size]}
+        if start + size < len(items):
+            page['nextPageToken'] = str(start + size)
+        return page
+
+
+class _Range:
+    """Sliceable list of f(0) .. f(n-1), built only for the slice asked for"""
+
+    def __init__(self, n, f):
+        self.n, self.f = n, f
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return [self.f(i) for i in range(*index.indices(self.n))]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif body is None:
+            body = ERRORS.get(status, ('', ''))[1].encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if url.path == '/_stats':
+            return self._reply(200, self.fake.stats())
+        if url.path == '/_reset':
+            self.fake.reset()
+            return self._reply(200, {})
+        if url.path == '/_notifications':
+            return self._reply(200, dict(self.fake.notifications))
+        if url.path == '/_simulate/event':
+            return self._reply(200, self.fake.simulate_event(json.loads(body or b'{}').get('summary')))
+        if url.path == '/_simulate/message':
+            return self._reply(200, self.fake.simulate_message(json.loads(body or b'{}').get('subject')))
+        match = DISCOVERY.match(url.path)
+        if match:
+            return self._reply(*self._discovery(*match.groups()))
+
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if url.path.rstrip('/') == '/batch' or url.path.startswith('/batch/'):
+            return self._batch(body)
+        self.fake.count(f'{method} {_kind(url.path)}')
+        error = self.fake.injected_error()
+        if error:
+            self.fake.count(f'injected {error}')
+            return self._reply(error, None)
+        status, result = self.fake.handle(method, url.path, parse_qs(url.query), body)
+        self._reply(status, result)
+
+    def _discovery(self, api, version):
+        document = self.fake.discovery_document(api, version)
+        return (200, document) if document else (404, None)
+
+    def _batch(self, body):
+        self.fake.count('POST batch')
+        boundary = 'batch_fake_google'
+        out = []
+        request = body.decode('utf-8', 'replace')
+        for part in _BATCH_PART.finditer(request):
+            content_id, method, uri, headers = part.groups()
+            length = _CONTENT_LENGTH.search(headers)
+            part_body = request[part.end():part.end() + int(length.group(1))] if length else None
+            url = urlsplit(uri)
+            self.fake.count(f'{method} {_kind(url.path)} (batched)')
+            status = self.fake.injected_error()
+            if status:
+                self.fake.count(f'injected {status}')
+                text = ERRORS[status][1]
+            else:
+                status, result = self.fake.handle(method, url.path, parse_qs(url.query), part_body)
+                text = json.dumps(result) if result is not None else ERRORS[status][1]
+            reason = 'OK' if status == 200 else ERRORS[status][0]
+            out.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n\r\n{text}\r\n'
+            )
+        out.append(f'--{boundary}--\r\n')
+        self._reply(200, ''.join(out).encode(), f'multipart/mixed; boundary={boundary}')
+
+    def do_GET(self):
+        self._serve('GET')
+
+    def do_POST(self):
+        self._serve('POST')
+
+
+def _message_id_header(raw):
+    from email import message_from_bytes
+    return message_from_bytes(base64.urlsafe_b64decode(raw or '')).get('Message-ID')
+
+
+def _time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _expiration(seconds):
+    """A channel expiry as Google writes it, in epoch milliseconds"""
+    return str(int((time.time() + seconds) * 1000))
+
+
+def _kind(path):
+    """Path with IDs replaced, for request counts"""
+    path = re.sub(r'/attachments/[^/]+', '/attachments/{id}', path)
+    path = re.sub(r'/messages/(?!send$)[^/]+', '/messages/{id}', path)
+    path = re.sub(r'/threads/[^/]+', '/threads/{id}', path)
+    path = re.sub(r'/events/(?!watch$)[^/]+', '/events/{id}', path)
+    return re.sub(r'/calendars/[^/]+', '/calendars/{id}', path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--messages', type=int, default=1000, help='mailbox size')
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--calendars', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every request')
+    parser.add_argument('--error-rate', type=float, default=0, help='share answered with 429')
+    parser.add_argument('--server-error-rate', type=float, default=0, help='share answered with 503')
+    parser.add_argument('--lost-write-rate', type=float, default=0,
+                        help='share of writes applied but answered with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pubsub-push', help='where to push Gmail changes once users.watch is called')
+    opts = parser.parse_args()
+    FakeGoogle(opts.messages, opts.events, opts.latency_ms / 1000, opts.error_rate,
+               opts.server_error_rate, opts.seed, opts.calendars,
+               opts.lost_write_rate, opts.pubsub_push).serve_forever(opts.host, opts.port)
+
+
+if __name__ == "__main__":
+    main()
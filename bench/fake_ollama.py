@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""A local stand-in for Ollama's /api/chat and /api/generate.
+
+Mimics the costs that decide time-to-first-token: loading the model when it
+is not in memory (--load-ms; it stays loaded for the request's keep_alive,
+5 minutes by default, as in Ollama), prompt evaluation (--prompt-ms-per-kchar)
+and one token every --token-ms. Answers stream as NDJSON when asked to. When
+tools are offered and the conversation has no tool results yet, the reply
+calls the first tool, so the server's tool loop can be exercised.
+
+    python bench/fake_ollama.py --port 11434 --load-ms 3000
+    OLLAMA_URL=http://127.0.0.1:11434 python src/server_http.py
+
+GET /_stats returns requests, model loads and TCP connections so far,
+POST /_reset clears them and POST /_unload drops the model from memory.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_KEEP_ALIVE = 300
+_DURATION = re.compile(r'^(-?\d+(?:\.\d+)?)(ms|s|m|h)?$')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, None: 1}
+_WORDS = ('Here is what I found . You have a few things coming up , '
+          'and nothing looks urgent . Let me know if you want details .').split()
+
+
+def keep_alive_seconds(value):
+    """Seconds for an Ollama keep_alive ("5m", "300", 300, -1 = forever)"""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    match = _DURATION.match(str(value).strip())
+    if not match:
+        return DEFAULT_KEEP_ALIVE
+    seconds = float(match.group(1)) * _UNITS[match.group(2)]
+    return float('inf') if seconds < 0 else seconds
+
+
+class FakeOllama:
+    """The fake's state: which model is loaded until when, and counters"""
+
+    def __init__(self, load=2.0, prompt_per_kchar=0.02, token=0.02, tokens=24):
+        self.load = load
+        self.prompt_per_kchar = prompt_per_kchar
+        self.token = token
+        self.tokens = tokens
+        self.requests = Counter()
+        self.root = None
+        self._loaded = {}  # model -> unload time
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._server = None
+
+    def ensure_loaded(self, model, keep_alive):
+        """Seconds spent loading model (0 when it was in memory)"""
+        spent = 0.0
+        # Requests arriving during a load wait for it, as in Ollama
+        with self._load_lock:
+            if self._loaded.get(model, 0) <= time.monotonic():
+                self.count('loads')
+                time.sleep(self.load)
+                spent = self.load
+            with self._lock:
+                self._loaded[model] = time.monotonic() + keep_alive_seconds(keep_alive)
+        return spent
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.requests)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+
+    def unload(self):
+        with self._lock:
+            self._loaded.clear()
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve on a daemon thread; returns the root URL"""
+        state = self
+
+        class Handler(_Handler):
+            fake = state
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.root = f'http://{host}:{self._server.server_port}'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.root
+
+    def serve_forever(self, host, port):
+        print(f'Fake Ollama on {self.start(host, port)}', flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.fake.count('connections')
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, record):
+        data = (json.dumps(record) + '\n').encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            return self._reply(200, self.fake.stats())
+        if self.path == '/api/tags':
+            return self._reply(200, {'models': [{'name': 'llama3.2:3b'}]})
+        self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path == '/_reset':
+            self.fake.reset()
+            return self._reply(200, {})
+        if self.path == '/_unload':
+            self.fake.unload()
+            return self._reply(200, {})
+        if self.path not in ('/api/chat', '/api/generate'):
+            return self._reply(404, {'error': 'not found'})
+        chat = self.path == '/api/chat'
+        self.fake.count(f'POST {self.path}')
+        model = request.get('model', '')
+        load = self.fake.ensure_loaded(model, request.get('keep_alive'))
+
+        messages = request.get('messages') or []
+        if (chat and not messages) or (not chat and not request.get('prompt')):
+            # An empty request only loads the model
+            return self._reply(200, {'model': model, 'done': True, 'done_reason': 'load'})
+
+        prompt = json.dumps(messages) if chat else request['prompt']
+        prompt_eval = len(prompt) / 1000 * self.fake.prompt_per_kchar
+        time.sleep(prompt_eval)
+        final = {
+            'model': model, 'done': True, 'done_reason': 'stop',
+            'load_duration': int(load * 1e9),
+            'prompt_eval_count': len(prompt) // 4,
+            'prompt_eval_duration': int(prompt_eval * 1e9),
+            'eval_count': self.fake.tokens,
+        }
+
+        tools = request.get('tools') or []
+        if chat and tools and not any(m.get('role') == 'tool' for m in messages):
+            call = {'function': {'name': tools[0]['function']['name'], 'arguments': {}}}
+            pieces = [{'message': {'role': 'assistant', 'content': '', 'tool_calls': [call]}}]
+        else:
+            words = [_WORDS[i % len(_WORDS)] for i in range(self.fake.tokens)]
+            pieces = [
+                {'message': {'role': 'assistant', 'content': ' ' + word}} if chat else {'response': ' ' + word}
+                for word in words
+            ]
+
+        if not request.get('stream', True):
+            time.sleep(self.fake.token * len(pieces))
+            if chat:
+                message = pieces[0]['message'] if len(pieces) == 1 else {
+                    'role': 'assistant', 'content': ''.join(p['message']['content'] for p in pieces)
+                }
+                return self._reply(200, dict(final, message=message))
+            return self._reply(200, dict(final, response=''.join(p['response'] for p in pieces)))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for piece in pieces:
+            time.sleep(self.fake.token)
+            self._chunk(dict(piece, model=model, done=False))
+        self._chunk(dict(final, message={'role': 'assistant', 'content': ''}) if chat
+                    else dict(final, response=''))
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--load-ms', type=float, default=2000, help='model load time')
+    parser.add_argument('--prompt-ms-per-kchar', type=float, default=20)
+    parser.add_argument('--token-ms', type=float, default=20)
+    parser.add_argument('--tokens', type=int, default=24, help='tokens per answer')
+    opts = parser.parse_args()
+    FakeOllama(opts.load_ms / 1000, opts.prompt_ms_per_kchar / 1000, opts.token_ms / 1000,
+               opts.tokens).serve_forever(opts.host, opts.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Load test of the tool dispatch against the fake Google APIs.
+
+Starts bench/fake_google.py in-process (or uses --api-root), builds the same
+dispatcher the servers use with anonymous credentials, and fires rounds of
+concurrent calls: --duplicates identical "check my inbox" calls plus
+--distinct different reads per round. The fake answers a share of requests
+with 429 (--error-rate). Reports successes, latency percentiles, requests
+that reached the fake, retries, coalesced calls and quota waits as JSON.
+
+    python bench/load.py --rounds 5 --duplicates 10 --distinct 10 --error-rate 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def _counter_total(metric, **match):
+    return sum(
+        value for _, labels, value in metric.samples()
+        if all(labels.get(k) == v for k, v in match.items())
+    )
+
+
+def _calls(round_index, duplicates, distinct):
+    from fake_google import message_id
+
+    calls = [('gmail_list_messages', {'max_results': 10})] * duplicates
+    for i in range(distinct):
+        if i % 2:
+            calls.append(('gmail_read_message', {'message_id': message_id(round_index * distinct + i)}))
+        else:
+            calls.append(('calendar_list_events', {'max_results': 5 + i}))
+    return calls
+
+
+async def _timed(dispatcher, name, arguments):
+    started = time.perf_counter()
+    try:
+        await dispatcher.call(name, arguments)
+        return time.perf_counter() - started, None
+    except Exception as e:
+        return time.perf_counter() - started, e
+
+
+async def run(opts):
+    from google.auth.credentials import AnonymousCredentials
+
+    import metrics
+    from cache import ToolCache
+    from dispatch import ToolDispatcher
+    from executor import GoogleExecutor
+
+    executor = GoogleExecutor(AnonymousCredentials, max_workers=opts.workers)
+    latencies, errors = [], []
+    started = time.perf_counter()
+    for round_index in range(opts.rounds):
+        # A fresh cache per round so every round reaches the API
+        dispatcher = ToolDispatcher(executor, ToolCache() if opts.cache else None)
+        calls = _calls(round_index, opts.duplicates, opts.distinct)
+        for seconds, error in await asyncio.gather(*(_timed(dispatcher, *c) for c in calls)):
+            latencies.append(seconds)
+            if error is not None:
+                errors.append(f'{type(error).__name__}: {error}'[:200])
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'succeeded': len(latencies) - len(errors),
+        'errors': sorted(set(errors)),
+        'elapsed_s': round(elapsed, 3),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'retries': _counter_total(metrics.RETRIES),
+        'coalesced_tool_calls': _counter_total(metrics.COALESCED, level='tool'),
+        'coalesced_http_requests': _counter_total(metrics.COALESCED, level='http'),
+        'quota_wait_s': round(_counter_total(metrics.THROTTLE_SECONDS), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--api-root', help='use an already running fake instead of starting one')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--duplicates', type=int, default=10, help='identical inbox calls per round')
+    parser.add_argument('--distinct', type=int, default=10, help='different reads per round')
+    parser.add_argument('--error-rate', type=float, default=0.2, help='share of 429s from the fake')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--cache', action='store_true', help='put the response cache in front')
+    opts = parser.parse_args()
+
+    fake = None
+    api_root = opts.api_root
+    if api_root is None:
+        from fake_google import FakeGoogle
+        fake = FakeGoogle(latency=opts.latency_ms / 1000, error_rate=opts.error_rate, seed=1)
+        api_root = fake.start()
+    # Read by discovery at import time
+    os.environ['GOOGLE_API_ROOT'] = api_root
+    os.environ.setdefault('GOOGLE_BACKOFF_BASE', '0.05')
+
+    report = asyncio.run(run(opts))
+    if fake is not None:
+        report['api_requests'] = fake.stats()
+        fake.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""How long a change takes to show up in the read tools, polling against push.
+
+Starts the fake Google APIs and src/server_http.py with the calendar store
+and the Gmail mirror on, twice:
+  poll  the snapshots sync when a read finds them older than their interval,
+        and the response cache keeps results for its TTL
+  push  the server watches the calendar and the mailbox, and the fake posts a
+        notification for every change
+Each round adds an event or a message in the fake, as another client would,
+then reads calendar_list_events / gmail_list_messages every --read-ms until
+it appears.
+
+    python bench/push.py --rounds 6 --latency-ms 100
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from fake_google import FakeGoogle  # noqa: E402
+from suite import HttpServer, _setup_dir, free_port  # noqa: E402
+
+TOKEN = 'bench-push'
+# (simulate the change, tool reading it, result field holding the title)
+CHANGES = (
+    ('simulate_event', 'calendar_list_events', 'summary'),
+    ('simulate_message', 'gmail_list_messages', 'subject'),
+)
+
+
+def _call(server, name, arguments):
+    request = urllib.request.Request(
+        server.url + '/call_tool', data=json.dumps({'name': name, 'arguments': arguments}).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return json.load(response)['result']
+
+
+def run(mode, opts):
+    google = FakeGoogle(messages=opts.messages, latency=opts.latency_ms / 1000)
+    google.start()
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory(prefix='bench-push-') as directory:
+        env = dict(
+            os.environ,
+            GOOGLE_TOKEN_DIR=directory,
+            GOOGLE_DISCOVERY_DIR=_setup_dir(google, directory),
+            OLLAMA_WARM_START='0',
+            CALENDAR_STORE='1',
+            GMAIL_MIRROR='1',
+        )
+        if mode == 'push':
+            google.pubsub_push = f'{url}/webhooks/gmail?token={TOKEN}'
+            env.update(PUSH_WEBHOOK_URL=url, PUSH_TOKEN=TOKEN,
+                       GMAIL_PUBSUB_TOPIC='projects/bench/topics/gmail')
+        server = HttpServer(env, port)
+        try:
+            # First reads do the full syncs
+            for _, tool, _ in CHANGES:
+                _call(server, tool, {'max_results': 50})
+            google.reset()
+            delays, reads = [], 0
+            for i in range(opts.rounds):
+                simulate, tool, field = CHANGES[i % len(CHANGES)]
+                title = f'{mode} change {i}'
+                getattr(google, simulate)(title)
+                changed = time.perf_counter()
+                while True:
+                    reads += 1
+                    if any(item[field] == title for item in _call(server, tool, {'max_results': 50})):
+                        break
+                    time.sleep(opts.read_ms / 1000)
+                delays.append(time.perf_counter() - changed)
+        finally:
+            server.stop()
+    requests = sum(n for kind, n in google.stats().items() if kind != 'POST batch')
+    return {
+        'visible_p50_ms': round(statistics.median(delays) * 1000, 1),
+        'visible_max_ms': round(max(delays) * 1000, 1),
+        'reads': reads,
+        # Syncs as well as reads: what keeping up with one change costs
+        'google_requests_per_change': round(requests / opts.rounds, 2),
+        'notifications': dict(google.notifications),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=6)
+    parser.add_argument('--read-ms', type=float, default=250, help='pause between reads')
+    parser.add_argument('--messages', type=int, default=1000, help='seeded mailbox size')
+    parser.add_argument('--latency-ms', type=float, default=100, help='fake Google API latency')
+    parser.add_argument('--modes', default='poll,push')
+    opts = parser.parse_args()
+    report = {'config': vars(opts)}
+    for mode in opts.modes.split(','):
+        report[mode] = run(mode, opts)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
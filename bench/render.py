@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Prompt-size benchmark for the result formats in src/render.py.
+
+Renders sample calendar and Gmail listings (or a saved tool result) in every
+format and reports characters and estimated tokens. With --ollama it also
+sends the chat interface's prompt to Ollama for each format and reports the
+tokens Ollama evaluated, its prompt evaluation time and the time to the first
+streamed token. Output is JSON on stdout.
+
+    python bench/render.py --ollama --model llama3.2:3b --max-tokens 800
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from render import FORMATS, estimate_tokens, render  # noqa: E402
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. Today is 2026-03-02. When given calendar or email "
+    "data, provide a clear, natural summary. Don't write code. Just answer the "
+    "question based on the data."
+)
+
+
+def sample_results(count):
+    events = [{
+        'id': f'evt{i:04d}abcdefghijklmnop',
+        'summary': f'Project sync #{i} with the platform team',
+        'start': f'2026-03-{2 + i // 4:02d}T{9 + i % 4 * 2:02d}:00:00+01:00',
+        'end': f'2026-03-{2 + i // 4:02d}T{10 + i % 4 * 2:02d}:00:00+01:00'
+    } for i in range(count)]
+    messages = [{
+        'id': f'18e{i:013x}',
+        'from': f'Person {i} <person{i}@example.com>',
+        'subject': f'Re: Quarterly planning, item {i}',
+        'date': f'Mon, {2 + i % 20} Mar 2026 0{i % 10}:15:00 +0100'
+    } for i in range(count)]
+    return {
+        ("What's on my calendar?", 'calendar_list_events'): events,
+        ('Show me my recent emails', 'gmail_list_messages'): messages,
+    }
+
+
+def _post(url, body):
+    return urllib.request.urlopen(urllib.request.Request(
+        url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'}
+    ))
+
+
+def ollama_timing(url, model, prompt):
+    """Prompt tokens, prompt eval seconds and time to first token for one prompt"""
+    started = time.perf_counter()
+    first_token = None
+    final = {}
+    with _post(f'{url}/api/generate', {
+        'model': model, 'prompt': prompt, 'stream': True, 'options': {'num_predict': 16}
+    }) as response:
+        for line in response:
+            chunk = json.loads(line)
+            if first_token is None and chunk.get('response'):
+                first_token = time.perf_counter() - started
+            if chunk.get('done'):
+                final = chunk
+    return {
+        'prompt_eval_count': final.get('prompt_eval_count'),
+        'prompt_eval_s': round(final.get('prompt_eval_duration', 0) / 1e9, 4),
+        'first_token_s': round(first_token, 4) if first_token is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=10, help='items per sample listing')
+    parser.add_argument('--result', help='JSON file with a saved tool result to use instead')
+    parser.add_argument('--max-tokens', type=int, help='token budget passed to render()')
+    parser.add_argument('--ollama', action='store_true', help='also time prompt evaluation')
+    parser.add_argument('--ollama-url', default='http://localhost:11434')
+    parser.add_argument('--model', default='llama3.2:3b')
+    opts = parser.parse_args()
+
+    if opts.result:
+        with open(opts.result, encoding='utf-8') as f:
+            samples = {('Summarize this data', os.path.basename(opts.result)): json.load(f)}
+    else:
+        samples = sample_results(opts.items)
+
+    report = []
+    for (question, source), result in samples.items():
+        for fmt in FORMATS:
+            text = render(result, fmt, opts.max_tokens)
+            row = {
+                'source': source,
+                'format': fmt,
+                'chars': len(text),
+                'estimated_tokens': estimate_tokens(text),
+            }
+            if opts.ollama:
+                prompt = (f"{SYSTEM_PROMPT}\n\nUser: {question}\n\n"
+                          f"Here is the relevant data:\n{text}\n\nAssistant:")
+                row.update(ollama_timing(opts.ollama_url, opts.model, prompt))
+            report.append(row)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Cold-start benchmark for the MCP stdio server.
+
+Spawns src/server.py the way an MCP client does, speaks JSON-RPC over its
+stdin/stdout and reports, per run and as medians, the time from spawn to the
+initialize response, the tools/list response and the first tools/call
+result. Output is JSON on stdout.
+
+    python bench/startup.py --runs 5 --tool calendar_list_events --args '{"max_results": 5}'
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'server.py')
+
+
+def _rpc(proc, message_id, method, params=None):
+    message = {'jsonrpc': '2.0', 'method': method}
+    if message_id is not None:
+        message['id'] = message_id
+    if params is not None:
+        message['params'] = params
+    proc.stdin.write(json.dumps(message) + '\n')
+    proc.stdin.flush()
+    if message_id is None:
+        return None
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"server exited while waiting for {method}")
+        reply = json.loads(line)
+        if reply.get('id') == message_id:
+            return reply
+
+
+def run_once(tool, arguments):
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, SERVER], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, text=True, bufsize=1
+    )
+    try:
+        _rpc(proc, 1, 'initialize', {
+            'protocolVersion': '2024-11-05',
+            'capabilities': {},
+            'clientInfo': {'name': 'startup-bench', 'version': '1.0'}
+        })
+        initialized = time.perf_counter() - start
+        _rpc(proc, None, 'notifications/initialized')
+        _rpc(proc, 2, 'tools/list')
+        listed = time.perf_counter() - start
+        reply = _rpc(proc, 3, 'tools/call', {'name': tool, 'arguments': arguments})
+        called = time.perf_counter() - start
+        text = reply.get('result', {}).get('content', [{}])[0].get('text', '')
+        return {
+            'initialize_s': round(initialized, 4),
+            'list_tools_s': round(listed, 4),
+            'first_tool_result_s': round(called, 4),
+            'tool_error': text.startswith('Error:') or 'error' in reply,
+        }
+    finally:
+        proc.stdin.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--tool', default='calendar_list_events')
+    parser.add_argument('--args', default='{"max_results": 5}', help='tool arguments as JSON')
+    opts = parser.parse_args()
+
+    runs = [run_once(opts.tool, json.loads(opts.args)) for _ in range(opts.runs)]
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 4)
+        for key in ('initialize_s', 'list_tools_s', 'first_tool_result_s')
+    }
+    print(json.dumps({'tool': opts.tool, 'runs': runs, 'median': summary}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
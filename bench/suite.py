@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""Offline benchmark of every tool through both servers.
+
+Starts bench/fake_google.py in-process with a seeded mailbox, gives the
+servers a fake token and the fake's discovery documents (through
+GOOGLE_TOKEN_DIR and GOOGLE_DISCOVERY_DIR, the same way a real install
+loads them), then for each transport and tool spawns a fresh server:
+src/server.py spoken to over MCP stdio, or src/server_http.py under uvicorn.
+After one warm-up call it makes --calls calls, --concurrency at a time, and
+records:
+
+- p50/p95/p99 latency and throughput
+- HTTP round trips the fake received per call, with a breakdown
+- the server process's peak RSS (VmHWM)
+
+Every server gets a token directory of its own, so one run's outbox is not
+drained by the next. The bulk tools answer once their items are queued, so
+their latency is the acknowledgement; the run then waits for the outbox to
+write every item to the fake, and reports how fast it drained along with
+the round trips the sends took.
+
+The servers pace requests to Google's quotas as usual, which bounds the
+throughput of the write tools; set GMAIL_QUOTA_UNITS_PER_SECOND=0 and
+CALENDAR_REQUESTS_PER_SECOND=0 to lift that. The report is JSON with the
+commit it was taken at. Pass an earlier report as --compare to get per-tool
+changes in the same file:
+
+    python bench/suite.py --messages 100000 --latency-ms 30 --output bench.json
+    python bench/suite.py --compare bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import pickle
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from fake_google import (  # noqa: E402
+    ATTACHMENT_EVERY, FakeGoogle, attachment_id, message_id, thread_id
+)
+
+TRANSPORTS = ('stdio', 'http')
+# Tool -> arguments of its i-th call; distinct, so concurrent calls aren't coalesced
+TOOL_ARGUMENTS = {
+    'calendar_list_events': lambda i: {'max_results': 5 + i % 40},
+    'gmail_list_messages': lambda i: {'max_results': 5 + i % 40},
+    'gmail_read_message': lambda i: {'message_id': message_id(i)},
+    'gmail_list_threads': lambda i: {'max_results': 5 + i % 40},
+    'gmail_read_thread': lambda i: {'thread_id': thread_id(i)},
+    'gmail_get_attachment': lambda i: {
+        'message_id': message_id(i * ATTACHMENT_EVERY),
+        'attachment_id': attachment_id(i * ATTACHMENT_EVERY),
+    },
+    'calendar_create_event': lambda i: {
+        'summary': f'Benchmark {i}',
+        'start_time': '2026-03-02T10:00:00Z',
+        'end_time': '2026-03-02T11:00:00Z',
+    },
+    'gmail_send_message': lambda i: {
+        'to': 'someone@example.com', 'subject': f'Benchmark {i}', 'body': 'Hello',
+    },
+    # Fresh idempotency keys, so every call queues new items
+    'calendar_create_events': lambda i: {'events': [
+        dict(TOOL_ARGUMENTS['calendar_create_event'](i), idempotency_key=uuid.uuid4().hex)
+        for _ in range(BULK_ITEMS)
+    ]},
+    'gmail_send_messages': lambda i: {'messages': [
+        dict(TOOL_ARGUMENTS['gmail_send_message'](i), idempotency_key=uuid.uuid4().hex)
+        for _ in range(BULK_ITEMS)
+    ]},
+}
+# Bulk tool -> items the fake has written for it so far
+WRITTEN = {
+    'calendar_create_events': lambda fake: len(fake.created_events),
+    'gmail_send_messages': lambda fake: len(fake.sent),
+}
+BULK_ITEMS = 10
+DISCOVERY_APIS = (('calendar', 'v3'), ('gmail', 'v1'))
+# Metrics where a lower value is better
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'round_trips_per_call', 'peak_rss_mb')
+
+
+# -- servers ------------------------------------------------------------------
+
+def _peak_rss_mb(pid):
+    """Peak resident set size of a running process, Linux only"""
+    try:
+        with open(f'/proc/{pid}/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+class StdioServer:
+    """src/server.py spoken to over MCP stdio, with concurrent requests"""
+
+    def __init__(self, env):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'server.py')], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1, env=env
+        )
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read, daemon=True).start()
+        self._request('initialize', {
+            'protocolVersion': '2024-11-05',
+            'capabilities': {},
+            'clientInfo': {'name': 'bench-suite', 'version': '1.0'}
+        }).result(timeout=60)
+        self._send({'jsonrpc': '2.0', 'method': 'notifications/initialized'})
+
+    def _send(self, message):
+        with self._lock:
+            self.proc.stdin.write(json.dumps(message) + '\n')
+            self.proc.stdin.flush()
+
+    def _request(self, method, params):
+        message_id = next(self._ids)
+        future = self._pending[message_id] = Future()
+        self._send({'jsonrpc': '2.0', 'id': message_id, 'method': method, 'params': params})
+        return future
+
+    def _read(self):
+        for line in self.proc.stdout:
+            reply = json.loads(line)
+            future = self._pending.pop(reply.get('id'), None)
+            if future is not None:
+                future.set_result(reply)
+        for future in self._pending.values():
+            future.set_exception(RuntimeError('server exited'))
+
+    def call(self, name, arguments):
+        """True if the call succeeded"""
+        reply = self._request('tools/call', {'name': name, 'arguments': arguments}).result(timeout=120)
+        result = reply.get('result') or {}
+        text = (result.get('content') or [{}])[0].get('text', '')
+        return 'error' not in reply and not result.get('isError') and not text.startswith('Error:')
+
+    def stop(self):
+        self.proc.stdin.close()
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class HttpServer:
+    """src/server_http.py under uvicorn on a free port"""
+
+    def __init__(self, env, port=None):
+        if port is None:
+            port = free_port()
+        self.url = f'http://127.0.0.1:{port}'
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'server_http:app', '--host', '127.0.0.1',
+             '--port', str(port), '--log-level', 'warning'],
+            cwd=SRC, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env
+        )
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                urllib.request.urlopen(self.url + '/', timeout=1).close()
+                return
+            except OSError:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('server_http did not start')
+                time.sleep(0.05)
+
+    def call(self, name, arguments):
+        request = urllib.request.Request(
+            self.url + '/call_tool', data=json.dumps({'name': name, 'arguments': arguments}).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return json.load(response).get('error') is None
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+SERVERS = {'stdio': StdioServer, 'http': HttpServer}
+
+
+# -- measurement --------------------------------------------------------------
+
+def _setup_dir(fake, directory):
+    """Fake token and the fake's discovery documents, as the servers expect them"""
+    from google.oauth2.credentials import Credentials
+
+    # No expiry: never refreshed, so the servers never reach Google
+    with open(os.path.join(directory, 'token.pickle'), 'wb') as f:
+        pickle.dump(Credentials(token='bench-token'), f)
+    discovery_dir = os.path.join(directory, 'discovery')
+    os.makedirs(discovery_dir)
+    for api, version in DISCOVERY_APIS:
+        url = f'{fake.root}discovery/v1/apis/{api}/{version}/rest'
+        with urllib.request.urlopen(url) as response, \
+                open(os.path.join(discovery_dir, f'{api}.{version}.json'), 'wb') as f:
+            f.write(response.read())
+    return discovery_dir
+
+
+def _percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def _timed_call(server, name, arguments):
+    started = time.perf_counter()
+    try:
+        ok = server.call(name, arguments)
+    except Exception:
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def _drain(fake, tool, items, timeout=600):
+    """Wait until the fake has written `items` for a bulk tool; False on timeout"""
+    deadline = time.monotonic() + timeout
+    while WRITTEN[tool](fake) < items:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def bench_tool(transport, tool, fake, env, calls, concurrency):
+    with tempfile.TemporaryDirectory(prefix='bench-run-') as directory:
+        # Its own outbox, snapshots and token, next to the shared discovery documents
+        shutil.copy(os.path.join(env['GOOGLE_TOKEN_DIR'], 'token.pickle'), directory)
+        return _bench_server(transport, tool, fake, dict(env, GOOGLE_TOKEN_DIR=directory),
+                             calls, concurrency)
+
+
+def _bench_server(transport, tool, fake, env, calls, concurrency):
+    bulk = tool in WRITTEN
+    drain = {}
+    server = SERVERS[transport](env)
+    try:
+        # Token, discovery documents and the first worker's services load here
+        written = WRITTEN[tool](fake) if bulk else 0
+        _timed_call(server, tool, TOOL_ARGUMENTS[tool](calls))
+        if bulk:
+            _drain(fake, tool, written + BULK_ITEMS)
+            written = WRITTEN[tool](fake)
+        fake.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(
+                lambda i: _timed_call(server, tool, TOOL_ARGUMENTS[tool](i)), range(calls)
+            ))
+        elapsed = time.perf_counter() - started
+        if bulk:
+            items = calls * BULK_ITEMS
+            drained = _drain(fake, tool, written + items)
+            drain_elapsed = time.perf_counter() - started
+            drain = {
+                'items_written': WRITTEN[tool](fake) - written,
+                # From the first call to the last item written, queueing included
+                'drain_s': round(drain_elapsed, 2) if drained else None,
+                'drain_items_per_s': round(items / drain_elapsed, 2) if drained else None,
+            }
+        requests = fake.stats()
+        peak_rss = _peak_rss_mb(server.proc.pid)
+    finally:
+        server.stop()
+
+    latencies = sorted(seconds for seconds, _ in outcomes)
+    round_trips = sum(count for kind, count in requests.items()
+                      if not kind.startswith('injected') and not kind.endswith('(batched)'))
+    return {
+        'transport': transport,
+        'tool': tool,
+        'calls': calls,
+        'errors': sum(1 for _, ok in outcomes if not ok),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'throughput_per_s': round(calls / elapsed, 2),
+        'round_trips_per_call': round(round_trips / calls, 2),
+        'api_requests': requests,
+        'peak_rss_mb': peak_rss,
+        **drain,
+    }
+
+
+def compare(baseline, report):
+    """Relative change of each metric against an earlier report, per tool"""
+    before = {(row['transport'], row['tool']): row for row in baseline['results']}
+    changes = []
+    for row in report['results']:
+        old = before.get((row['transport'], row['tool']))
+        if old is None:
+            continue
+        change = {'transport': row['transport'], 'tool': row['tool']}
+        for key in LOWER_IS_BETTER + ('throughput_per_s', 'drain_items_per_s'):
+            if old.get(key) and row.get(key) is not None:
+                change[key + '_change_pct'] = round((row[key] - old[key]) / old[key] * 100, 1)
+        changes.append(change)
+    return {'commit': baseline.get('commit'), 'changes': changes}
+
+
+def _commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    cwd=ROOT, capture_output=True, text=True).stdout.strip())
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--transports', default=','.join(TRANSPORTS))
+    parser.add_argument('--tools', default=','.join(TOOL_ARGUMENTS))
+    parser.add_argument('--calls', type=int, default=50, help='measured calls per tool')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=1000, help='seeded mailbox size')
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20, help='fake API latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of 429s')
+    parser.add_argument('--server-error-rate', type=float, default=0, help='share of 503s')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--output', help='write the report here instead of stdout')
+    parser.add_argument('--compare', help='earlier report to compare against')
+    opts = parser.parse_args()
+
+    fake = FakeGoogle(opts.messages, opts.events, opts.latency_ms / 1000,
+                      opts.error_rate, opts.server_error_rate)
+    fake.start()
+    with tempfile.TemporaryDirectory(prefix='bench-suite-') as directory:
+        env = dict(
+            os.environ,
+            GOOGLE_TOKEN_DIR=directory,
+            GOOGLE_DISCOVERY_DIR=_setup_dir(fake, directory),
+            GMAIL_ATTACHMENT_DIR=os.path.join(directory, 'attachments'),
+            TOOL_CACHE='1' if opts.cache else '0',
+            PYTHONUNBUFFERED='1',
+        )
+        env.pop('GOOGLE_API_ROOT', None)
+        results = [
+            bench_tool(transport, tool, fake, env, opts.calls, opts.concurrency)
+            for transport in opts.transports.split(',')
+            for tool in opts.tools.split(',')
+        ]
+    fake.stop()
+
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(opts).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    if opts.compare:
+        with open(opts.compare, encoding='utf-8') as f:
+            report['comparison'] = compare(json.load(f), report)
+    text = json.dumps(report, indent=2)
+    if opts.output:
+        with open(opts.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,8 +27,8 @@ pip install -r requirements.txt
 echo ""
 echo "🔐 Starting authentication flow..."
 echo "A browser window will open for you to authorize the app"
-python3 -c "
-from src.server import get_google_creds
+PYTHONPATH=src python3 -c "
+from server import get_google_creds
 print('Authenticating...')
 get_google_creds()
 print('✓ Authentication successful!')
@@ -0,0 +1,192 @@
+"""Per-account credentials, so one server process can serve a team.
+
+Each call runs as an account, held in a context variable. The HTTP server sets
+it from the X-Account header, and the MCP server from the "account" tool
+argument. GOOGLE_ACCOUNT names the default account; without it the default
+is the one in token.pickle. Account <name> uses token-<name>.pickle in the
+token directory, created with `python src/accounts.py --authorize <name>`.
+
+Worker threads keep a single service pair and HTTP transport each, shared by
+all accounts: AccountCredentials puts the current account's token on every
+request. A new account therefore costs only a credential load, and AccountPool
+keeps those in an LRU of GOOGLE_MAX_ACCOUNTS entries, dropping accounts idle
+for GOOGLE_ACCOUNT_IDLE_SECONDS.
+"""
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from credential_manager import CredentialManager, default_token_dir
+
+SCOPES = [
+    'https://www.googleapis.com/auth/calendar',
+    'https://www.googleapis.com/auth/gmail.modify'
+]
+
+DEFAULT_ACCOUNT = os.environ.get('GOOGLE_ACCOUNT') or None
+MAX_ACCOUNTS = int(os.environ.get('GOOGLE_MAX_ACCOUNTS', '32'))
+IDLE_SECONDS = float(os.environ.get('GOOGLE_ACCOUNT_IDLE_SECONDS', '900'))
+
+# Account names end up in file names, so keep them to a safe alphabet
+ACCOUNT_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._@+-]{0,127}$')
+
+current_account = contextvars.ContextVar('account', default=None)
+
+
+def validate(account):
+    """account, or ValueError if it is not a usable account name"""
+    if not isinstance(account, str) or not ACCOUNT_NAME.match(account):
+        raise ValueError(f"Invalid account name: {account!r}")
+    return account
+
+
+def active_account():
+    """The account the current call runs as; None for token.pickle"""
+    return current_account.get() or DEFAULT_ACCOUNT
+
+
+def is_default():
+    """True unless the call selected an account other than the default"""
+    return current_account.get() in (None, DEFAULT_ACCOUNT)
+
+
+def token_path(token_dir, account):
+    name = 'token.pickle' if account is None else f'token-{account}.pickle'
+    return os.path.join(token_dir, name)
+
+
+class AccountCredentials:
+    """Credentials facade that acts as whichever account the call runs as.
+
+    Offers the same interface as ManagedCredentials, which AuthorizedHttp,
+    AuthorizedSession and googleapiclient's batch requests use.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def _managed(self):
+        return self._pool.managed(active_account())
+
+    @property
+    def access_token(self):
+        return self._managed().access_token
+
+    @property
+    def access_token_expired(self):
+        return self._managed().access_token_expired
+
+    def apply(self, headers, token=None):
+        self._managed().apply(headers, token=token)
+
+    def before_request(self, request, method, url, headers):
+        self._managed().before_request(request, method, url, headers)
+
+    def refresh(self, request):
+        self._managed().refresh(request)
+
+
+class AccountPool:
+    """CredentialManagers by account, least recently used evicted first"""
+
+    def __init__(self, token_dir, client_secrets_path, scopes,
+                 max_accounts=None, idle_seconds=None, clock=time.monotonic, interactive=False):
+        self.token_dir = token_dir
+        self.client_secrets_path = client_secrets_path
+        self.scopes = scopes
+        # A token that cannot be loaded or refreshed opens the browser sign-in
+        # (stdio server, run by the user) or raises (the headless HTTP server)
+        self.interactive = interactive
+        self.max_accounts = max_accounts or MAX_ACCOUNTS
+        self.idle_seconds = IDLE_SECONDS if idle_seconds is None else idle_seconds
+        self.credentials = AccountCredentials(self)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # account -> [manager, last use], least recently used first
+        self._managers = OrderedDict()
+        self.evictions = 0
+
+    def manager(self, account=None):
+        with self._lock:
+            now = self._clock()
+            self._drop_idle(now)
+            entry = self._managers.get(account)
+            if entry is None:
+                entry = self._managers[account] = [self._open(account), now]
+                while len(self._managers) > self.max_accounts:
+                    _, (evicted, _) = self._managers.popitem(last=False)
+                    evicted.stop()
+                    self.evictions += 1
+            else:
+                entry[1] = now
+                self._managers.move_to_end(account)
+            return entry[0]
+
+    def _open(self, account):
+        path = token_path(self.token_dir, account)
+        if account is not None and not os.path.exists(path):
+            raise RuntimeError(
+                f"No token for account {account}; run "
+                f"`python src/accounts.py --authorize {account}` first"
+            )
+        return CredentialManager(path, self.client_secrets_path, self.scopes,
+                                 interactive=self.interactive)
+
+    def _drop_idle(self, now):
+        while self._managers:
+            account, (manager, last_use) = next(iter(self._managers.items()))
+            if now - last_use < self.idle_seconds:
+                return
+            del self._managers[account]
+            manager.stop()
+            self.evictions += 1
+
+    def managed(self, account=None):
+        return self.manager(account).managed
+
+    def get(self, account=None):
+        """Valid credentials of account, loading its token if needed"""
+        return self.manager(account).get()
+
+    def authorized(self):
+        """Credentials for the HTTP transports, resolved per request.
+
+        Loads the default account's token first when it is saved, so warming
+        up a worker still takes the token load off the first call.
+        """
+        if os.path.exists(token_path(self.token_dir, DEFAULT_ACCOUNT)):
+            self.get(DEFAULT_ACCOUNT)
+        return self.credentials
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accounts': len(self._managers),
+                'max_accounts': self.max_accounts,
+                'evictions': self.evictions,
+            }
+
+    def stop(self):
+        with self._lock:
+            for manager, _ in self._managers.values():
+                manager.stop()
+            self._managers.clear()
+
+
+def authorize(token_dir, account=None):
+    """Load account's token, running the browser sign-in if needed; returns its path"""
+    path = token_path(token_dir, account)
+    CredentialManager(
+        path, os.path.join(token_dir, 'credentials.json'), SCOPES, background_refresh=False
+    ).get()
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != '--authorize':
+        sys.exit("usage: python src/accounts.py --authorize ACCOUNT")
+    print(f"Saved {authorize(default_token_dir(), validate(sys.argv[2]))}")
@@ -0,0 +1,176 @@
+"""Streaming Gmail attachment downloads.
+
+attachments.get answers {"data": "<base64url>"}, which googleapiclient would
+read, parse and decode whole. Here the response is streamed instead: the
+base64 text is decoded a chunk at a time into a SpooledTemporaryFile (in
+memory while small, on disk after that) and only copied to the download
+directory once it is complete. Files already there are never replaced: a
+name that is taken gets a numbered suffix instead.
+"""
+import base64
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+import metrics
+import payload
+from accounts import active_account
+from scheduler import shared as scheduler
+
+ATTACHMENT_DIR = os.environ.get('GMAIL_ATTACHMENT_DIR') or os.path.join(
+    tempfile.gettempdir(), 'gmail-attachments'
+)
+MAX_ATTACHMENT_BYTES = int(os.environ.get('GMAIL_MAX_ATTACHMENT_BYTES', str(50 * 1024 * 1024)))
+# Attachments up to this size never touch the disk before the final copy
+SPOOL_MAX_BYTES = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_DATA_START = re.compile(rb'"data"\s*:\s*"')
+_local = threading.local()
+
+
+def _session(credentials):
+    """An AuthorizedSession for the current thread, sharing credentials"""
+    from google.auth.transport.requests import AuthorizedSession
+
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    key = id(credentials)
+    if key not in sessions:
+        sessions[key] = AuthorizedSession(credentials)
+    return sessions[key]
+
+
+def _account_dir():
+    """ATTACHMENT_DIR, or its subfolder for an account other than token.pickle's"""
+    account = active_account()
+    return ATTACHMENT_DIR if account is None else os.path.join(ATTACHMENT_DIR, account)
+
+
+def _http_error(response):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    resp = httplib2.Response({'status': response.status_code, **response.headers})
+    return HttpError(resp, response.content, uri=response.url)
+
+
+def iter_base64_field(chunks):
+    """Yield the raw text of the JSON "data" string from streamed byte chunks.
+
+    base64url never needs JSON escaping, so the string ends at the next quote.
+    """
+    buffer = b''
+    chunks = iter(chunks)
+    for chunk in chunks:
+        buffer += chunk
+        match = _DATA_START.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+    else:
+        raise ValueError("Attachment response has no data")
+
+    while True:
+        end = buffer.find(b'"')
+        if end >= 0:
+            yield buffer[:end]
+            return
+        yield buffer
+        buffer = next(chunks, None)
+        if buffer is None:
+            raise ValueError("Attachment response ended early")
+
+
+def decode_to_file(pieces, out, max_bytes=None):
+    """Decode streamed base64url text into out; returns the decoded size"""
+    size, pending = 0, b''
+    for piece in pieces:
+        pending += piece
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            decoded = base64.urlsafe_b64decode(pending[:usable])
+            pending = pending[usable:]
+            size += len(decoded)
+            if max_bytes is not None and size > max_bytes:
+                raise ValueError(f"Attachment is larger than {max_bytes} bytes")
+            out.write(decoded)
+    if pending.rstrip(b'='):
+        decoded = base64.urlsafe_b64decode(pending + b'=' * (-len(pending) % 4))
+        size += len(decoded)
+        out.write(decoded)
+    return size
+
+
+def safe_filename(name, fallback):
+    name = os.path.basename((name or '').replace('\\', '/')).strip()
+    name = re.sub(r'[\x00-\x1f]', '', name).lstrip('.')
+    return name or fallback
+
+
+def _create_exclusive(target_dir, filename):
+    """(path, file) for a new file named filename, or name-1.ext, name-2.ext... if taken"""
+    stem, ext = os.path.splitext(filename)
+    candidate, n = filename, 0
+    while True:
+        path = os.path.join(target_dir, candidate)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0))
+        except FileExistsError:
+            n += 1
+            candidate = f'{stem}-{n}{ext}'
+            continue
+        return path, os.fdopen(fd, 'wb')
+
+
+def download_attachment(gmail_service, message_id, attachment_id, filename=None, directory=None):
+    """Save one attachment under directory/<message_id>/ and describe the file"""
+    request = gmail_service.users().messages().attachments().get(
+        userId='me', messageId=message_id, id=attachment_id, fields='data'
+    )
+    credentials = getattr(request.http, 'credentials', None)
+    timeout = getattr(request.http, 'timeout', None)
+
+    started = time.perf_counter()
+    # Not through httplib2, so the quota and retries are applied here
+    response = scheduler.streamed_get(request.uri, lambda: _session(credentials).get(
+        request.uri, stream=True, timeout=timeout,
+        # Google only compresses for user agents that mention gzip
+        headers={'accept-encoding': 'gzip', 'user-agent': 'google-services-mcp (gzip)'}
+    ))
+    try:
+        if response.status_code >= 300:
+            metrics.record_api_call(
+                'GET', request.uri, response.status_code, time.perf_counter() - started, 0
+            )
+            raise _http_error(response)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+            size = decode_to_file(
+                iter_base64_field(response.iter_content(CHUNK_SIZE)), spool, MAX_ATTACHMENT_BYTES
+            )
+            payload.stats.record_response(size, response.headers.get('content-encoding') == 'gzip')
+            metrics.record_api_call(
+                'GET', request.uri, response.status_code, time.perf_counter() - started, size
+            )
+
+            target_dir = os.path.join(directory or _account_dir(), safe_filename(message_id, 'message'))
+            os.makedirs(target_dir, exist_ok=True)
+            # Unnamed attachments of one message must not share a name
+            fallback = 'attachment-' + hashlib.sha256(attachment_id.encode()).hexdigest()[:12]
+            spool.seek(0)
+            path, out = _create_exclusive(target_dir, safe_filename(filename, fallback))
+            try:
+                with out:
+                    shutil.copyfileobj(spool, out, CHUNK_SIZE)
+            except BaseException:
+                os.unlink(path)
+                raise
+    finally:
+        response.close()
+
+    return {'path': path, 'filename': os.path.basename(path), 'size': size}
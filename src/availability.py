@@ -0,0 +1,213 @@
+"""Free time of one or more people, from freebusy.query.
+
+Google returns each calendar's busy periods already sorted and merged, so
+the work here is interval algebra over sorted lists: heapq.merge walks all
+participants' busy periods in start order and folds overlaps into one busy
+timeline (O(n log k) for n periods over k calendars), which is then inverted
+and intersected with the working-hours windows in a single linear pass.
+Working hours are laid out per local date with zoneinfo, so days that change
+to or from daylight saving time keep the right wall-clock hours.
+
+freebusy.query takes at most FREEBUSY_MAX_CALENDARS calendars per request;
+larger groups are split and the requests sent concurrently.
+"""
+import heapq
+import os
+import re
+from datetime import datetime, time as dtime, timedelta, timezone
+
+from calendar_store import parse_time
+from calendars import list_calendars
+from pagination import execute_all
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+DEFAULT_WORKING_HOURS = os.environ.get('FREE_SLOTS_WORKING_HOURS', '09:00-17:00')
+DEFAULT_DAYS = int(os.environ.get('FREE_SLOTS_DAYS', '7'))
+# Longest range one call may cover
+MAX_DAYS = 62
+FREEBUSY_MAX_CALENDARS = 50
+FREEBUSY_FIELDS = 'calendars'
+
+_HOURS = re.compile(r'^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})$')
+
+
+def parse_working_hours(value):
+    """(start, end) times of day for "HH:MM-HH:MM"; "24:00" ends at midnight"""
+    match = _HOURS.match(value.strip()) if isinstance(value, str) else None
+    if not match:
+        raise ValueError(f"working_hours must look like 09:00-17:00, not {value!r}")
+    h1, m1, h2, m2 = (int(g) for g in match.groups())
+    if h1 > 23 or m1 > 59 or m2 > 59 or h2 > 24 or (h2 == 24 and m2):
+        raise ValueError(f"Invalid working_hours: {value!r}")
+    start = timedelta(hours=h1, minutes=m1)
+    end = timedelta(hours=h2, minutes=m2)
+    if end <= start:
+        raise ValueError(f"working_hours must end after they start: {value!r}")
+    return start, end
+
+
+def get_zone(name):
+    if name in (None, '', 'UTC', 'Z'):
+        return timezone.utc
+    if ZoneInfo is None:
+        raise ValueError("Time zones other than UTC need Python 3.9+")
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        raise ValueError(f"Unknown time zone: {name!r}") from None
+
+
+def merge_busy(busy_lists):
+    """Union of several sorted interval lists, as one sorted disjoint list"""
+    merged = []
+    for start, end in heapq.merge(*busy_lists):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def working_windows(lo, hi, tz, hours, weekends=False):
+    """[start, end) timestamps of the working hours between lo and hi"""
+    day_start, day_end = hours
+    day = datetime.fromtimestamp(lo, tz).date()
+    last = datetime.fromtimestamp(hi, tz).date()
+    windows = []
+    while day <= last:
+        if weekends or day.weekday() < 5:
+            midnight = datetime.combine(day, dtime())
+            # Wall-clock times, so 09:00 stays 09:00 across DST changes
+            start = (midnight + day_start).replace(tzinfo=tz).timestamp()
+            end = (midnight + day_end).replace(tzinfo=tz).timestamp()
+            start, end = max(start, lo), min(end, hi)
+            if start < end:
+                windows.append((start, end))
+        day += timedelta(days=1)
+    return windows
+
+
+def free_slots(busy, windows, min_seconds):
+    """Gaps of at least min_seconds in windows not covered by busy.
+
+    Both lists are sorted and disjoint, so one pass over each suffices.
+    """
+    slots = []
+    i = 0
+    for start, end in windows:
+        # Busy periods that ended before this window are done with
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        cursor = start
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] - cursor >= min_seconds:
+                slots.append((cursor, busy[j][0]))
+            cursor = max(cursor, busy[j][1])
+            j += 1
+        if end - cursor >= min_seconds:
+            slots.append((cursor, end))
+    return slots
+
+
+def query_busy(calendar_service, calendar_ids, time_min, time_max):
+    """({calendar_id: sorted [start, end] timestamps}, {calendar_id: reason})
+
+    Calendars Google cannot report on (unknown address, not shared) are
+    returned with the error reason instead of busy periods.
+    """
+    groups = [
+        calendar_ids[i:i + FREEBUSY_MAX_CALENDARS]
+        for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS)
+    ]
+    responses = execute_all([
+        calendar_service.freebusy().query(
+            body={
+                'timeMin': time_min,
+                'timeMax': time_max,
+                'items': [{'id': calendar_id} for calendar_id in group],
+            },
+            fields=FREEBUSY_FIELDS
+        )
+        for group in groups
+    ])
+    busy, errors = {}, {}
+    for response in responses:
+        if isinstance(response, Exception):
+            raise response
+        for calendar_id, entry in response.get('calendars', {}).items():
+            if entry.get('errors'):
+                errors[calendar_id] = entry['errors'][0].get('reason', 'unknown')
+                continue
+            busy[calendar_id] = sorted(
+                (parse_time(period['start']).timestamp(), parse_time(period['end']).timestamp())
+                for period in entry.get('busy', [])
+            )
+    return busy, errors
+
+
+def primary_time_zone(calendar_service):
+    for entry in list_calendars(calendar_service):
+        if entry.get('primary'):
+            return entry.get('timeZone')
+    return None
+
+
+def find_free_slots(calendar_service, calendars, time_min, time_max, duration_minutes,
+                    working_hours=None, time_zone=None, weekends=False, max_results=10):
+    """Common free slots of calendars, as a dict with slots and unavailable calendars"""
+    if isinstance(calendars, str):
+        calendars = [calendars]
+    if not isinstance(calendars, list) or not calendars or \
+            not all(isinstance(c, str) and c for c in calendars):
+        raise ValueError("calendars must be a list of calendar IDs or email addresses")
+    calendars = list(dict.fromkeys(calendars))
+    min_seconds = float(duration_minutes) * 60
+    if min_seconds <= 0:
+        raise ValueError("duration_minutes must be positive")
+    hours = parse_working_hours(working_hours or DEFAULT_WORKING_HOURS)
+    tz = get_zone(time_zone or primary_time_zone(calendar_service))
+
+    lo = parse_time(time_min, tz).timestamp()
+    hi = parse_time(time_max, tz).timestamp() if time_max else lo + DEFAULT_DAYS * 86400
+    if hi <= lo:
+        raise ValueError("time_max must be after time_min")
+    if hi - lo > MAX_DAYS * 86400:
+        raise ValueError(f"The range may cover at most {MAX_DAYS} days")
+
+    busy, errors = query_busy(
+        calendar_service, calendars,
+        datetime.fromtimestamp(lo, timezone.utc).isoformat(),
+        datetime.fromtimestamp(hi, timezone.utc).isoformat()
+    )
+    if errors and not busy:
+        raise ValueError("No calendar could be read: " + ", ".join(
+            f"{calendar_id} ({reason})" for calendar_id, reason in errors.items()
+        ))
+
+    windows = working_windows(lo, hi, tz, hours, weekends)
+    slots = free_slots(merge_busy(busy.values()), windows, min_seconds)
+    result = {
+        'time_zone': getattr(tz, 'key', 'UTC'),
+        'slots': [
+            {
+                'start': datetime.fromtimestamp(start, tz).isoformat(),
+                'end': datetime.fromtimestamp(end, tz).isoformat(),
+                'minutes': int((end - start) // 60),
+            }
+            for start, end in slots[:max(0, int(max_results))]
+        ],
+    }
+    if len(slots) > len(result['slots']):
+        result['more_slots'] = len(slots) - len(result['slots'])
+    if errors:
+        # Free time of these people is unknown, so the slots may not suit them
+        result['unavailable'] = [
+            {'calendar': calendar_id, 'reason': reason} for calendar_id, reason in errors.items()
+        ]
+    return result
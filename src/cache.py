@@ -0,0 +1,147 @@
+"""Response cache in front of the tool dispatch of both servers.
+
+Entries are keyed on the tool name plus its normalized arguments, expire after
+a per-tool TTL and are evicted least-recently-used once max_entries is reached.
+Successful write tools drop the cached reads they make stale. Keys include
+the account the call runs as, so accounts never see each other's results.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from accounts import active_account
+
+# Seconds a result stays valid; tools not listed here are never cached
+DEFAULT_TTLS = {
+    'calendar_list_events': 30,
+    'calendar_find_free_slots': 30,
+    'gmail_list_messages': 30,
+    'gmail_list_threads': 30,
+    # Unlike a message, a thread grows when replies arrive
+    'gmail_read_thread': 30,
+    # A message's headers and body never change once it has an ID
+    'gmail_read_message': 24 * 3600,
+}
+
+# Write tool -> read tools whose cached results it invalidates; the bulk
+# write tools use their single-item tool's entry once their items are done
+INVALIDATES = {
+    'calendar_create_event': ('calendar_list_events', 'calendar_find_free_slots'),
+    'gmail_send_message': ('gmail_list_messages', 'gmail_list_threads', 'gmail_read_thread'),
+}
+
+# Filled in for missing arguments so {} and {"max_results": 10} share an entry
+DEFAULT_ARGUMENTS = {
+    'calendar_list_events': {'max_results': 10},
+    'calendar_find_free_slots': {'max_results': 10, 'duration_minutes': 30},
+    'gmail_list_messages': {'max_results': 10, 'query': ''},
+    'gmail_list_threads': {'max_results': 10, 'query': ''},
+    'gmail_read_thread': {'strip_quotes': True},
+}
+
+# invalidate() default: every account's entries
+ALL_ACCOUNTS = object()
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('TOOL_CACHE_MAX_ENTRIES', '512'))
+
+
+def _normalize(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def cache_key(name, arguments):
+    """Key of a call by the current account"""
+    args = dict(DEFAULT_ARGUMENTS.get(name, {}))
+    args.update(_normalize(arguments or {}))
+    key = name + ':' + json.dumps(args, sort_keys=True, separators=(',', ':'), default=str)
+    account = active_account()
+    return key if account is None else f'{account}/{key}'
+
+
+def cache_from_env():
+    """The shared cache, or None when TOOL_CACHE=0 disables it"""
+    if os.environ.get('TOOL_CACHE', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    return ToolCache()
+
+
+class ToolCache:
+    def __init__(self, ttls=None, max_entries=None, clock=time.monotonic):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (tool name, expiry, result, account), oldest use first
+        self._entries = OrderedDict()
+        self._hits = {}
+        self._misses = {}
+        self._evictions = 0
+
+    def cacheable(self, name):
+        return name in self.ttls
+
+    def get(self, name, arguments):
+        """Return (hit, result) for a read tool call"""
+        key = cache_key(name, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self._clock():
+                self._entries.move_to_end(key)
+                self._hits[name] = self._hits.get(name, 0) + 1
+                return True, entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self._misses[name] = self._misses.get(name, 0) + 1
+            return False, None
+
+    def put(self, name, arguments, result):
+        """Remember a successful result, or invalidate what a write makes stale"""
+        if name in INVALIDATES:
+            self.invalidate(*INVALIDATES[name], account=active_account())
+            return
+        if not self.cacheable(name):
+            return
+        key = cache_key(name, arguments)
+        with self._lock:
+            self._entries[key] = (name, self._clock() + self.ttls[name], result, active_account())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, *names, account=ALL_ACCOUNTS):
+        """Drop the results of the named tools (all without names) of one account or all"""
+        with self._lock:
+            if not names and account is ALL_ACCOUNTS:
+                self._entries.clear()
+                return
+            for key in [
+                k for k, entry in self._entries.items()
+                if (not names or entry[0] in names) and account in (ALL_ACCOUNTS, entry[3])
+            ]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            tools = sorted(set(self._hits) | set(self._misses))
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'evictions': self._evictions,
+                'hits': sum(self._hits.values()),
+                'misses': sum(self._misses.values()),
+                'tools': {
+                    name: {'hits': self._hits.get(name, 0), 'misses': self._misses.get(name, 0)}
+                    for name in tools
+                },
+            }
@@ -0,0 +1,245 @@
+"""Optional local copy of the primary calendar for fast range queries.
+
+The first sync lists expanded (singleEvents) events between
+CALENDAR_STORE_PAST_DAYS ago and CALENDAR_STORE_FUTURE_DAYS ahead and keeps
+the nextSyncToken; later syncs only fetch changes since that token. A 410 GONE
+means the token expired, so the store throws everything away and does a
+full sync again. Events are indexed by [start, end) so calendar_list_events
+can answer arbitrary time_min/time_max windows without another fetch.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, time as dtime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+DEFAULT_SYNC_INTERVAL = float(os.environ.get('CALENDAR_STORE_SYNC_INTERVAL', '30'))
+DEFAULT_PAST_DAYS = int(os.environ.get('CALENDAR_STORE_PAST_DAYS', '30'))
+DEFAULT_FUTURE_DAYS = int(os.environ.get('CALENDAR_STORE_FUTURE_DAYS', '365'))
+
+
+def parse_time(value, tz=None):
+    """Parse an RFC 3339 timestamp or a bare date into an aware datetime"""
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    if len(value) == 10:
+        parsed = datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), dtime())
+    else:
+        parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz or timezone.utc)
+    return parsed
+
+
+def to_rfc3339(value):
+    """Normalize a user-supplied time to what events.list accepts"""
+    return parse_time(value).isoformat()
+
+
+# Partial-response masks: only what format_event and the store read
+EVENT_FIELDS = 'id,summary,start,end'
+EVENT_LIST_FIELDS = f'nextPageToken,items({EVENT_FIELDS})'
+SYNC_FIELDS = f'nextPageToken,nextSyncToken,timeZone,items({EVENT_FIELDS},status)'
+
+
+def format_event(e):
+    return {
+        'id': e.get('id'),
+        'summary': e.get('summary'),
+        'start': e.get('start', {}).get('dateTime', e.get('start', {}).get('date')),
+        'end': e.get('end', {}).get('dateTime', e.get('end', {}).get('date'))
+    }
+
+
+def _http_status(exc):
+    resp = getattr(exc, 'resp', None)
+    return getattr(resp, 'status', None)
+
+
+def store_from_env():
+    """Create the store when CALENDAR_STORE is set, otherwise return None"""
+    if os.environ.get('CALENDAR_STORE', '').lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+    return CalendarStore()
+
+
+class IntervalIndex:
+    """Static index over half-open [start, end) intervals.
+
+    Intervals are sorted by start and a segment tree keeps the maximum end of
+    every block, so an overlap query only descends into blocks that can still
+    contain a match: O(log n + k), with results ordered by start.
+    """
+
+    def __init__(self, items):
+        items = sorted(items, key=lambda item: (item[0], item[1]))
+        self._starts = [item[0] for item in items]
+        self._ends = [item[1] for item in items]
+        self._values = [item[2] for item in items]
+        size = 1
+        while size < len(items):
+            size *= 2
+        self._size = size
+        self._max_end = [float('-inf')] * (2 * size)
+        for i, end in enumerate(self._ends):
+            self._max_end[size + i] = end
+        for node in range(size - 1, 0, -1):
+            self._max_end[node] = max(self._max_end[2 * node], self._max_end[2 * node + 1])
+
+    def __len__(self):
+        return len(self._values)
+
+    def overlapping(self, lo, hi, max_results=None):
+        """Values whose interval intersects [lo, hi), in start order"""
+        limit = bisect_left(self._starts, hi)
+        if limit == 0:
+            return []
+        found = []
+        # (node, first leaf, last leaf) of each block still worth visiting
+        stack = [(1, 0, self._size - 1)]
+        while stack:
+            node, first, last = stack.pop()
+            if first >= limit or self._max_end[node] <= lo:
+                continue
+            if first == last:
+                found.append(self._values[first])
+                if len(found) == max_results:
+                    break
+                continue
+            middle = (first + last) // 2
+            stack.append((2 * node + 1, middle + 1, last))
+            stack.append((2 * node, first, middle))
+        return found
+
+
+class CalendarStore:
+    """Primary-calendar events kept fresh with syncToken incremental sync"""
+
+    def __init__(self, calendar_id='primary', sync_interval=None,
+                 past_days=None, future_days=None):
+        self.calendar_id = calendar_id
+        self.sync_interval = DEFAULT_SYNC_INTERVAL if sync_interval is None else sync_interval
+        self.past_days = DEFAULT_PAST_DAYS if past_days is None else past_days
+        self.future_days = DEFAULT_FUTURE_DAYS if future_days is None else future_days
+        self._lock = threading.RLock()
+        self._events = {}
+        self._index = IntervalIndex([])
+        self._sync_token = None
+        self._time_zone = None
+        self._window = None
+        self._last_sync = 0.0
+
+    def is_fresh(self):
+        return self._sync_token is not None and time.monotonic() - self._last_sync < self.sync_interval
+
+    def covers(self, lo, hi):
+        """True when [lo, hi) lies inside the window the full sync fetched"""
+        return self._window is not None and self._window[0] <= lo and hi <= self._window[1]
+
+    def _tz(self):
+        if self._time_zone and ZoneInfo is not None:
+            try:
+                return ZoneInfo(self._time_zone)
+            except Exception:
+                pass
+        return timezone.utc
+
+    def _interval(self, event):
+        tz = self._tz()
+        start = event.get('start', {})
+        end = event.get('end', {})
+        start_at = parse_time(start.get('dateTime') or start['date'], tz)
+        end_value = end.get('dateTime') or end.get('date')
+        end_at = parse_time(end_value, tz) if end_value else start_at
+        return start_at.timestamp(), max(end_at.timestamp(), start_at.timestamp())
+
+    def _list_pages(self, calendar_service, **params):
+        page_token = None
+        while True:
+            page = calendar_service.events().list(
+                calendarId=self.calendar_id, singleEvents=True,
+                maxResults=2500, pageToken=page_token, fields=SYNC_FIELDS, **params
+            ).execute()
+            yield page
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                return
+
+    def _apply(self, items):
+        for event in items:
+            if event.get('status') == 'cancelled':
+                self._events.pop(event['id'], None)
+                continue
+            try:
+                start, end = self._interval(event)
+            except (KeyError, ValueError):
+                continue
+            self._events[event['id']] = (start, end, event)
+
+    def _reindex(self):
+        self._index = IntervalIndex(
+            (start, end, format_event(event)) for start, end, event in self._events.values()
+        )
+
+    def full_sync(self, calendar_service):
+        """Replace the store with the events in the window; returns True"""
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            lo = now - timedelta(days=self.past_days)
+            hi = now + timedelta(days=self.future_days)
+            self._events = {}
+            token = None
+            for page in self._list_pages(
+                calendar_service, timeMin=lo.isoformat(), timeMax=hi.isoformat()
+            ):
+                self._time_zone = page.get('timeZone', self._time_zone)
+                self._apply(page.get('items', []))
+                token = page.get('nextSyncToken', token)
+            self._sync_token = token
+            self._window = (lo.timestamp(), hi.timestamp())
+            self._reindex()
+            self._last_sync = time.monotonic()
+            return True
+
+    def incremental_sync(self, calendar_service):
+        """Apply the changes since the sync token; True when there were any"""
+        with self._lock:
+            try:
+                pages = list(self._list_pages(calendar_service, syncToken=self._sync_token))
+            except Exception as e:
+                # 410 GONE: the sync token expired and only a full sync recovers
+                if _http_status(e) == 410:
+                    return self.full_sync(calendar_service)
+                raise
+            for page in pages:
+                self._apply(page.get('items', []))
+                self._sync_token = page.get('nextSyncToken', self._sync_token)
+            changed = any(page.get('items') for page in pages)
+            if changed:
+                self._reindex()
+            self._last_sync = time.monotonic()
+            return changed
+
+    def sync(self, calendar_service, force=False):
+        """Bring the store up to date unless it was synced recently; True if it changed"""
+        with self._lock:
+            if self._sync_token is None:
+                return self.full_sync(calendar_service)
+            if force or not self.is_fresh():
+                return self.incremental_sync(calendar_service)
+            return False
+
+    def query(self, time_min, time_max=None, max_results=10):
+        """Events overlapping [time_min, time_max), or None if outside the window"""
+        if self._window is None:
+            return None
+        lo = parse_time(time_min).timestamp()
+        hi = parse_time(time_max).timestamp() if time_max else self._window[1]
+        if not self.covers(lo, hi):
+            return None
+        return self._index.overlapping(lo, hi, max_results)
@@ -0,0 +1,186 @@
+"""Events of several calendars merged into one list ordered by start time.
+
+calendar_list_events reads only the primary calendar unless the caller asks
+for more with "calendars": "all" (every calendar in the user's calendar
+list), "selected" (the ones shown in the Calendar UI) or a list of calendar
+IDs. The first page of every calendar is requested at once on the prefetch
+pool, so an N-calendar query takes about as long as the slowest calendar.
+heapq.merge then walks the per-calendar streams lazily, fetching another page
+of a calendar only when the merge reaches the end of the previous one. An
+event that shows up in several calendars (same iCalUID and start, e.g. a
+meeting in both your calendar and a team calendar) is returned once.
+
+The cursor of a merged listing records where the merge stopped: the start
+time of the last event returned and which events at exactly that time were
+already returned.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from operator import itemgetter
+
+from accounts import active_account
+from calendar_store import EVENT_FIELDS, format_event, parse_time, to_rfc3339
+from pagination import MAX_TOTAL_ITEMS, Page, decode_cursor, encode_cursor, execute_all, iter_pages
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+# Seconds the calendar list is reused before it is fetched again
+CALENDAR_LIST_TTL = float(os.environ.get('CALENDAR_LIST_TTL', '300'))
+# Largest page events.list hands out
+CALENDAR_PAGE_MAX = 2500
+CALENDAR_LIST_FIELDS = 'nextPageToken,items(id,summary,summaryOverride,selected,primary,timeZone)'
+# iCalUID to spot the same event in several calendars, timeZone for all-day events
+MERGE_FIELDS = f'nextPageToken,timeZone,items({EVENT_FIELDS},iCalUID)'
+
+# account -> (expiry, calendar list entries)
+_calendar_lists = {}
+_lock = threading.Lock()
+
+
+def list_calendars(calendar_service):
+    """The current account's calendarList entries, cached for CALENDAR_LIST_TTL"""
+    account = active_account()
+    with _lock:
+        cached = _calendar_lists.get(account)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    calendars = []
+    pages = iter_pages(
+        lambda page_token: calendar_service.calendarList().list(
+            maxResults=250, pageToken=page_token, fields=CALENDAR_LIST_FIELDS
+        ),
+        prefetch=False
+    )
+    for _, response in pages:
+        calendars.extend(response.get('items', []))
+    with _lock:
+        _calendar_lists[account] = (time.monotonic() + CALENDAR_LIST_TTL, calendars)
+    return calendars
+
+
+def resolve_calendars(calendar_service, selection):
+    """[(calendar_id, label)] for a calendars argument"""
+    if selection in ('all', 'selected'):
+        entries = list_calendars(calendar_service)
+        if selection == 'selected':
+            entries = [c for c in entries if c.get('selected') or c.get('primary')]
+        return [(c['id'], c.get('summaryOverride') or c.get('summary') or c['id']) for c in entries]
+    if isinstance(selection, str):
+        selection = [selection]
+    if not isinstance(selection, list) or not all(isinstance(c, str) and c for c in selection):
+        raise ValueError('calendars must be "all", "selected" or a list of calendar IDs')
+    return [(calendar_id, calendar_id) for calendar_id in dict.fromkeys(selection)]
+
+
+def _zone(name):
+    if not name or ZoneInfo is None:
+        return None
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return None
+
+
+def _start(event, tz):
+    start = event.get('start', {})
+    return parse_time(start.get('dateTime') or start.get('date'), tz).timestamp()
+
+
+def _stream(make_request, response, label):
+    """Yield (start, event, label) for one calendar, starting from its first page"""
+    while True:
+        tz = _zone(response.get('timeZone'))
+        for event in response.get('items', []):
+            yield _start(event, tz), event, label
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+        response = make_request(page_token).execute()
+
+
+def merged_events(calendar_service, calendars, time_min, time_max, page_size):
+    """Yield (start, key, event, label) from all calendars in start order, deduplicated.
+
+    Calendars that fail (unsubscribed, no access) are skipped, unless all of
+    them fail.
+    """
+    def make_request(calendar_id, page_token):
+        params = {'timeMin': to_rfc3339(time_min)}
+        if time_max:
+            params['timeMax'] = to_rfc3339(time_max)
+        return calendar_service.events().list(
+            calendarId=calendar_id,
+            maxResults=page_size,
+            singleEvents=True,
+            orderBy='startTime',
+            pageToken=page_token,
+            fields=MERGE_FIELDS,
+            **params
+        )
+
+    first_pages = execute_all([make_request(calendar_id, None) for calendar_id, _ in calendars])
+    streams, errors = [], []
+    for (calendar_id, label), response in zip(calendars, first_pages):
+        if isinstance(response, Exception):
+            errors.append(response)
+            continue
+        streams.append(_stream(
+            lambda page_token, calendar_id=calendar_id: make_request(calendar_id, page_token),
+            response, label
+        ))
+    if errors and not streams:
+        raise errors[0]
+
+    seen = set()
+    for start, event, label in heapq.merge(*streams, key=itemgetter(0)):
+        # Instances of a recurring event share the iCalUID, so the start is part of the key
+        key = [event.get('iCalUID') or event.get('id'), start]
+        if tuple(key) in seen:
+            continue
+        seen.add(tuple(key))
+        yield start, key, event, label
+
+
+def list_merged_events(calendar_service, selection, requested, max_results, cursor, now):
+    """calendar_list_events across the selected calendars, as a Page"""
+    limit = max(0, min(int(max_results), MAX_TOTAL_ITEMS))
+    arguments = dict(requested, calendars=selection)
+    after, skip = None, set()
+    if cursor:
+        position, _, arguments = decode_cursor(cursor, arguments)
+        after, skip = position[0], {tuple(key) for key in position[1]}
+    else:
+        arguments['time_min'] = arguments['time_min'] or now
+
+    # A resumed listing starts again at the last start returned; events
+    # before it, and the ones at it that were returned, are skipped below
+    time_min = to_rfc3339(arguments['time_min'])
+    if after is not None and after > parse_time(time_min).timestamp():
+        time_min = datetime.fromtimestamp(after, timezone.utc).isoformat()
+
+    calendars = resolve_calendars(calendar_service, arguments['calendars'])
+    page_size = max(1, min(limit + len(skip), CALENDAR_PAGE_MAX))
+    events = merged_events(calendar_service, calendars, time_min, arguments['time_max'], page_size)
+
+    items, last_start, boundary = [], after, [list(key) for key in skip]
+    try:
+        for start, key, event, label in events:
+            if after is not None and (start < after or (start == after and tuple(key) in skip)):
+                continue
+            if len(items) == limit:
+                # At least one more event exists, so hand out a cursor
+                return Page(items, encode_cursor([last_start, boundary], 0, arguments))
+            items.append(dict(format_event(event), calendar=label))
+            if start != last_start:
+                last_start, boundary = start, []
+            boundary.append(key)
+    finally:
+        events.close()
+    return Page(items)
@@ -0,0 +1,246 @@
+"""Server-side chat loop for the HTTP server's /chat endpoint.
+
+The browser used to pick a tool, wait for it, then wait for Ollama to
+generate the whole answer. Here the work overlaps instead:
+- the tools the question most likely needs (keyword rules, as the page
+  used) start right away, while the model is loaded with keep_alive
+- the answer is requested with stream=true and every token is passed on
+- a question no rule matches goes to the model with the read-only tools
+  offered, and the tools it asks for run before it answers
+
+All requests to Ollama share one keep-alive connection pool, and the model
+stays loaded for OLLAMA_KEEP_ALIVE between chats, so neither a TCP handshake
+nor a model load sits in front of the first token.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import date
+
+from metrics import CHAT_FIRST_TOKEN, CHAT_PREFETCH
+from render import render
+
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.2:3b')
+# How long Ollama keeps the model in memory after a request
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+# Seconds to wait for Ollama to start answering (a cold model load included)
+OLLAMA_TIMEOUT = float(os.environ.get('OLLAMA_TIMEOUT', '120'))
+MAX_CONNECTIONS = int(os.environ.get('OLLAMA_MAX_CONNECTIONS', '8'))
+# Model-requested tool rounds before it has to answer
+MAX_TOOL_ROUNDS = int(os.environ.get('CHAT_MAX_TOOL_ROUNDS', '3'))
+# Tool results go into the prompt as a compact table capped at this many
+# tokens, so the small model spends less time on prompt evaluation
+RESULT_FORMAT = os.environ.get('CHAT_RESULT_FORMAT', 'table')
+RESULT_MAX_TOKENS = int(os.environ.get('CHAT_RESULT_MAX_TOKENS', '800'))
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. Today is {today}. When given calendar or email "
+    "data, provide a clear, natural summary. Don't write code. Just answer the "
+    "question based on the data."
+)
+
+# (pattern, tool, arguments), most specific first; every match is prefetched
+PREFETCH_RULES = (
+    (re.compile(r'\b(free|available|availability)\b'), 'calendar_find_free_slots', {}),
+    (re.compile(r'\b(threads?|conversations?)\b'), 'gmail_list_threads', {'max_results': 10}),
+    (re.compile(r'calendar|event|meeting|schedule'), 'calendar_list_events', {'max_results': 10}),
+    (re.compile(r'mail|inbox'), 'gmail_list_messages', {'max_results': 10}),
+)
+MAX_PREFETCH = 3
+
+# Tools the model may call on its own; never the ones that send or create
+CHAT_TOOLS = (
+    'calendar_list_events', 'calendar_find_free_slots', 'gmail_list_messages',
+    'gmail_read_message', 'gmail_list_threads', 'gmail_read_thread',
+)
+
+
+def likely_tools(message):
+    """[(tool, arguments)] the message most likely needs"""
+    text = message.lower()
+    picked = []
+    for pattern, tool, arguments in PREFETCH_RULES:
+        if pattern.search(text):
+            picked.append((tool, arguments))
+    return picked[:MAX_PREFETCH]
+
+
+def ollama_tools(listing):
+    """Ollama function specs for the CHAT_TOOLS in a /tools listing"""
+    specs = []
+    for tool in listing:
+        if tool['name'] not in CHAT_TOOLS:
+            continue
+        properties, required = {}, []
+        for name, spec in tool.get('parameters', {}).items():
+            properties[name] = {k: v for k, v in spec.items() if k in ('type', 'description')}
+            if spec.get('required'):
+                required.append(name)
+        specs.append({'type': 'function', 'function': {
+            'name': tool['name'],
+            'description': tool['description'],
+            'parameters': {'type': 'object', 'properties': properties, 'required': required},
+        }})
+    return specs
+
+
+class OllamaClient:
+    """Ollama's chat API over one pooled keep-alive HTTP client"""
+
+    def __init__(self, base_url=None, model=None, keep_alive=None):
+        self.base_url = (base_url or OLLAMA_URL).rstrip('/')
+        self.model = model or OLLAMA_MODEL
+        self.keep_alive = keep_alive or OLLAMA_KEEP_ALIVE
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use so it binds to the server's event loop
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def warm(self):
+        """Load the model, or keep it loaded; a chat without messages does just that"""
+        response = await self.client.post('/api/chat', json={
+            'model': self.model, 'messages': [], 'keep_alive': self.keep_alive
+        })
+        response.raise_for_status()
+
+    async def stream(self, messages, tools=None):
+        """Yield Ollama's response chunks (content pieces, tool calls, final stats)"""
+        body = {
+            'model': self.model,
+            'messages': messages,
+            'stream': True,
+            'keep_alive': self.keep_alive,
+        }
+        if tools:
+            body['tools'] = tools
+        import httpx
+        try:
+            async with self.client.stream('POST', '/api/chat', json=body) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    raise RuntimeError(f"Ollama error {response.status_code}: {response.text[:200]}")
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+        except httpx.TransportError as e:
+            raise RuntimeError(f"Cannot reach Ollama at {self.base_url}: {e}") from e
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+async def _run_tool(dispatcher, name, arguments):
+    """Rendered result text of a tool call, or the error as text"""
+    try:
+        result = await dispatcher.call(name, dict(arguments))
+        return render(result, RESULT_FORMAT, RESULT_MAX_TOKENS), None
+    except Exception as e:
+        return f"Error: {e}", str(e)
+
+
+async def _unknown_tool(name):
+    return f"Error: unknown tool {name}", f"unknown tool {name}"
+
+
+async def chat(dispatcher, ollama, message, history=None, tool_specs=None):
+    """Yield (event, data) pairs for one chat turn.
+
+    Events: "tool" when a tool finished, "token" for each piece of the
+    answer, "done" with timings last, or "error".
+    """
+    started = time.perf_counter()
+
+    def elapsed_ms():
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    # Tools and the model load run side by side; the prompt needs both
+    prefetch = [
+        (name, arguments, asyncio.ensure_future(_run_tool(dispatcher, name, arguments)))
+        for name, arguments in likely_tools(message)
+    ]
+    for name, _, _ in prefetch:
+        CHAT_PREFETCH.inc(tool=name)
+    warming = asyncio.ensure_future(ollama.warm())
+
+    messages = [{'role': 'system', 'content': SYSTEM_PROMPT.format(today=date.today().isoformat())}]
+    messages.extend(history or [])
+    data = []
+    try:
+        for name, arguments, task in prefetch:
+            text, error = await task
+            yield 'tool', {'name': name, 'arguments': arguments, 'error': error, 'ms': elapsed_ms()}
+            data.append(f"{name}:\n{text}")
+        content = message
+        if data:
+            content += "\n\nHere is the relevant data:\n" + "\n\n".join(data)
+        messages.append({'role': 'user', 'content': content})
+        try:
+            await warming
+        except Exception:
+            # The answer request reports an unreachable Ollama more usefully
+            pass
+
+        # Prefetched data usually answers the question; only offer tools without it
+        tools = None if prefetch else tool_specs
+        first_token, stats, rounds = None, {}, 0
+        while True:
+            calls = []
+            async for chunk in ollama.stream(messages, tools):
+                piece = chunk.get('message', {})
+                calls.extend(piece.get('tool_calls') or [])
+                if piece.get('content'):
+                    if first_token is None:
+                        first_token = elapsed_ms()
+                        CHAT_FIRST_TOKEN.observe(first_token / 1000)
+                    yield 'token', {'text': piece['content']}
+                if chunk.get('done'):
+                    stats = chunk
+            if not calls:
+                break
+            rounds += 1
+            messages.append({'role': 'assistant', 'content': '', 'tool_calls': calls})
+            requested = [
+                (call.get('function', {}).get('name'), call.get('function', {}).get('arguments') or {})
+                for call in calls
+            ]
+            # The model may ask for several tools at once; they run concurrently
+            outcomes = await asyncio.gather(*(
+                _run_tool(dispatcher, name, arguments) if name in CHAT_TOOLS
+                else _unknown_tool(name)
+                for name, arguments in requested
+            ))
+            for (name, arguments), (text, error) in zip(requested, outcomes):
+                yield 'tool', {'name': name, 'arguments': arguments, 'error': error, 'ms': elapsed_ms()}
+                messages.append({'role': 'tool', 'content': text})
+            if rounds >= MAX_TOOL_ROUNDS:
+                tools = None
+    except Exception as e:
+        yield 'error', {'error': str(e) or type(e).__name__}
+        return
+    finally:
+        warming.cancel()
+
+    yield 'done', {
+        'first_token_ms': first_token,
+        'total_ms': elapsed_ms(),
+        'tool_rounds': rounds,
+        'load_ms': round(stats.get('load_duration', 0) / 1e6, 1),
+        'prompt_eval_ms': round(stats.get('prompt_eval_duration', 0) / 1e6, 1),
+        'eval_count': stats.get('eval_count'),
+    }
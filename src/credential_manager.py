@@ -0,0 +1,187 @@
+"""OAuth credentials shared by every worker thread.
+
+The manager loads token.pickle once, refreshes the access token on a daemon
+thread shortly before it expires, funnels every other refresh through one
+lock so concurrent callers share a single in-flight refresh, and rewrites the
+token file atomically.
+"""
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Refresh this many seconds before expiry, well ahead of google-auth's own
+# ~4 minute threshold so requests never have to refresh inline
+DEFAULT_REFRESH_MARGIN = float(os.environ.get('GOOGLE_TOKEN_REFRESH_MARGIN', '300'))
+RETRY_DELAY = 30
+
+
+def default_token_dir():
+    """Directory holding token.pickle, credentials.json and local caches"""
+    return os.path.abspath(os.path.expanduser(os.environ.get('GOOGLE_TOKEN_DIR') or PROJECT_DIR))
+
+
+def _seconds_left(creds):
+    if creds.expiry is None:
+        return float('inf')
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (creds.expiry - now).total_seconds()
+
+
+class ManagedCredentials:
+    """What AuthorizedHttp and batch requests see instead of the raw credentials.
+
+    Tokens always come from the manager, and a refresh after a 401 only
+    happens if nobody replaced the rejected token in the meantime.
+    """
+
+    def __init__(self, manager):
+        self._manager = manager
+        self._local = threading.local()
+
+    # oauth2client-style interface, used by googleapiclient's batch requests
+    @property
+    def access_token(self):
+        return self._manager.get().token
+
+    @property
+    def access_token_expired(self):
+        return not self._manager.get().valid
+
+    def apply(self, headers, token=None):
+        creds = self._manager.get()
+        self._local.token = creds.token
+        creds.apply(headers, token=token)
+
+    def before_request(self, request, method, url, headers):
+        self.apply(headers)
+
+    def refresh(self, request):
+        self._manager.refresh(stale_token=getattr(self._local, 'token', None))
+
+
+class CredentialManager:
+    def __init__(self, token_path, client_secrets_path, scopes,
+                 refresh_margin=None, background_refresh=True, interactive=True):
+        self.token_path = token_path
+        self.client_secrets_path = client_secrets_path
+        self.scopes = scopes
+        self.refresh_margin = DEFAULT_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.background_refresh = background_refresh
+        # Without a usable token, run the browser flow (True) or raise
+        self.interactive = interactive
+        self._creds = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+        self.managed = ManagedCredentials(self)
+
+    def get(self):
+        """Valid credentials, loading or refreshing them only when needed"""
+        creds = self._creds
+        if creds is not None and creds.valid:
+            return creds
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load()
+                self._start_refresher()
+            elif not self._creds.valid:
+                self._refresh_locked()
+            return self._creds
+
+    def authorized(self):
+        """Credentials facade for HTTP transports, after loading the token"""
+        self.get()
+        return self.managed
+
+    def refresh(self, stale_token=None):
+        """Refresh the access token; concurrent callers share one refresh.
+
+        With stale_token set, the refresh is skipped if the current token
+        already differs from it, i.e. someone else refreshed first.
+        """
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load()
+                self._start_refresher()
+                return self._creds
+            if stale_token is not None and self._creds.token != stale_token:
+                return self._creds
+            self._refresh_locked()
+            return self._creds
+
+    def _refresh_locked(self):
+        from google.auth.transport.requests import Request
+        self._creds.refresh(Request())
+        self._save(self._creds)
+
+    def _load(self):
+        import pickle
+
+        creds = None
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'rb') as token:
+                creds = pickle.load(token)
+
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request
+                creds.refresh(Request())
+            elif not self.interactive:
+                raise RuntimeError(f"No valid token in {self.token_path}")
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    self.client_secrets_path, self.scopes)
+                creds = flow.run_local_server(port=0)
+            self._save(creds)
+
+        return creds
+
+    def _save(self, creds):
+        """Write token.pickle via a temp file so readers never see half a file"""
+        import pickle
+
+        directory = os.path.dirname(self.token_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.token-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                pickle.dump(creds, tmp)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.token_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    # -- background refresh -----------------------------------------------
+
+    def _start_refresher(self):
+        if not self.background_refresh or self._refresher is not None:
+            return
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, name='google-token-refresh', daemon=True
+        )
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            creds = self._creds
+            if creds is None or creds.expiry is None or not creds.refresh_token:
+                return
+            delay = _seconds_left(creds) - self.refresh_margin
+            if delay > 0 and self._stop.wait(delay):
+                return
+            try:
+                self.refresh(stale_token=creds.token)
+            except Exception:
+                # Requests still refresh inline; try again shortly
+                if self._stop.wait(RETRY_DELAY):
+                    return
+
+    def stop(self):
+        self._stop.set()
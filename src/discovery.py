@@ -0,0 +1,74 @@
+"""Discovery documents for the Google APIs, loaded without touching the network.
+
+Documents come from GOOGLE_DISCOVERY_DIR when it holds <api>.<version>.json
+(written by `python discovery.py --save DIR`), otherwise from the copies
+bundled with google-api-python-client. The text is read once per process;
+build_from_document mutates the parsed document, so every build parses its
+own copy.
+
+GOOGLE_API_ROOT points the built services at another host (a local fake of
+the Google APIs, for benchmarks) by replacing the document's rootUrl.
+"""
+import json
+import os
+import sys
+import threading
+
+DISCOVERY_DIR = os.environ.get('GOOGLE_DISCOVERY_DIR')
+API_ROOT = os.environ.get('GOOGLE_API_ROOT')
+APIS = (('calendar', 'v3'), ('gmail', 'v1'))
+
+_documents = {}
+_lock = threading.Lock()
+
+
+def get_document(api, version):
+    """Discovery document text for api/version"""
+    key = (api, version)
+    with _lock:
+        if key not in _documents:
+            _documents[key] = _load_document(api, version)
+        return _documents[key]
+
+
+def _load_document(api, version):
+    if DISCOVERY_DIR:
+        path = os.path.join(DISCOVERY_DIR, f'{api}.{version}.json')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+
+    from googleapiclient import discovery_cache
+    content = discovery_cache.get_static_doc(api, version)
+    if content is None:
+        raise RuntimeError(
+            f"No discovery document for {api} {version}; "
+            f"run `python discovery.py --save DIR` and set GOOGLE_DISCOVERY_DIR"
+        )
+    return content
+
+
+def build_service(api, version, http, model=None):
+    """Same as googleapiclient's build(), minus the discovery lookup"""
+    from googleapiclient.discovery import build_from_document
+    document = get_document(api, version)
+    if API_ROOT:
+        document = json.loads(document)
+        document['rootUrl'] = API_ROOT.rstrip('/') + '/'
+    return build_from_document(document, http=http, model=model)
+
+
+def save_documents(directory):
+    """Write the discovery documents the servers use into directory"""
+    os.makedirs(directory, exist_ok=True)
+    for api, version in APIS:
+        path = os.path.join(directory, f'{api}.{version}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(json.loads(get_document(api, version)), f)
+        print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != '--save':
+        sys.exit("usage: python discovery.py --save DIR")
+    save_documents(sys.argv[2])
@@ -0,0 +1,182 @@
+"""Tool dispatch shared by both servers: cache lookup, then the worker pool"""
+import asyncio
+import time
+
+import tools
+from cache import DEFAULT_TTLS, cache_key
+from metrics import COALESCED, instrumented, observe_call
+from pagination import Page
+from tools import STREAMING_TOOLS, TOOLS
+
+
+class ToolDispatcher:
+    def __init__(self, executor, cache=None):
+        self.executor = executor
+        self.cache = cache
+        # cache key -> task of a read that has not finished yet
+        self._inflight = {}
+
+    def _cached(self, name, arguments):
+        if self.cache is not None and self.cache.cacheable(name):
+            return self.cache.get(name, arguments)
+        return False, None
+
+    def _remember(self, name, arguments, result):
+        if self.cache is not None:
+            self.cache.put(name, arguments, result)
+
+    async def call(self, name, arguments):
+        """Run a known tool and return its JSON-serializable result"""
+        started = time.perf_counter()
+        try:
+            hit, result = self._cached(name, arguments)
+            if not hit:
+                result = await self._shared_run(name, arguments)
+        except Exception as e:
+            observe_call(name, time.perf_counter() - started, e)
+            raise
+        observe_call(name, time.perf_counter() - started)
+        return result
+
+    async def _shared_run(self, name, arguments):
+        """_run, joined by identical read calls made while it is running"""
+        if name not in DEFAULT_TTLS:
+            return await self._run(name, arguments)
+        key = cache_key(name, arguments)
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._run(name, arguments))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            COALESCED.inc(level='tool')
+        # One caller giving up must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _run(self, name, arguments):
+        result = await self.executor.run(instrumented(name, TOOLS[name]), arguments)
+        self._remember(name, arguments, result)
+        return result
+
+    async def stream(self, name, arguments, page=None):
+        """Async-iterate the items of a list tool as they are fetched.
+
+        Tools without a streaming version yield their whole result once.
+        A list tool's items also go into page, when given, which ends up
+        holding the cursor for the rest, as call() would return it.
+        """
+        if page is None:
+            page = Page()
+        started = time.perf_counter()
+        try:
+            async for item in self._stream(name, arguments, page):
+                yield item
+        except Exception as e:
+            observe_call(name, time.perf_counter() - started, e)
+            raise
+        observe_call(name, time.perf_counter() - started)
+
+    async def _stream(self, name, arguments, page):
+        hit, result = self._cached(name, arguments)
+        if hit or name not in STREAMING_TOOLS:
+            if not hit:
+                result = await self._run(name, arguments)
+            if name in STREAMING_TOOLS:
+                page.next_cursor = getattr(result, 'next_cursor', None)
+                for item in result:
+                    page.append(item)
+                    yield item
+            else:
+                yield result
+            return
+
+        chunks = self.executor.stream(instrumented(name, STREAMING_TOOLS[name]), arguments)
+        async for chunk in chunks:
+            page.next_cursor = chunk.next_cursor
+            for item in chunk:
+                page.append(item)
+                yield item
+        # Cached as a Page, like call() results, so a later call keeps the cursor
+        self._remember(name, arguments, Page(page, page.next_cursor))
+
+    async def _read_messages(self, message_ids):
+        """Fetch several gmail_read_message results in one Google batch"""
+        unique = list(dict.fromkeys(message_ids))
+        fetched = dict(zip(unique, await self.executor.run(
+            instrumented('gmail_read_message', tools.gmail_read_messages), unique
+        )))
+        results = []
+        for msg_id in message_ids:
+            result = fetched[msg_id]
+            if not isinstance(result, Exception):
+                self._remember('gmail_read_message', {'message_id': msg_id}, result)
+            results.append(result)
+        return results
+
+    async def call_many(self, calls, timeout=None):
+        """Run independent (name, arguments) calls concurrently.
+
+        Returns one entry per call, in order: the result, or the exception
+        that call raised. Uncached gmail_read_message calls share a single
+        Google batch request. Calls still running when the overall timeout
+        expires are cancelled and reported as TimeoutError.
+        """
+        started = time.perf_counter()
+        results = [None] * len(calls)
+        ended = {}
+        jobs = {}
+        reads = []
+
+        for index, (name, arguments) in enumerate(calls):
+            if name not in TOOLS:
+                results[index] = ValueError(f"Unknown tool: {name}")
+                continue
+            hit, result = self._cached(name, arguments)
+            if hit:
+                results[index] = result
+                ended[index] = time.perf_counter()
+            elif name == 'gmail_read_message' and 'message_id' in arguments:
+                reads.append(index)
+            else:
+                jobs[asyncio.ensure_future(self._run(name, arguments))] = [index]
+
+        batch_job = None
+        if len(reads) == 1:
+            index = reads[0]
+            jobs[asyncio.ensure_future(self._run(*calls[index]))] = [index]
+        elif reads:
+            ids = [calls[index][1]['message_id'] for index in reads]
+            batch_job = asyncio.ensure_future(self._read_messages(ids))
+            jobs[batch_job] = reads
+
+        for job, indexes in jobs.items():
+            job.add_done_callback(
+                lambda _, indexes=indexes: ended.update(dict.fromkeys(indexes, time.perf_counter()))
+            )
+        if jobs:
+            await self._collect(jobs, batch_job, results, timeout)
+
+        now = time.perf_counter()
+        for index, (name, _) in enumerate(calls):
+            if name in TOOLS:
+                outcome = results[index]
+                error = outcome if isinstance(outcome, Exception) else None
+                observe_call(name, ended.get(index, now) - started, error)
+        return results
+
+    async def _collect(self, jobs, batch_job, results, timeout):
+        """Wait for the jobs until timeout and write their outcomes into results"""
+        done, pending = await asyncio.wait(jobs, timeout=timeout)
+        for job in pending:
+            job.cancel()
+            for index in jobs[job]:
+                results[index] = TimeoutError(f"Deadline of {timeout:g}s exceeded")
+        for job in done:
+            indexes = jobs[job]
+            if job.exception() is not None:
+                outcomes = [job.exception()] * len(indexes)
+            elif job is batch_job:
+                outcomes = job.result()
+            else:
+                outcomes = [job.result()]
+            for index, outcome in zip(indexes, outcomes):
+                results[index] = outcome
@@ -0,0 +1,170 @@
+"""Bounded worker pool that runs blocking Google API calls off the event loop.
+
+googleapiclient services share one httplib2.Http underneath, and httplib2 is
+not thread-safe, so every worker thread builds its own transport and its own
+service objects on first use. Only the credentials are shared between threads.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from discovery import APIS, build_service, get_document
+from payload import MeteredHttp, MeteredModel
+from scheduler import ScheduledHttp
+
+DEFAULT_MAX_WORKERS = int(os.environ.get('GOOGLE_MAX_WORKERS', '8'))
+DEFAULT_TIMEOUT = float(os.environ.get('GOOGLE_CALL_TIMEOUT', '60'))
+
+
+def authorized_http(creds, timeout=None):
+    """A new HTTP transport for creds: scheduled, gzip-negotiating and metered"""
+    # Imported here so the stdio server can answer initialize/list_tools
+    # before paying for the Google client libraries
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+
+    # Metering sits below the scheduler so retries count as round trips
+    # and coalesced requests do not
+    return AuthorizedHttp(
+        creds, http=ScheduledHttp(MeteredHttp(httplib2.Http(timeout=timeout)))
+    )
+
+
+def build_services(creds, timeout=None):
+    """Build calendar and gmail services on a private HTTP transport"""
+    from googleapiclient.model import JsonModel
+
+    http = authorized_http(creds, timeout)
+    model = MeteredModel(JsonModel())
+    return (
+        build_service('calendar', 'v3', http, model),
+        build_service('gmail', 'v1', http, model),
+    )
+
+
+class GoogleExecutor:
+    """Runs fn(calendar_service, gmail_service, *args) on a worker thread"""
+
+    def __init__(self, creds_factory, max_workers=None, timeout=None):
+        self._creds_factory = creds_factory
+        self._creds = None
+        self._creds_lock = threading.Lock()
+        self._local = threading.local()
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='google-api'
+        )
+
+    def credentials(self):
+        with self._creds_lock:
+            if self._creds is None:
+                self._creds = self._creds_factory()
+            return self._creds
+
+    def services(self):
+        """Services owned by the calling worker thread"""
+        services = getattr(self._local, 'services', None)
+        if services is None:
+            # The socket timeout bounds how long an abandoned call can keep
+            # its worker busy after the awaiting coroutine has given up.
+            services = build_services(self.credentials(), timeout=self.timeout)
+            self._local.services = services
+        return services
+
+    def _warm(self, credentials):
+        import googleapiclient.discovery  # noqa: F401
+        for api, version in APIS:
+            get_document(api, version)
+        if credentials:
+            self.services()
+
+    def warm(self, credentials=False):
+        """Preload libraries and discovery documents on a worker thread.
+
+        With credentials=True the token is loaded and one worker's services
+        are built too; only pass it when that cannot start an interactive
+        OAuth flow. Returns the concurrent future.
+        """
+        return self._pool.submit(self._warm, credentials)
+
+    def _call(self, fn, args):
+        return fn(*self.services(), *args)
+
+    async def run(self, fn, *args, timeout=None):
+        """Await fn on the pool; raises TimeoutError after the per-call timeout.
+
+        Cancelling the awaiting task (client disconnect, MCP cancellation)
+        drops the call if it is still queued; a call that already started
+        finishes in the background and its result is discarded.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        ctx = contextvars.copy_context()
+        future = self._pool.submit(ctx.run, self._call, fn, args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Google API call timed out after {timeout:g}s") from None
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    async def stream(self, fn, *args, timeout=None):
+        """Async-iterate a blocking generator fn running on the pool.
+
+        Items are handed to the event loop as soon as the worker produces
+        them. The timeout covers the whole stream; when it expires or the
+        consumer stops early, the generator is closed at its next item, so
+        it fetches no further pages.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def produce(*services_and_args):
+            items = fn(*services_and_args)
+            try:
+                for item in items:
+                    if stopped.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, (True, item))
+            finally:
+                # Runs the generator's own cleanup, e.g. cancelling a prefetched page
+                items.close()
+
+        def work():
+            # Failures before the first item (building the services, a bad
+            # argument) end the stream too, not just those while iterating
+            try:
+                self._call(produce, args)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (False, e))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (False, None))
+
+        ctx = contextvars.copy_context()
+        future = self._pool.submit(ctx.run, work)
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                try:
+                    is_item, value = await asyncio.wait_for(queue.get(), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"Google API call timed out after {timeout:g}s") from None
+                if is_item:
+                    yield value
+                elif value is None:
+                    return
+                else:
+                    raise value
+        finally:
+            stopped.set()
+            future.cancel()
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,122 @@
+"""Batched Gmail message and thread fetches shared by the stdio and HTTP servers"""
+import os
+
+from metrics import GMAIL_BATCH_SIZE, RETRIES
+from scheduler import is_retryable_error, shared as scheduler
+
+# Gmail accepts up to 100 calls per batch but throttles batches above ~50
+DEFAULT_BATCH_SIZE = int(os.environ.get('GMAIL_BATCH_SIZE', '50'))
+METADATA_HEADERS = ['From', 'Subject', 'Date']
+# Partial-response masks: only what the summaries and listings read
+SUMMARY_FIELDS = 'id,payload/headers'
+LIST_FIELDS = 'nextPageToken,messages/id'
+THREAD_SUMMARY_FIELDS = 'id,messages(id,payload/headers)'
+THREAD_LIST_FIELDS = 'nextPageToken,threads/id'
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+
+def batch_get_messages(gmail_service, message_ids, batch_size=None, **get_kwargs):
+    """Fetch messages with one HTTP round trip per chunk of IDs.
+
+    Returns a list in the same order as message_ids. Each entry is either the
+    message resource or the exception Gmail returned for that ID, so one bad
+    message does not fail the whole listing. Parts that were throttled (Gmail
+    answers 429 per part when a batch is too hot) are retried with backoff.
+    """
+    return _batch_get(gmail_service, 'messages', message_ids, batch_size, get_kwargs)
+
+
+def batch_get_threads(gmail_service, thread_ids, batch_size=None, **get_kwargs):
+    """batch_get_messages for threads.get"""
+    return _batch_get(gmail_service, 'threads', thread_ids, batch_size, get_kwargs)
+
+
+def _batch_get(gmail_service, collection, ids, batch_size, get_kwargs):
+    ids = list(ids)
+    size = max(1, min(int(batch_size or DEFAULT_BATCH_SIZE), 100))
+    results = [None] * len(ids)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = exception if exception is not None else response
+
+    pending = list(range(len(ids)))
+    attempt = 0
+    while pending:
+        for _, chunk in _chunks(pending, size):
+            batch = gmail_service.new_batch_http_request(callback=callback)
+            for index in chunk:
+                batch.add(
+                    getattr(gmail_service.users(), collection)().get(
+                        userId='me', id=ids[index], **get_kwargs
+                    ),
+                    request_id=str(index)
+                )
+            GMAIL_BATCH_SIZE.observe(len(chunk))
+            batch.execute()
+
+        pending = [i for i in pending if is_retryable_error(results[i])]
+        if not pending or attempt >= scheduler.max_retries:
+            break
+        for index in pending:
+            RETRIES.inc(api='gmail', status=results[index].resp.status)
+        scheduler.sleep(scheduler.delay(attempt))
+        attempt += 1
+
+    return results
+
+
+def summarize_message(m):
+    """Reduce a metadata-format message to the fields the tools return"""
+    headers = {h['name']: h['value'] for h in m.get('payload', {}).get('headers', [])}
+    return {
+        'id': m['id'],
+        'from': headers.get('From'),
+        'subject': headers.get('Subject'),
+        'date': headers.get('Date')
+    }
+
+
+def fetch_message_summaries(gmail_service, message_ids, batch_size=None):
+    """Batched replacement for the per-ID messages().get(format='metadata') loop"""
+    message_ids = list(message_ids)
+    fetched = batch_get_messages(
+        gmail_service, message_ids, batch_size=batch_size,
+        format='metadata', metadataHeaders=METADATA_HEADERS, fields=SUMMARY_FIELDS
+    )
+    detailed = []
+    for msg_id, m in zip(message_ids, fetched):
+        if isinstance(m, Exception):
+            detailed.append({'id': msg_id, 'error': str(m)})
+        else:
+            detailed.append(summarize_message(m))
+    return detailed
+
+
+def summarize_thread(t):
+    """Reduce a metadata-format thread to subject, senders, last date and size"""
+    messages = [summarize_message(m) for m in t.get('messages', [])]
+    senders = list(dict.fromkeys(m['from'] for m in messages if m['from']))
+    return {
+        'id': t['id'],
+        'subject': messages[0]['subject'] if messages else None,
+        'from': ', '.join(senders),
+        'date': messages[-1]['date'] if messages else None,
+        'messages': len(messages)
+    }
+
+
+def fetch_thread_summaries(gmail_service, thread_ids, batch_size=None):
+    """fetch_message_summaries for threads: one batch for all their messages' headers"""
+    thread_ids = list(thread_ids)
+    fetched = batch_get_threads(
+        gmail_service, thread_ids, batch_size=batch_size,
+        format='metadata', metadataHeaders=METADATA_HEADERS, fields=THREAD_SUMMARY_FIELDS
+    )
+    return [
+        {'id': thread_id, 'error': str(t)} if isinstance(t, Exception) else summarize_thread(t)
+        for thread_id, t in zip(thread_ids, fetched)
+    ]
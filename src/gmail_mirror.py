@@ -0,0 +1,335 @@
+"""Optional local mirror of Gmail message metadata.
+
+The mirror lives in a SQLite file next to token.pickle. The first sync lists
+the newest GMAIL_MIRROR_MAX_MESSAGES messages; later syncs replay
+users.history.list from the stored historyId, which is normally a single
+round trip. gmail_list_messages answers the simple queries it understands
+(recent, is:unread, from:, subject:, label:/in:) straight from SQLite and
+falls back to the API for everything else.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from gmail_batch import LIST_FIELDS, METADATA_HEADERS, batch_get_messages
+
+MIRROR_FILENAME = 'gmail_mirror.sqlite3'
+DEFAULT_MAX_MESSAGES = int(os.environ.get('GMAIL_MIRROR_MAX_MESSAGES', '2000'))
+DEFAULT_SYNC_INTERVAL = float(os.environ.get('GMAIL_MIRROR_SYNC_INTERVAL', '15'))
+
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Partial-response masks: only the columns the mirror stores
+MESSAGE_FIELDS = 'id,threadId,internalDate,labelIds,payload/headers'
+HISTORY_FIELDS = (
+    'historyId,nextPageToken,history(messagesAdded/message/id,messagesDeleted/message/id,'
+    'labelsAdded/message(id,labelIds),labelsRemoved/message(id,labelIds))'
+)
+# messages.list hides these unless includeSpamTrash is set, so the mirror does too
+HIDDEN_LABELS = ('SPAM', 'TRASH')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    internal_date INTEGER NOT NULL DEFAULT 0,
+    from_header TEXT,
+    subject TEXT,
+    date_header TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_by_date ON messages (internal_date DESC);
+CREATE TABLE IF NOT EXISTS message_labels (
+    message_id TEXT NOT NULL,
+    label_id TEXT NOT NULL,
+    PRIMARY KEY (message_id, label_id)
+);
+CREATE INDEX IF NOT EXISTS message_labels_by_label ON message_labels (label_id);
+CREATE TABLE IF NOT EXISTS labels (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_TERM = re.compile(r'(\w+):("[^"]*"|\S+)|(\S+)')
+
+
+def _http_status(exc):
+    resp = getattr(exc, 'resp', None)
+    return getattr(resp, 'status', None)
+
+
+def parse_query(query):
+    """Translate a Gmail search string into (sql_where, params).
+
+    Returns None when the query uses anything the mirror cannot evaluate
+    exactly (free text, OR, negation, date operators...), so the caller can
+    fall back to the API.
+    """
+    clauses, params = [], []
+    for match in _TERM.finditer(query or ''):
+        op, value, bare = match.groups()
+        if bare is not None:
+            return None
+        op = op.lower()
+        value = value.strip('"')
+        if not value:
+            return None
+
+        if op == 'is' and value.lower() in ('unread', 'read', 'starred', 'important'):
+            label = 'UNREAD' if value.lower() == 'read' else value.upper()
+            negate = 'NOT ' if value.lower() == 'read' else ''
+            clauses.append(
+                f"{negate}EXISTS (SELECT 1 FROM message_labels l "
+                f"WHERE l.message_id = m.id AND l.label_id = ?)"
+            )
+            params.append(label)
+        elif op in ('label', 'in'):
+            if value.lower() in ('anywhere', 'spam', 'trash'):
+                return None
+            # Gmail writes spaces in label names as dashes in queries
+            clauses.append(
+                "EXISTS (SELECT 1 FROM message_labels l JOIN labels n ON n.id = l.label_id "
+                "WHERE l.message_id = m.id "
+                "AND (lower(n.name) IN (lower(?), lower(?)) OR lower(n.id) = lower(?)))"
+            )
+            params.extend([value, value.replace('-', ' '), value])
+        elif op == 'from':
+            clauses.append("m.from_header LIKE ?")
+            params.append(f'%{value}%')
+        elif op == 'subject':
+            clauses.append("m.subject LIKE ?")
+            params.append(f'%{value}%')
+        else:
+            return None
+    return clauses, params
+
+
+def mirror_from_env(token_dir):
+    """Open the mirror when GMAIL_MIRROR is set, otherwise return None"""
+    if os.environ.get('GMAIL_MIRROR', '').lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+    return GmailMirror.open(token_dir)
+
+
+class GmailMirror:
+    """SQLite-backed copy of message metadata, kept fresh via the history API"""
+
+    def __init__(self, path, max_messages=None, sync_interval=None):
+        self.path = path
+        self.max_messages = max_messages or DEFAULT_MAX_MESSAGES
+        self.sync_interval = DEFAULT_SYNC_INTERVAL if sync_interval is None else sync_interval
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._last_sync = 0.0
+
+    @classmethod
+    def open(cls, token_dir, **kwargs):
+        return cls(os.path.join(token_dir, MIRROR_FILENAME), **kwargs)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # -- sync state -------------------------------------------------------
+
+    def _get_state(self, key):
+        row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    @property
+    def history_id(self):
+        with self._lock:
+            return self._get_state('history_id')
+
+    @property
+    def complete(self):
+        """True when the mirror holds every message, not just the newest ones"""
+        with self._lock:
+            return self._get_state('complete') == '1'
+
+    def is_fresh(self):
+        return self.history_id is not None and time.monotonic() - self._last_sync < self.sync_interval
+
+    # -- writes -----------------------------------------------------------
+
+    def _store(self, messages):
+        for m in messages:
+            headers = {h['name']: h['value'] for h in m.get('payload', {}).get('headers', [])}
+            self._conn.execute(
+                "INSERT OR REPLACE INTO messages "
+                "(id, thread_id, internal_date, from_header, subject, date_header) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (m['id'], m.get('threadId'), int(m.get('internalDate', 0)),
+                 headers.get('From'), headers.get('Subject'), headers.get('Date'))
+            )
+            self._set_labels(m['id'], m.get('labelIds', []))
+
+    def _set_labels(self, message_id, label_ids):
+        self._conn.execute("DELETE FROM message_labels WHERE message_id = ?", (message_id,))
+        self._conn.executemany(
+            "INSERT INTO message_labels (message_id, label_id) VALUES (?, ?)",
+            [(message_id, label) for label in label_ids]
+        )
+
+    def _delete(self, message_id):
+        self._conn.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+        self._conn.execute("DELETE FROM message_labels WHERE message_id = ?", (message_id,))
+
+    def _fetch_metadata(self, gmail_service, message_ids):
+        fetched = batch_get_messages(
+            gmail_service, message_ids,
+            format='metadata', metadataHeaders=METADATA_HEADERS, fields=MESSAGE_FIELDS
+        )
+        # A message added and deleted between two syncs comes back as a 404
+        return [m for m in fetched if not isinstance(m, Exception)]
+
+    def _store_labels(self, labels):
+        self._conn.execute("DELETE FROM labels")
+        self._conn.executemany(
+            "INSERT INTO labels (id, name) VALUES (?, ?)",
+            [(label['id'], label['name']) for label in labels]
+        )
+
+    # -- sync -------------------------------------------------------------
+
+    def full_sync(self, gmail_service):
+        """Replace the mirror with the newest max_messages messages; returns True"""
+        with self._lock:
+            # Read the historyId first so changes made while listing are replayed later
+            profile = gmail_service.users().getProfile(userId='me', fields='historyId').execute()
+
+            ids, page_token = [], None
+            while len(ids) < self.max_messages:
+                page = gmail_service.users().messages().list(
+                    userId='me', maxResults=min(500, self.max_messages - len(ids)),
+                    pageToken=page_token, fields=LIST_FIELDS
+                ).execute()
+                ids.extend(msg['id'] for msg in page.get('messages', []))
+                page_token = page.get('nextPageToken')
+                if not page_token:
+                    break
+
+            messages = self._fetch_metadata(gmail_service, ids)
+            labels = gmail_service.users().labels().list(
+                userId='me', fields='labels(id,name)'
+            ).execute().get('labels', [])
+            with self._conn:
+                self._conn.execute("DELETE FROM messages")
+                self._conn.execute("DELETE FROM message_labels")
+                self._store(messages)
+                self._store_labels(labels)
+                self._set_state('history_id', profile['historyId'])
+                self._set_state('complete', '0' if page_token else '1')
+            self._last_sync = time.monotonic()
+            return True
+
+    def incremental_sync(self, gmail_service):
+        """Apply users.history.list changes since the stored historyId; True if there were any"""
+        with self._lock:
+            start = self.history_id
+            added, label_changes, deleted = [], {}, set()
+            page_token, latest = None, start
+            try:
+                while True:
+                    page = gmail_service.users().history().list(
+                        userId='me', startHistoryId=start,
+                        historyTypes=HISTORY_TYPES, pageToken=page_token, fields=HISTORY_FIELDS
+                    ).execute()
+                    for record in page.get('history', []):
+                        for item in record.get('messagesAdded', []):
+                            added.append(item['message']['id'])
+                        for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                            label_changes[item['message']['id']] = item['message'].get('labelIds', [])
+                        for item in record.get('messagesDeleted', []):
+                            deleted.add(item['message']['id'])
+                    latest = page.get('historyId', latest)
+                    page_token = page.get('nextPageToken')
+                    if not page_token:
+                        break
+            except Exception as e:
+                # Gmail keeps roughly a week of history; older ids return 404
+                if _http_status(e) == 404:
+                    return self.full_sync(gmail_service)
+                raise
+
+            new_ids = [i for i in dict.fromkeys(added) if i not in deleted]
+            # A label change can bring in a message the mirror never had: one
+            # restored from Trash or Spam, which the full sync's listing skips
+            unknown = [
+                i for i in label_changes
+                if i not in deleted and i not in new_ids and not self._conn.execute(
+                    "SELECT 1 FROM messages WHERE id = ?", (i,)
+                ).fetchone()
+            ]
+            unknown_ids = set(unknown)
+            fetch_ids = new_ids + unknown
+            messages = self._fetch_metadata(gmail_service, fetch_ids) if fetch_ids else []
+            if unknown and self._get_state('complete') != '1':
+                # A partial mirror holds the newest messages only; older ones
+                # stay out, so the mirror never has gaps inside its range
+                oldest = self._conn.execute("SELECT MIN(internal_date) FROM messages").fetchone()[0]
+                messages = [
+                    m for m in messages
+                    if m['id'] not in unknown_ids or int(m.get('internalDate', 0)) >= (oldest or 0)
+                ]
+            with self._conn:
+                self._store(messages)
+                fetched = {m['id'] for m in messages}
+                for message_id, label_ids in label_changes.items():
+                    if message_id in fetched or message_id in deleted or message_id in unknown_ids:
+                        continue
+                    self._set_labels(message_id, label_ids)
+                for message_id in deleted:
+                    self._delete(message_id)
+                self._set_state('history_id', latest)
+            self._last_sync = time.monotonic()
+            return bool(messages or label_changes or deleted)
+
+    def sync(self, gmail_service, force=False):
+        """Bring the mirror up to date unless it was synced recently; True if it changed"""
+        with self._lock:
+            if self.history_id is None:
+                return self.full_sync(gmail_service)
+            if force or not self.is_fresh():
+                return self.incremental_sync(gmail_service)
+            return False
+
+    # -- reads ------------------------------------------------------------
+
+    def query(self, query, max_results):
+        """Answer a list query locally, or return None if the API is needed"""
+        parsed = parse_query(query)
+        if parsed is None:
+            return None
+        clauses, params = parsed
+        hidden = ", ".join("?" for _ in HIDDEN_LABELS)
+        clauses.append(
+            f"NOT EXISTS (SELECT 1 FROM message_labels h "
+            f"WHERE h.message_id = m.id AND h.label_id IN ({hidden}))"
+        )
+        params.extend(HIDDEN_LABELS)
+        sql = (
+            "SELECT m.id, m.from_header, m.subject, m.date_header FROM messages m "
+            f"WHERE {' AND '.join(clauses)} ORDER BY m.internal_date DESC LIMIT ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, params + [int(max_results)]).fetchall()
+            complete = self._get_state('complete') == '1'
+        # Older matches may exist outside a partial mirror
+        if len(rows) < max_results and not complete:
+            return None
+        return [
+            {'id': row[0], 'from': row[1], 'subject': row[2], 'date': row[3]}
+            for row in rows
+        ]
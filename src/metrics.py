@@ -0,0 +1,334 @@
+"""Prometheus metrics and optional trace spans for both servers.
+
+Everything lives in process memory and is rendered in the Prometheus text
+format by exposition(): per-tool latency histograms and error counts, Google
+API round trips per tool invocation, Gmail batch sizes, plus the counters
+the response cache and payload.stats already keep.
+
+With GOOGLE_TRACE set, every HTTP round trip to Google is written as a JSON
+line (to stderr for "1", otherwise to that file), followed by a summary line
+per tool invocation, so an N+1 loop shows up as a run of identical spans.
+"""
+import contextvars
+import inspect
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import payload
+from payload import attributed
+
+PREFIX = 'google_mcp'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+TRACE = os.environ.get('GOOGLE_TRACE', '')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = f'{PREFIX}_{name}'
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(c[0]), c[1], c[2]) for key, c in self._values.items()}
+        for key, (buckets, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            for bound, bucket_count in zip(self.buckets, buckets):
+                yield self.name + '_bucket', {**labels, 'le': _number(bound)}, bucket_count
+            yield self.name + '_bucket', {**labels, 'le': '+Inf'}, count
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+_registry = []
+
+TOOL_CALLS = Counter('tool_calls_total', 'Tool calls by outcome', ('tool', 'outcome'))
+TOOL_DURATION = Histogram('tool_duration_seconds', 'Tool call latency, cache hits included', ('tool',))
+TOOL_ERRORS = Counter('tool_errors_total', 'Failed tool calls by error class', ('tool', 'error_class', 'status'))
+API_CALLS = Counter('google_api_requests_total', 'HTTP round trips to Google', ('tool', 'method', 'status'))
+API_DURATION = Histogram('google_api_request_seconds', 'Latency of HTTP round trips to Google', ('tool',))
+API_CALLS_PER_INVOCATION = Histogram(
+    'google_api_requests_per_invocation', 'HTTP round trips per tool invocation', ('tool',),
+    buckets=COUNT_BUCKETS
+)
+RETRIES = Counter('google_api_retries_total', 'Requests retried after throttling or 5xx', ('api', 'status'))
+THROTTLE_SECONDS = Counter(
+    'scheduler_wait_seconds_total', 'Time requests waited for quota', ('api',)
+)
+COALESCED = Counter(
+    'coalesced_requests_total', 'Requests answered by an identical one already in flight', ('level',)
+)
+GMAIL_BATCH_SIZE = Histogram(
+    'gmail_batch_size', 'Requests per Gmail batch round trip', (), buckets=(1, 5, 10, 25, 50, 100)
+)
+CHAT_FIRST_TOKEN = Histogram('chat_first_token_seconds', 'Time from a /chat request to its first token')
+CHAT_PREFETCH = Counter('chat_prefetched_tools_total', 'Tools started before the model was asked', ('tool',))
+OUTBOX_ITEMS = Counter(
+    'outbox_items_total', 'Bulk write items by outcome of an attempt (done, retried, failed)', ('tool', 'outcome')
+)
+PUSH_NOTIFICATIONS = Counter(
+    'push_notifications_total', 'Push notifications by snapshot and outcome (accepted, ignored, rejected)',
+    ('snapshot', 'outcome')
+)
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def http_status(exc):
+    resp = getattr(exc, 'resp', None)
+    return getattr(resp, 'status', None)
+
+
+# -- tool invocations -------------------------------------------------------
+
+class _Invocation:
+    _ids = itertools.count(1)
+
+    def __init__(self, tool):
+        self.tool = tool
+        self.trace_id = f'{os.getpid():x}-{next(self._ids):x}'
+        self.api_calls = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def next_call(self):
+        with self._lock:
+            self.api_calls += 1
+            return self.api_calls
+
+
+_invocation = contextvars.ContextVar('invocation', default=None)
+
+
+def _finish(invocation):
+    API_CALLS_PER_INVOCATION.observe(invocation.api_calls, tool=invocation.tool)
+    _trace({
+        'trace': invocation.trace_id,
+        'tool': invocation.tool,
+        'span': 'tool',
+        'api_calls': invocation.api_calls,
+        'ms': round((time.perf_counter() - invocation.started) * 1000, 2),
+    })
+
+
+def instrumented(tool, fn):
+    """payload.attributed(tool, fn) that also counts Google round trips.
+
+    Like attributed(), the invocation is stored in the worker's private
+    context copy; the page prefetch thread copies it too, so its requests
+    count towards the same invocation.
+    """
+    fn = attributed(tool, fn)
+    if inspect.isgeneratorfunction(fn):
+        def run(*args):
+            invocation = _Invocation(tool)
+            _invocation.set(invocation)
+            try:
+                yield from fn(*args)
+            finally:
+                _finish(invocation)
+    else:
+        def run(*args):
+            invocation = _Invocation(tool)
+            _invocation.set(invocation)
+            try:
+                return fn(*args)
+            finally:
+                _finish(invocation)
+    return run
+
+
+def record_api_call(method, uri, status, seconds, nbytes):
+    """Count one HTTP round trip to Google and trace it"""
+    invocation = _invocation.get()
+    tool = invocation.tool if invocation else (payload.current_tool.get() or 'other')
+    API_CALLS.inc(tool=tool, method=method, status=status)
+    API_DURATION.observe(seconds, tool=tool)
+    if TRACE:
+        _trace({
+            'trace': invocation.trace_id if invocation else None,
+            'tool': tool,
+            'seq': invocation.next_call() if invocation else None,
+            'span': f'{method} {urlsplit(uri).path}',
+            'status': status,
+            'bytes': nbytes,
+            'ms': round(seconds * 1000, 2),
+        })
+    elif invocation:
+        invocation.next_call()
+
+
+payload.observers.append(record_api_call)
+
+
+def observe_call(tool, seconds, error=None):
+    """Record one finished tool call"""
+    TOOL_DURATION.observe(seconds, tool=tool)
+    if error is None:
+        TOOL_CALLS.inc(tool=tool, outcome='ok')
+        return
+    TOOL_CALLS.inc(tool=tool, outcome='error')
+    TOOL_ERRORS.inc(
+        tool=tool, error_class=type(error).__name__, status=http_status(error) or ''
+    )
+
+
+# -- traces -----------------------------------------------------------------
+
+_trace_lock = threading.Lock()
+
+
+def _trace(span):
+    if not TRACE:
+        return
+    line = json.dumps({'ts': round(time.time(), 3), **span}) + '\n'
+    with _trace_lock:
+        if TRACE.lower() in ('1', 'true', 'yes', 'on', 'stderr'):
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            with open(TRACE, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+# -- exposition -------------------------------------------------------------
+
+def _family(name, kind, help_text, samples):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for sample_name, labels, value in samples:
+        if labels:
+            rendered = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f'{sample_name}{{{rendered}}} {_number(value)}')
+        else:
+            lines.append(f'{sample_name} {_number(value)}')
+    return lines
+
+
+def _cache_families(cache):
+    stats = cache.stats()
+    yield _family(f'{PREFIX}_cache_entries', 'gauge', 'Cached tool results', [
+        (f'{PREFIX}_cache_entries', {}, stats['entries'])
+    ])
+    yield _family(f'{PREFIX}_cache_evictions_total', 'counter', 'LRU evictions', [
+        (f'{PREFIX}_cache_evictions_total', {}, stats['evictions'])
+    ])
+    yield _family(f'{PREFIX}_cache_requests_total', 'counter', 'Cache lookups by result', [
+        (f'{PREFIX}_cache_requests_total', {'tool': tool, 'result': result}, counts[key])
+        for tool, counts in stats['tools'].items()
+        for result, key in (('hit', 'hits'), ('miss', 'misses'))
+    ])
+
+
+def _payload_families():
+    tools = payload.stats.snapshot()
+    name = f'{PREFIX}_google_response_bytes_total'
+    yield _family(name, 'counter', 'Decoded bytes received from Google', [
+        (name, {'tool': tool}, entry['bytes']) for tool, entry in sorted(tools.items())
+    ])
+    name = f'{PREFIX}_google_gzip_responses_total'
+    yield _family(name, 'counter', 'Google responses that arrived gzip-compressed', [
+        (name, {'tool': tool}, entry['gzip_responses']) for tool, entry in sorted(tools.items())
+    ])
+    name = f'{PREFIX}_google_decode_seconds_total'
+    yield _family(name, 'counter', 'Time spent parsing Google JSON responses', [
+        (name, {'tool': tool}, entry['decode_ms'] / 1000) for tool, entry in sorted(tools.items())
+    ])
+
+
+def exposition(cache=None):
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(_family(metric.name, metric.kind, metric.help, metric.samples()))
+    for family in _payload_families():
+        lines.extend(family)
+    if cache is not None:
+        for family in _cache_families(cache):
+            lines.extend(family)
+    return '\n'.join(lines) + '\n'
+
+
+def start_file_dump(path, interval, cache=None):
+    """Rewrite path with exposition() every interval seconds on a daemon thread"""
+    def dump():
+        directory = os.path.dirname(os.path.abspath(path))
+        failing = False
+        while True:
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(exposition(cache))
+                os.replace(tmp_path, path)
+                failing = False
+            except Exception as e:
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                # Reported once per run of failures, then retried quietly
+                if not failing:
+                    sys.stderr.write(f"metrics: cannot write {path}: {e}\n")
+                    sys.stderr.flush()
+                    failing = True
+            time.sleep(interval)
+
+    thread = threading.Thread(target=dump, name='metrics-dump', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,209 @@
+"""Body and attachment extraction for format='full' Gmail messages.
+
+The walker visits parts at any depth without recursion, picks text/plain
+(or text/html, stripped to text, when there is no plain part) and decodes
+only that part, and only as much of it as the body limit needs. Attachments
+are listed as references; their data is fetched separately with
+gmail_get_attachment. strip_quoted drops the earlier messages a reply quotes,
+which in a thread are already there in full.
+"""
+import base64
+import codecs
+import os
+import re
+from email.message import Message
+from html import unescape
+from html.parser import HTMLParser
+
+# Longest body returned, in characters; longer bodies end with a marker
+MAX_BODY_CHARS = int(os.environ.get('GMAIL_MAX_BODY_CHARS', '20000'))
+# HTML is mostly markup, so decode this many bytes per character kept
+HTML_BYTES_PER_CHAR = 8
+# Partial-response masks cannot recurse; this covers every nesting seen in practice
+MAX_PART_DEPTH = 5
+
+PART_FIELDS = 'partId,mimeType,filename,headers(name,value),body(size,data,attachmentId)'
+
+# Lines that introduce the quoted original below a reply: "On ... wrote:"
+# (often wrapped onto a second line), Outlook's separators and headers
+_REPLY_HEADER = re.compile(
+    r'^(?:On\b[^\n]*(?:\n[^\n]*)?\bwrote:[ \t]*$'
+    r'|-{2,}[ \t]*(?:Original|Forwarded) Message[ \t]*-{2,}'
+    r'|_{10,}[ \t]*\n(?:From|De|Von):'
+    r'|From:[^\n]*\n(?:Sent|Date):[^\n]*\n)',
+    re.MULTILINE
+)
+QUOTE_MARKER = '[... quoted text hidden]'
+
+
+def message_fields(depth=MAX_PART_DEPTH):
+    """fields= mask for messages.get(format='full') down to depth nested parts"""
+    parts = PART_FIELDS
+    for _ in range(depth):
+        parts = f'{PART_FIELDS},parts({parts})'
+    return f'id,payload({parts})'
+
+
+def header_map(part):
+    return {h['name']: h['value'] for h in part.get('headers', [])}
+
+
+def walk_parts(payload):
+    """Yield every part of a payload depth-first, in document order"""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        yield part
+        stack.extend(reversed(part.get('parts', [])))
+
+
+def _is_attachment(part):
+    if part.get('filename'):
+        return True
+    disposition = header_map(part).get('Content-Disposition', '')
+    return disposition.lower().startswith('attachment')
+
+
+def _charset(part):
+    content_type = header_map(part).get('Content-Type')
+    if not content_type:
+        return 'utf-8'
+    message = Message()
+    message['Content-Type'] = content_type
+    charset = message.get_content_charset() or 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        return 'utf-8'
+    return charset
+
+
+def decode_data(data, max_bytes=None):
+    """Decode base64url body data, only the first max_bytes if given.
+
+    Returns (raw bytes, whether the data was cut short).
+    """
+    truncated = False
+    if max_bytes is not None:
+        needed = -(-max_bytes // 3) * 4
+        if len(data) > needed:
+            data, truncated = data[:needed], True
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    if max_bytes is not None and len(raw) > max_bytes:
+        raw, truncated = raw[:max_bytes], True
+    return raw, truncated
+
+
+class _TextExtractor(HTMLParser):
+    SKIP = {'script', 'style', 'head', 'title', 'template'}
+    BREAKS = {'br', 'p', 'div', 'li', 'tr', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'blockquote', 'pre', 'hr', 'section', 'article', 'header', 'footer'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BREAKS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.BREAKS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.chunks.append(data)
+
+
+def html_to_text(html):
+    """Visible text of an HTML document, with block elements as line breaks"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = unescape(''.join(parser.chunks))
+    text = re.sub(r'[ \t\r\f\v\xa0]+', ' ', text)
+    text = re.sub(r' ?\n ?', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+def find_body_part(payload):
+    """The part holding the message text: first text/plain, else first text/html"""
+    html = None
+    for part in walk_parts(payload):
+        mime_type = part.get('mimeType', '')
+        if not mime_type.startswith('text/') or _is_attachment(part):
+            continue
+        if 'data' not in part.get('body', {}):
+            continue
+        if mime_type == 'text/plain':
+            return part
+        if mime_type == 'text/html' and html is None:
+            html = part
+    return html
+
+
+def strip_quoted(text):
+    """text without the quoted messages of a reply.
+
+    Drops everything from the first reply header on, and "> " lines of
+    inline replies. Text that is nothing but a quote is returned unchanged.
+    """
+    match = _REPLY_HEADER.search(text)
+    kept = text[:match.start()] if match else text
+    lines = [line for line in kept.split('\n') if not line.lstrip().startswith('>')]
+    stripped = re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+    if not stripped:
+        return text
+    if stripped != text.strip():
+        stripped += '\n\n' + QUOTE_MARKER
+    return stripped
+
+
+def extract_body(payload, max_chars=None, strip_quotes=False):
+    """Plain-text body of a payload, at most max_chars plus a truncation marker"""
+    max_chars = MAX_BODY_CHARS if max_chars is None else max_chars
+    part = find_body_part(payload)
+    if part is None:
+        return ""
+
+    is_html = part.get('mimeType') == 'text/html'
+    # Up to 4 bytes per character in UTF-8, far more for markup
+    per_char = HTML_BYTES_PER_CHAR if is_html else 4
+    raw, truncated = decode_data(part['body']['data'], max_chars * per_char)
+    decoder = codecs.getincrementaldecoder(_charset(part))(errors='replace')
+    text = decoder.decode(raw, final=not truncated)
+    if is_html:
+        text = html_to_text(text)
+    if strip_quotes:
+        text = strip_quoted(text)
+
+    total = part['body'].get('size') or len(raw)
+    if len(text) > max_chars:
+        text, truncated = text[:max_chars], True
+    if truncated:
+        text += f"\n\n[... body truncated at {max_chars} characters of about {total} bytes]"
+    return text
+
+
+def list_attachments(payload):
+    """Lazy references to the attachments of a payload"""
+    attachments = []
+    for part in walk_parts(payload):
+        body = part.get('body', {})
+        if not _is_attachment(part) or 'attachmentId' not in body:
+            continue
+        attachments.append({
+            'attachment_id': body['attachmentId'],
+            'filename': part.get('filename') or None,
+            'mime_type': part.get('mimeType'),
+            'size': body.get('size'),
+            'part_id': part.get('partId')
+        })
+    return attachments
@@ -0,0 +1,562 @@
+"""Durable outbox behind the bulk write tools.
+
+calendar_create_events and gmail_send_messages only record their items in a
+SQLite file next to token.pickle and return a job ID. Worker threads then
+send the items to Google in batch requests, one HTTP round trip per
+OUTBOX_BATCH_SIZE events or OUTBOX_SEND_BATCH_SIZE emails, paced by the
+quota scheduler like every other request. Throttled and failed items are
+retried with backoff, outbox_job_status reports every item's progress, and
+whatever was queued or in flight when the process stopped is picked up again
+on the next start.
+
+Every stdio session is a process of its own, and all of them may drain the
+same file. A worker claims a batch in a write transaction, recording its
+process as the owner with a lease that a heartbeat keeps extending, and only
+the owner may finish or retry the items. Items whose lease ran out (their
+process died) go back to the queue for any process to claim.
+
+Each item carries a client idempotency key, unique per account and tool.
+Submitting a key again points at the job that already holds it instead of
+queueing a second copy, and a retried item is never applied twice:
+- an event is inserted with an ID derived from its key, so a repeated insert
+  gets 409 Conflict and the existing event is reported instead
+- an email is saved as a draft first and the draft ID recorded before it is
+  sent. Gmail sends a draft only once, so a repeated send gets 404 and the
+  item counts as sent. The draft's Message-ID is derived from the key too,
+  so when the answer to creating it was lost, the retry finds that draft
+  instead of making another one.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from accounts import active_account, current_account
+from cache import INVALIDATES
+from metrics import OUTBOX_ITEMS, http_status, instrumented
+from scheduler import is_retryable_error, shared as scheduler
+from tools import event_body, raw_message
+
+OUTBOX_FILENAME = 'outbox.sqlite3'
+# Calendar takes at most 50 calls per batch request
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+# A send costs 100 quota units, so a batch of 10 already waits about 5s for quota
+SEND_BATCH_SIZE = int(os.environ.get('OUTBOX_SEND_BATCH_SIZE', '10'))
+DEFAULT_WORKERS = int(os.environ.get('OUTBOX_WORKERS', '2'))
+MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+# Most items one call may queue
+MAX_ITEMS = int(os.environ.get('OUTBOX_MAX_ITEMS', '500'))
+# Finished jobs, and with them their idempotency keys, are kept this long
+RETENTION_DAYS = float(os.environ.get('OUTBOX_RETENTION_DAYS', '30'))
+# Claimed items stay with their process this long after its last heartbeat
+LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', '60'))
+MAX_KEY_LENGTH = 256
+
+# Bulk tool -> (argument holding the items, fields every item needs)
+ITEMS = {
+    'calendar_create_events': ('events', ('summary', 'start_time', 'end_time')),
+    'gmail_send_messages': ('messages', ('to', 'subject', 'body')),
+}
+# Bulk tool -> the single-item tool whose cached reads its items make stale
+SINGLE_TOOLS = {
+    'calendar_create_events': 'calendar_create_event',
+    'gmail_send_messages': 'gmail_send_message',
+}
+STATUSES = ('pending', 'running', 'done', 'failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    account TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    remote_id TEXT,
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, position),
+    UNIQUE (account, tool, idempotency_key)
+);
+CREATE INDEX IF NOT EXISTS items_ready ON items (status, next_attempt);
+"""
+# Columns added since the first version of the file
+MIGRATIONS = {
+    'owner': "ALTER TABLE items ADD COLUMN owner TEXT",
+    'lease_until': "ALTER TABLE items ADD COLUMN lease_until REAL NOT NULL DEFAULT 0",
+}
+
+
+def outbox_from_env(token_dir, executor, cache=None):
+    """Open the outbox unless OUTBOX=0 turns the bulk write tools off"""
+    if os.environ.get('OUTBOX', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    return Outbox.open(token_dir, executor, cache)
+
+
+def stable_id(account, key):
+    """ID derived from an idempotency key; hex digits are valid base32hex, as event IDs must be"""
+    return hashlib.sha256(f'{account}\0{key}'.encode()).hexdigest()[:32]
+
+
+def validate_items(tool, items):
+    """items, or ValueError naming the first one that cannot be queued"""
+    argument, required = ITEMS[tool]
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"{argument} must be a non-empty list")
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f"At most {MAX_ITEMS} {argument} per call, not {len(items)}")
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"{argument}[{index}] must be an object")
+        key = item.get('idempotency_key')
+        if not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH:
+            raise ValueError(
+                f"{argument}[{index}] needs an idempotency_key of 1 to {MAX_KEY_LENGTH} characters"
+            )
+        missing = [name for name in required if not isinstance(item.get(name), str) or not item[name]]
+        if missing:
+            raise ValueError(f"{argument}[{index}] is missing {', '.join(missing)}")
+        if not isinstance(item.get('attendees', []), list):
+            raise ValueError(f"{argument}[{index}].attendees must be a list of emails")
+    return items
+
+
+def _batch(service, requests):
+    """Execute requests as one batch; responses in order, exceptions in place of failures"""
+    results = [None] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = exception if exception is not None else response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for index, request in enumerate(requests):
+        batch.add(request, request_id=str(index))
+    batch.execute()
+    return results
+
+
+def _message_id(item):
+    return f"<{item['stable_id']}@outbox.mcp-google-services>"
+
+
+def _retryable(error):
+    # No HTTP status: the connection failed or timed out, so try again
+    return http_status(error) is None or is_retryable_error(error)
+
+
+def _describe(error):
+    status = http_status(error)
+    reason = getattr(error, 'reason', None) or str(error) or type(error).__name__
+    return f"{status} {reason}" if status else reason
+
+
+def _job_status(counts):
+    if counts['pending'] or counts['running']:
+        return 'running' if counts['running'] or counts['done'] or counts['failed'] else 'queued'
+    if not counts['failed']:
+        return 'done'
+    return 'failed' if not counts['done'] else 'partial'
+
+
+class Outbox:
+    """SQLite queue of bulk write items, drained in batches by worker threads"""
+
+    def __init__(self, path, executor, cache=None, workers=None, clock=time.time):
+        self.path = path
+        self.executor = executor
+        self.cache = cache
+        self.workers = workers or DEFAULT_WORKERS
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._wake = threading.Condition(self._lock)
+        # Bumped by every notify, so a worker that was claiming does not miss one
+        self._wakeups = 0
+        # Other processes' workers hold the write lock only briefly
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Status queries read while a worker writes
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(items)")}
+        with self._conn:
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    self._conn.execute(statement)
+        # The workers write through their own connection and lock, so waiting
+        # for another process's write lock never holds up submit() or job()
+        self._worker_lock = threading.Lock()
+        self._worker_conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Marks the items this process claimed
+        self.owner = uuid.uuid4().hex
+        self._threads = []
+        self._stopping = False
+
+    @classmethod
+    def open(cls, token_dir, executor, cache=None, **kwargs):
+        return cls(os.path.join(token_dir, OUTBOX_FILENAME), executor, cache, **kwargs)
+
+    def start(self):
+        """Start the workers and the heartbeat that keeps their claims"""
+        with self._lock, self._conn:
+            self._prune()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'outbox-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name='outbox-lease', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def close(self, timeout=5.0):
+        """Stop the workers after their current batch and close the database"""
+        with self._wake:
+            self._stopping = True
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._worker_lock:
+            self._worker_conn.close()
+        with self._lock:
+            self._conn.close()
+
+    def _notify(self):
+        # Called holding self._wake
+        self._wakeups += 1
+        self._wake.notify_all()
+
+    def _prune(self):
+        cutoff = self._clock() - RETENTION_DAYS * 86400
+        self._conn.execute(
+            "DELETE FROM items WHERE status IN ('done', 'failed') "
+            "AND job_id IN (SELECT id FROM jobs WHERE created < ?)", (cutoff,)
+        )
+        self._conn.execute(
+            "DELETE FROM jobs WHERE created < ? AND id NOT IN (SELECT job_id FROM items)", (cutoff,)
+        )
+
+    # -- the tools' side ----------------------------------------------------
+
+    def submit(self, tool, items):
+        """Queue items as one job of the current account and acknowledge them.
+
+        Returns the job ID (None when every item was queued before), how
+        many items were accepted, and for the rest the job already holding
+        their idempotency key.
+        """
+        validate_items(tool, items)
+        account = active_account() or ''
+        job_id = uuid.uuid4().hex
+        accepted, duplicates = 0, []
+        with self._wake, self._conn:
+            for index, item in enumerate(items):
+                key = item['idempotency_key']
+                row = self._conn.execute(
+                    "SELECT job_id, position, status FROM items "
+                    "WHERE account = ? AND tool = ? AND idempotency_key = ?",
+                    (account, tool, key)
+                ).fetchone()
+                if row is not None:
+                    duplicates.append({
+                        'index': index, 'idempotency_key': key,
+                        'job_id': row[0], 'job_index': row[1], 'status': row[2],
+                    })
+                    continue
+                payload = {name: value for name, value in item.items() if name != 'idempotency_key'}
+                remote_id = stable_id(account, key) if tool == 'calendar_create_events' else None
+                self._conn.execute(
+                    "INSERT INTO items (job_id, position, account, tool, idempotency_key, payload, "
+                    "remote_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, index, account, tool, key, json.dumps(payload), remote_id)
+                )
+                accepted += 1
+            if accepted:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, account, tool, created) VALUES (?, ?, ?, ?)",
+                    (job_id, account, tool, self._clock())
+                )
+                self._notify()
+        result = {'job_id': job_id if accepted else None, 'accepted': accepted}
+        if duplicates:
+            result['duplicates'] = duplicates
+        return result
+
+    def job(self, job_id):
+        """Progress of one of the current account's jobs, item by item"""
+        account = active_account() or ''
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT tool, created FROM jobs WHERE id = ? AND account = ?", (job_id, account)
+            ).fetchone()
+            if job is None:
+                raise ValueError(f"Unknown job: {job_id}")
+            rows = self._conn.execute(
+                "SELECT position, idempotency_key, status, attempts, result, error "
+                "FROM items WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        items = []
+        for position, key, status, attempts, result, error in rows:
+            counts[status] += 1
+            item = {'index': position, 'idempotency_key': key, 'status': status, 'attempts': attempts}
+            if result is not None:
+                item['result'] = json.loads(result)
+            if error is not None:
+                # On a pending item: why the last attempt is being retried
+                item['error'] = error
+            items.append(item)
+        return {
+            'job_id': job_id,
+            'tool': job[0],
+            'created': datetime.fromtimestamp(job[1], timezone.utc).isoformat(),
+            'status': _job_status(counts),
+            'counts': counts,
+            'items': items,
+        }
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT tool, status, COUNT(*) FROM items GROUP BY tool, status"
+            ).fetchall()
+            jobs = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        tools = {}
+        for tool, status, count in rows:
+            tools.setdefault(tool, dict.fromkeys(STATUSES, 0))[status] = count
+        return {'jobs': jobs, 'workers': self.workers, 'items': tools}
+
+    # -- the workers' side --------------------------------------------------
+
+    def _heartbeat(self):
+        while True:
+            with self._wake:
+                self._wake.wait(LEASE_SECONDS / 3)
+                if self._stopping:
+                    return
+            with self._worker_lock, self._worker_conn:
+                self._worker_conn.execute(
+                    "UPDATE items SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                    (self._clock() + LEASE_SECONDS, self.owner)
+                )
+
+    def _claim(self):
+        """((account, tool, items), None) for the next batch, or (None, seconds until one is due)"""
+        with self._worker_lock:
+            now = self._clock()
+            # The write lock from the start: no other process claims in between
+            self._worker_conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Their process died mid-batch; the idempotency keys make a retry safe
+                self._worker_conn.execute(
+                    "UPDATE items SET status = 'pending', owner = NULL "
+                    "WHERE status = 'running' AND lease_until < ?", (now,)
+                )
+                batch, wait = self._claim_batch(now)
+                self._worker_conn.commit()
+            except BaseException:
+                self._worker_conn.rollback()
+                raise
+        return batch, wait
+
+    def _claim_batch(self, now):
+        row = self._worker_conn.execute(
+            "SELECT account, tool FROM items WHERE status = 'pending' AND next_attempt <= ? "
+            "ORDER BY next_attempt, rowid LIMIT 1", (now,)
+        ).fetchone()
+        if row is None:
+            due = self._worker_conn.execute(
+                "SELECT MIN(next_attempt) FROM items WHERE status = 'pending'"
+            ).fetchone()[0]
+            # Another process may still finish or give up the running items
+            running = self._worker_conn.execute(
+                "SELECT MIN(lease_until) FROM items WHERE status = 'running'"
+            ).fetchone()[0]
+            due = min((t for t in (due, running) if t is not None), default=None)
+            return None, None if due is None else max(0.0, due - now)
+
+        account, tool = row
+        size = SEND_BATCH_SIZE if tool == 'gmail_send_messages' else BATCH_SIZE
+        candidates = self._worker_conn.execute(
+            "SELECT rowid, idempotency_key, payload, attempts, remote_id FROM items "
+            "WHERE status = 'pending' AND next_attempt <= ? AND account = ? AND tool = ? "
+            "ORDER BY rowid LIMIT ?", (now, account, tool, max(1, size))
+        ).fetchall()
+        rows = [
+            r for r in candidates
+            if self._worker_conn.execute(
+                "UPDATE items SET status = 'running', owner = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE rowid = ? AND status = 'pending'",
+                (self.owner, now + LEASE_SECONDS, r[0])
+            ).rowcount == 1
+        ]
+        items = [
+            {'rowid': rowid, 'tool': tool, 'key': key, 'payload': json.loads(payload),
+             'attempts': attempts + 1, 'remote_id': remote_id, 'stable_id': stable_id(account, key)}
+            for rowid, key, payload, attempts, remote_id in rows
+        ]
+        return (account or None, tool, items), None
+
+    def _work(self):
+        while True:
+            with self._wake:
+                if self._stopping:
+                    return
+                wakeups = self._wakeups
+            batch, wait = self._claim()
+            if batch is None:
+                with self._wake:
+                    # Items queued while claiming were not seen by the claim
+                    if self._wakeups == wakeups and not self._stopping:
+                        self._wake.wait(wait)
+                continue
+            account, tool, items = batch
+            try:
+                # A fresh context, so the account and metrics stay with this batch
+                contextvars.Context().run(self._execute, account, tool, items)
+            except Exception as e:
+                # The batch request itself failed; nothing in it is known to be done
+                for item in items:
+                    self._attempt_failed(item, e)
+
+    def _execute(self, account, tool, items):
+        current_account.set(account)
+        handler = {
+            'calendar_create_events': self._create_events,
+            'gmail_send_messages': self._send_messages,
+        }[tool]
+        instrumented(tool, handler)(*self.executor.services(), items)
+        if self.cache is not None:
+            self.cache.invalidate(*INVALIDATES[SINGLE_TOOLS[tool]], account=active_account())
+
+    def _create_events(self, calendar_service, gmail_service, items):
+        events = calendar_service.events()
+        outcomes = _batch(calendar_service, [
+            events.insert(
+                calendarId='primary',
+                body=dict(event_body(item['payload']), id=item['remote_id']),
+                fields='id,htmlLink'
+            )
+            for item in items
+        ])
+        # The ID is taken: an earlier attempt created the event but its answer was lost
+        existing = [i for i, outcome in enumerate(outcomes) if http_status(outcome) == 409]
+        if existing:
+            found = _batch(calendar_service, [
+                events.get(calendarId='primary', eventId=items[i]['remote_id'], fields='id,htmlLink')
+                for i in existing
+            ])
+            for i, event in zip(existing, found):
+                outcomes[i] = event if isinstance(event, Exception) else dict(event, existed=True)
+
+        for item, outcome in zip(items, outcomes):
+            if isinstance(outcome, Exception):
+                self._attempt_failed(item, outcome)
+                continue
+            result = {'event_link': outcome.get('htmlLink'), 'id': outcome.get('id')}
+            if outcome.get('existed'):
+                result['already_created'] = True
+            self._done(item, result)
+
+    def _send_messages(self, calendar_service, gmail_service, items):
+        drafts = gmail_service.users().drafts()
+        # A retry may have a draft whose ID never reached us; look for its Message-ID
+        lost = [item for item in items if not item['remote_id'] and item['attempts'] > 1]
+        found = _batch(gmail_service, [
+            drafts.list(userId='me', q=f"rfc822msgid:{_message_id(item)}", fields='drafts/id')
+            for item in lost
+        ]) if lost else []
+        unknown = set()
+        for item, listing in zip(lost, found):
+            if isinstance(listing, Exception):
+                # Without the answer a new draft could duplicate one; try again later
+                self._attempt_failed(item, listing)
+                unknown.add(item['rowid'])
+            elif listing.get('drafts'):
+                self._set_draft(item, listing['drafts'][0]['id'])
+
+        fresh = [item for item in items if not item['remote_id'] and item['rowid'] not in unknown]
+        created = _batch(gmail_service, [
+            drafts.create(
+                userId='me',
+                body={'message': {'raw': raw_message(item['payload'], _message_id(item))}},
+                fields='id'
+            )
+            for item in fresh
+        ]) if fresh else []
+        for item, draft in zip(fresh, created):
+            if isinstance(draft, Exception):
+                self._attempt_failed(item, draft)
+            else:
+                self._set_draft(item, draft['id'])
+
+        ready = [item for item in items if item['remote_id']]
+        if not ready:
+            return
+        fresh_rows = {item['rowid'] for item in fresh}
+        sent = _batch(gmail_service, [
+            drafts.send(userId='me', body={'id': item['remote_id']}, fields='id') for item in ready
+        ])
+        for item, outcome in zip(ready, sent):
+            if http_status(outcome) == 404 and item['rowid'] not in fresh_rows:
+                # The draft is gone: an earlier attempt sent it but its answer was lost
+                self._done(item, {'message_id': None, 'already_sent': True})
+            elif isinstance(outcome, Exception):
+                self._attempt_failed(item, outcome)
+            else:
+                self._done(item, {'message_id': outcome['id']})
+
+    def _set_draft(self, item, draft_id):
+        # Recorded before sending, so any retry sends this draft and no other
+        with self._worker_lock, self._worker_conn:
+            kept = self._worker_conn.execute(
+                "UPDATE items SET remote_id = ? WHERE rowid = ? AND status = 'running' AND owner = ?",
+                (draft_id, item['rowid'], self.owner)
+            ).rowcount
+        # Without the claim the item is not sent; its new owner finds the draft
+        if kept:
+            item['remote_id'] = draft_id
+
+    def _done(self, item, result):
+        with self._worker_lock, self._worker_conn:
+            self._worker_conn.execute(
+                "UPDATE items SET status = 'done', result = ?, error = NULL, owner = NULL "
+                "WHERE rowid = ? AND status = 'running' AND owner = ?",
+                (json.dumps(result), item['rowid'], self.owner)
+            )
+        OUTBOX_ITEMS.inc(tool=item['tool'], outcome='done')
+
+    def _attempt_failed(self, item, error):
+        """Retry the item after a backoff, or give up on it"""
+        retry = _retryable(error) and item['attempts'] < MAX_ATTEMPTS
+        with self._worker_lock, self._worker_conn:
+            changed = self._worker_conn.execute(
+                "UPDATE items SET status = ?, error = ?, next_attempt = ?, owner = NULL "
+                "WHERE rowid = ? AND status = 'running' AND owner = ?",
+                (
+                    'pending' if retry else 'failed',
+                    _describe(error),
+                    self._clock() + scheduler.delay(item['attempts'] - 1) if retry else 0,
+                    item['rowid'],
+                    self.owner,
+                )
+            ).rowcount
+        if retry:
+            with self._wake:
+                self._notify()
+        if changed:
+            OUTBOX_ITEMS.inc(tool=item['tool'], outcome='retried' if retry else 'failed')
@@ -0,0 +1,179 @@
+"""Cursor-based pagination for the list tools.
+
+iter_pages walks nextPageToken lazily and, while the caller works on one page,
+fetches the next one on a helper thread with its own HTTP transport (the
+caller's transport is not thread-safe). Cursors handed to clients are opaque
+base64 blobs holding the page token, the offset inside that page and the
+arguments the listing was started with.
+"""
+import base64
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Hard cap on items a single call may return, whatever max_results says
+MAX_TOTAL_ITEMS = int(os.environ.get('TOOL_MAX_TOTAL_ITEMS', '500'))
+
+_prefetch_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('GOOGLE_MAX_WORKERS', '8')),
+    thread_name_prefix='google-prefetch'
+)
+_local = threading.local()
+
+
+class Page(list):
+    """A list of items plus the cursor for the rest, if there is more"""
+
+    def __init__(self, items=(), next_cursor=None):
+        super().__init__(items)
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(page_token, offset, arguments):
+    payload = {'t': page_token, 'o': offset, 'a': arguments}
+    raw = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, arguments):
+    """(page_token, offset, arguments) for a cursor.
+
+    Arguments the caller repeats must match the ones the cursor was issued
+    for; arguments left out are taken from the cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        token, offset, issued = payload['t'], int(payload['o']), payload['a']
+    except Exception:
+        raise ValueError("Invalid cursor") from None
+    for key, value in arguments.items():
+        if value is not None and issued.get(key) != value:
+            raise ValueError(f"Cursor was issued for a different {key}")
+    return token, offset, issued
+
+
+def _own_http(http):
+    """A transport for the current prefetch thread, sharing credentials"""
+    from executor import authorized_http
+
+    credentials = getattr(http, 'credentials', None)
+    key = id(credentials)
+    cache = getattr(_local, 'https', None)
+    if cache is None:
+        cache = _local.https = {}
+    if key not in cache:
+        cache[key] = authorized_http(credentials, getattr(http, 'timeout', None))
+    return cache[key]
+
+
+def _execute_elsewhere(request):
+    return request.execute(http=_own_http(request.http))
+
+
+def execute_all(requests):
+    """Execute requests concurrently on the prefetch pool.
+
+    Returns the responses in order, with the exception in place of any
+    request that failed.
+    """
+    futures = [
+        _prefetch_pool.submit(contextvars.copy_context().run, _execute_elsewhere, request)
+        for request in requests
+    ]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def iter_pages(make_request, page_token=None, prefetch=True, items_key=None, limit=None):
+    """Yield (page_token, response) for each page, fetching lazily.
+
+    make_request(page_token) must build (not execute) the request. With
+    prefetch, the next page is requested as soon as the current one is
+    handed out, unless items_key/limit show the caller already has enough.
+    """
+    response = make_request(page_token).execute()
+    seen = 0
+    pending = None
+    try:
+        while True:
+            next_token = response.get('nextPageToken')
+            if items_key is not None:
+                seen += len(response.get(items_key, []))
+            wanted = limit is None or seen < limit
+            if prefetch and next_token and wanted:
+                pending = _prefetch_pool.submit(
+                    contextvars.copy_context().run, _execute_elsewhere, make_request(next_token)
+                )
+            yield page_token, response
+            if not next_token:
+                return
+            page_token = next_token
+            if pending is not None:
+                response, pending = pending.result(), None
+            else:
+                response = make_request(page_token).execute()
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+def collect_pages(make_request, items_key, max_results, cursor, arguments, page_max, defaults=None):
+    """All raw items up to max_results as a Page, plus the arguments used"""
+    items, next_cursor, used = [], None, arguments
+    for chunk, next_cursor, used in iter_page_items(
+        make_request, items_key, max_results, cursor, arguments, page_max, defaults
+    ):
+        items.extend(chunk)
+    return Page(items, next_cursor), used
+
+
+def iter_page_items(make_request, items_key, max_results, cursor, arguments, page_max, defaults=None):
+    """Yield (items, next_cursor, arguments) per page until max_results is reached.
+
+    make_request(page_token, page_size, arguments) builds one page request.
+    arguments holds what the caller passed (None when omitted); on a fresh
+    listing omitted ones come from defaults, on a resumed one from the cursor.
+    next_cursor is only set on the last chunk, and only if more items exist.
+    max_results is clipped to MAX_TOTAL_ITEMS.
+    """
+    limit = max(0, min(int(max_results), MAX_TOTAL_ITEMS))
+    token, offset = None, 0
+    if cursor:
+        token, offset, arguments = decode_cursor(cursor, arguments)
+    else:
+        arguments = {
+            key: (defaults or {}).get(key) if value is None else value
+            for key, value in arguments.items()
+        }
+    page_size = max(1, min(limit + offset, page_max))
+
+    collected = 0
+    pages = iter_pages(
+        lambda page_token: make_request(page_token, page_size, arguments),
+        token, items_key=items_key, limit=limit + offset
+    )
+    try:
+        for page_token, response in pages:
+            page_items = response.get(items_key, [])[offset:]
+            take = limit - collected
+            next_token = response.get('nextPageToken')
+            if len(page_items) > take:
+                yield page_items[:take], encode_cursor(page_token, offset + take, arguments), arguments
+                return
+            collected += len(page_items)
+            offset = 0
+            if collected >= limit or not next_token:
+                next_cursor = encode_cursor(next_token, 0, arguments) if next_token else None
+                yield page_items, next_cursor, arguments
+                return
+            yield page_items, None, arguments
+    finally:
+        pages.close()
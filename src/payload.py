@@ -0,0 +1,128 @@
+"""Response size and decode-time accounting for Google API calls.
+
+MeteredHttp sits under AuthorizedHttp on every worker transport. It makes sure
+each request, including the outer request of a batch, asks for gzip, and it
+counts the bytes of every response. MeteredModel wraps googleapiclient's JSON
+model and times the parsing of each response. Both record under the tool that
+is running, which attributed() puts into the worker's context.
+"""
+import contextvars
+import inspect
+import threading
+import time
+
+current_tool = contextvars.ContextVar('current_tool', default=None)
+# Called as fn(method, uri, status, seconds, nbytes) after every round trip
+observers = []
+
+
+class PayloadStats:
+    """Per-tool counters, safe to update from any worker thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools = {}
+
+    def _entry(self):
+        tool = current_tool.get() or 'other'
+        entry = self._tools.get(tool)
+        if entry is None:
+            entry = self._tools[tool] = {
+                'responses': 0, 'gzip_responses': 0, 'bytes': 0,
+                'decoded': 0, 'decode_seconds': 0.0
+            }
+        return entry
+
+    def record_response(self, nbytes, compressed):
+        with self._lock:
+            entry = self._entry()
+            entry['responses'] += 1
+            entry['bytes'] += nbytes
+            if compressed:
+                entry['gzip_responses'] += 1
+
+    def record_decode(self, seconds):
+        with self._lock:
+            entry = self._entry()
+            entry['decoded'] += 1
+            entry['decode_seconds'] += seconds
+
+    def snapshot(self):
+        """{tool: counters} with averages per HTTP response"""
+        with self._lock:
+            tools = {tool: dict(entry) for tool, entry in self._tools.items()}
+        for entry in tools.values():
+            responses = entry['responses'] or 1
+            entry['avg_bytes'] = round(entry['bytes'] / responses)
+            entry['decode_ms'] = round(entry.pop('decode_seconds') * 1000, 3)
+        return tools
+
+
+stats = PayloadStats()
+
+
+def attributed(tool, fn):
+    """fn, recording payload stats under tool while it runs.
+
+    The executor runs every call in a fresh copy of the caller's context, so
+    the tool name is set there and never needs resetting. Generator functions
+    stay generators so streaming tools keep working.
+    """
+    if inspect.isgeneratorfunction(fn):
+        def run(*args):
+            current_tool.set(tool)
+            yield from fn(*args)
+    else:
+        def run(*args):
+            current_tool.set(tool)
+            return fn(*args)
+    return run
+
+
+class MeteredHttp:
+    """httplib2.Http wrapper that negotiates gzip and counts response bytes.
+
+    googleapiclient only marks single requests as gzip-capable; Google also
+    wants "gzip" in the User-Agent before it compresses, which the outer batch
+    request lacks. httplib2 decompresses transparently, so the bytes counted
+    are the decoded payload; gzip_responses tells how many came compressed.
+    """
+
+    def __init__(self, http):
+        self.http = http
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        headers = dict(headers or {})
+        if 'gzip' not in headers.get('accept-encoding', ''):
+            headers['accept-encoding'] = 'gzip, deflate'
+        user_agent = headers.get('user-agent', '')
+        if 'gzip' not in user_agent:
+            headers['user-agent'] = (user_agent + ' (gzip)').lstrip()
+        started = time.perf_counter()
+        resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        nbytes = len(content or b'')
+        stats.record_response(nbytes, '-content-encoding' in resp)
+        for observer in observers:
+            observer(method, uri, resp.status, elapsed, nbytes)
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+class MeteredModel:
+    """googleapiclient model wrapper that times response deserialization"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def response(self, resp, content):
+        started = time.perf_counter()
+        try:
+            return self.model.response(resp, content)
+        finally:
+            stats.record_decode(time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -0,0 +1,401 @@
+"""Push notifications from Google keep the local snapshots fresh.
+
+Without push, the calendar store and the Gmail mirror poll: a read more than
+CALENDAR_STORE_SYNC_INTERVAL / GMAIL_MIRROR_SYNC_INTERVAL seconds after the
+last sync first asks Google for changes. With PUSH_WEBHOOK_URL set to the
+public HTTPS address the server is reachable at, Google says when something
+changed instead:
+- Calendar: an events.watch channel on the primary calendar posts to
+  /webhooks/calendar
+- Gmail: users.watch publishes to the Pub/Sub topic GMAIL_PUBSUB_TOPIC, whose
+  push subscription delivers to /webhooks/gmail?token=<PUSH_TOKEN>
+
+A notification only says that something changed, so it starts one delta sync
+(syncToken or history.list) of that snapshot; notifications arriving while
+it runs share a single further sync. Reads are answered from the snapshot
+without asking Google. Only a sync that found changes drops the cached read
+results and tells the listeners (the stdio server sends MCP
+resources/updated). Channels expire, so each is renewed PUSH_RENEW_BEFORE
+seconds ahead, the new one opened before the old one is stopped. As a
+notification can be lost, the snapshots still sync every PUSH_SYNC_INTERVAL
+seconds, and they go back to polling while their channel is down.
+
+Like the snapshots, push covers the default account only. The stdio server
+takes the webhooks on PUSH_HOST:PUSH_PORT, which only one process can hold:
+the session that binds it opens the channels, and any other session started
+meanwhile polls. A process only ever stops the channels it opened itself.
+"""
+import asyncio
+import base64
+import hmac
+import json
+import os
+import socket
+import time
+import uuid
+
+from accounts import DEFAULT_ACCOUNT
+from cache import INVALIDATES
+from metrics import PUSH_NOTIFICATIONS, instrumented
+
+WEBHOOK_URL = os.environ.get('PUSH_WEBHOOK_URL', '')
+# Shared secret: the calendar channels' token and the Gmail endpoint's ?token=
+PUSH_TOKEN = os.environ.get('PUSH_TOKEN', '')
+GMAIL_TOPIC = os.environ.get('GMAIL_PUBSUB_TOPIC', '')
+# Lifetime asked for a calendar channel; Google may grant less
+CHANNEL_TTL = int(os.environ.get('PUSH_CHANNEL_TTL', str(7 * 24 * 3600)))
+RENEW_BEFORE = float(os.environ.get('PUSH_RENEW_BEFORE', '3600'))
+# A Gmail watch lasts 7 days; Google recommends renewing it daily
+GMAIL_WATCH_INTERVAL = float(os.environ.get('GMAIL_WATCH_INTERVAL', '86400'))
+# How long a snapshot with a live channel is trusted without a notification
+SYNC_INTERVAL = float(os.environ.get('PUSH_SYNC_INTERVAL', '600'))
+# Seconds before a failed watch is tried again
+RETRY_DELAY = 60
+SYNC_ATTEMPTS = 3
+# Where the stdio server, which has no HTTP port of its own, takes the webhooks
+LISTEN_HOST = os.environ.get('PUSH_HOST', '127.0.0.1')
+LISTEN_PORT = int(os.environ.get('PUSH_PORT', '8001'))
+
+CALENDAR_PATH = '/webhooks/calendar'
+GMAIL_PATH = '/webhooks/gmail'
+# Snapshot -> the write tool whose INVALIDATES entry lists the reads it serves
+WRITE_TOOLS = {
+    'calendar': 'calendar_create_event',
+    'gmail': 'gmail_send_message',
+}
+
+
+def push_from_env(executor, calendar_store, gmail_mirror, cache=None):
+    """Create the push manager when PUSH_WEBHOOK_URL is set, otherwise return None"""
+    if not WEBHOOK_URL:
+        return None
+    if not PUSH_TOKEN:
+        raise ValueError("PUSH_WEBHOOK_URL needs PUSH_TOKEN, the secret notifications must carry")
+    if gmail_mirror is not None and not GMAIL_TOPIC:
+        gmail_mirror = None
+    if calendar_store is None and gmail_mirror is None:
+        raise ValueError(
+            "PUSH_WEBHOOK_URL needs CALENDAR_STORE=1, or GMAIL_MIRROR=1 and GMAIL_PUBSUB_TOPIC"
+        )
+    return PushManager(executor, WEBHOOK_URL, PUSH_TOKEN, calendar_store, gmail_mirror,
+                       GMAIL_TOPIC, cache)
+
+
+def _watch_calendar(calendar_service, gmail_service, channel_id, address, token, ttl):
+    return calendar_service.events().watch(calendarId='primary', body={
+        'id': channel_id, 'type': 'web_hook', 'address': address, 'token': token,
+        'params': {'ttl': str(ttl)},
+    }).execute()
+
+
+def _stop_channel(calendar_service, gmail_service, channel):
+    calendar_service.channels().stop(body=channel).execute()
+
+
+def _watch_gmail(calendar_service, gmail_service, topic):
+    return gmail_service.users().watch(userId='me', body={'topicName': topic}).execute()
+
+
+def _stop_gmail(calendar_service, gmail_service):
+    gmail_service.users().stop(userId='me').execute()
+
+
+def _sync(calendar_service, gmail_service, snapshot, store):
+    """(changed, Gmail historyId or None) after a forced sync"""
+    if snapshot == 'calendar':
+        return store.sync(calendar_service, force=True), None
+    changed = store.sync(gmail_service, force=True)
+    return changed, int(store.history_id)
+
+
+class PushManager:
+    """Keeps a notification channel open per snapshot and syncs it on notifications"""
+
+    def __init__(self, executor, base_url, token, calendar_store=None, gmail_mirror=None,
+                 topic=None, cache=None, sync_interval=None, renew_before=None):
+        self.executor = executor
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.topic = topic
+        self.cache = cache
+        self.sync_interval = SYNC_INTERVAL if sync_interval is None else sync_interval
+        self.renew_before = RENEW_BEFORE if renew_before is None else renew_before
+        # Snapshot name -> store; both have sync(service, force) and sync_interval
+        self.stores = {}
+        if calendar_store is not None:
+            self.stores['calendar'] = calendar_store
+        if gmail_mirror is not None and topic:
+            self.stores['gmail'] = gmail_mirror
+        self._state = {
+            snapshot: {'expires': 0.0, 'renew_at': 0.0, 'notifications': 0, 'syncs': 0,
+                       'changes': 0, 'last_error': None}
+            for snapshot in self.stores
+        }
+        # The stores' own intervals, restored while their channel is down
+        self._poll_intervals = {snapshot: store.sync_interval for snapshot, store in self.stores.items()}
+        # Calendar channels opened and not stopped yet: id -> {'id', 'resourceId'}
+        self._channels = {}
+        self._history_id = 0
+        self._listeners = []
+        self._dirty = set()
+        self._syncing = {}
+        self._task = None
+        self._listener = None
+
+    def add_listener(self, callback):
+        """Await callback(snapshot) after a sync that changed the snapshot"""
+        self._listeners.append(callback)
+
+    def live(self, snapshot):
+        return time.time() < self._state[snapshot]['expires']
+
+    # -- channels ----------------------------------------------------------
+
+    async def start(self):
+        """Open the channels in the background and keep them renewed"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._maintain())
+
+    async def stop(self):
+        """Stop renewing and close the channels, so Google stops posting"""
+        if self._listener is not None:
+            self._listener.should_exit = True
+        tasks = [t for t in [self._task, *self._syncing.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        for channel in [c for c in self._channels.values() if c is not None]:
+            await self._close_channel(channel)
+        if 'gmail' in self.stores and self.live('gmail'):
+            try:
+                await self.executor.run(_stop_gmail)
+            except Exception:
+                pass
+        for snapshot in self.stores:
+            self._poll(snapshot)
+
+    async def _maintain(self):
+        while True:
+            for snapshot, state in self._state.items():
+                if state['expires'] and not self.live(snapshot):
+                    # The channel ran out before it could be renewed
+                    self._poll(snapshot)
+                if state['renew_at'] <= time.time():
+                    await self._open(snapshot)
+            wake = min(t for state in self._state.values() for t in (state['renew_at'], state['expires']) if t)
+            await asyncio.sleep(max(1.0, wake - time.time()))
+
+    async def _open(self, snapshot):
+        """Open (or renew) the channel of a snapshot and schedule its renewal"""
+        state = self._state[snapshot]
+        was_live = self.live(snapshot)
+        # A renewal still retrying when the channel runs out gives up, so
+        # the snapshot polls again meanwhile
+        timeout = self.executor.timeout
+        if was_live:
+            timeout = max(1.0, min(timeout, state['expires'] - time.time()))
+        try:
+            if snapshot == 'calendar':
+                expires = await self._watch_calendar(timeout)
+            else:
+                response = await self.executor.run(
+                    instrumented('push_watch', _watch_gmail), self.topic, timeout=timeout
+                )
+                expires = int(response['expiration']) / 1000
+        except Exception as e:
+            state['last_error'] = f"watch failed: {e}"
+            state['renew_at'] = time.time() + RETRY_DELAY
+            if not self.live(snapshot):
+                self._poll(snapshot)
+            return
+
+        now = time.time()
+        renew_at = max(expires - self.renew_before, now + (expires - now) / 2)
+        if snapshot == 'gmail':
+            renew_at = min(renew_at, now + GMAIL_WATCH_INTERVAL)
+        state.update(expires=expires, renew_at=renew_at, last_error=None)
+        if not was_live:
+            store = self.stores[snapshot]
+            store.sync_interval = max(self._poll_intervals[snapshot], self.sync_interval)
+            # Catch up on whatever changed before the channel was open
+            self.changed(snapshot)
+
+    async def _watch_calendar(self, timeout=None):
+        """Open a new calendar channel, then stop the one it replaces; returns its expiry"""
+        channel_id = uuid.uuid4().hex
+        # Registered first: Google's "sync" message may arrive before the answer
+        self._channels[channel_id] = None
+        try:
+            channel = await self.executor.run(
+                instrumented('push_watch', _watch_calendar), channel_id,
+                self.base_url + CALENDAR_PATH, self.token, CHANNEL_TTL, timeout=timeout
+            )
+        except BaseException:
+            self._channels.pop(channel_id, None)
+            raise
+        for old in [c for i, c in self._channels.items() if i != channel_id and c is not None]:
+            await self._close_channel(old)
+        self._channels[channel_id] = {'id': channel_id, 'resourceId': channel['resourceId']}
+        return int(channel['expiration']) / 1000
+
+    async def _close_channel(self, channel):
+        self._channels.pop(channel['id'], None)
+        try:
+            await self.executor.run(instrumented('push_watch', _stop_channel), channel)
+        except Exception:
+            # An expired or already stopped channel cannot post anyway
+            pass
+
+    def _poll(self, snapshot):
+        self._state[snapshot]['expires'] = 0.0
+        self.stores[snapshot].sync_interval = self._poll_intervals[snapshot]
+
+    # -- notifications -----------------------------------------------------
+
+    def calendar_notification(self, headers):
+        """HTTP status for a calendar channel's POST, given its headers"""
+        if 'calendar' not in self.stores:
+            return 404
+        if not hmac.compare_digest(headers.get('x-goog-channel-token', ''), self.token):
+            PUSH_NOTIFICATIONS.inc(snapshot='calendar', outcome='rejected')
+            return 403
+        channel_id = headers.get('x-goog-channel-id', '')
+        if channel_id not in self._channels:
+            # Not ours to stop (another process may still rely on it); it
+            # expires on its own
+            PUSH_NOTIFICATIONS.inc(snapshot='calendar', outcome='ignored')
+            return 200
+        # "sync" only confirms a new channel
+        if headers.get('x-goog-resource-state') == 'sync':
+            PUSH_NOTIFICATIONS.inc(snapshot='calendar', outcome='ignored')
+            return 200
+        PUSH_NOTIFICATIONS.inc(snapshot='calendar', outcome='accepted')
+        self._state['calendar']['notifications'] += 1
+        self.changed('calendar')
+        return 200
+
+    def gmail_notification(self, body, token):
+        """HTTP status for a Pub/Sub push of a Gmail change, given its body and ?token="""
+        if 'gmail' not in self.stores:
+            return 404
+        if not hmac.compare_digest(token or '', self.token):
+            PUSH_NOTIFICATIONS.inc(snapshot='gmail', outcome='rejected')
+            return 403
+        try:
+            data = json.loads(base64.b64decode(json.loads(body)['message']['data']))
+            history_id = int(data['historyId'])
+        except (ValueError, KeyError, TypeError):
+            # Acknowledged anyway: Pub/Sub would keep redelivering it
+            PUSH_NOTIFICATIONS.inc(snapshot='gmail', outcome='ignored')
+            return 204
+        if history_id <= self._history_id:
+            # Pub/Sub delivers at least once; the mirror already has this change
+            PUSH_NOTIFICATIONS.inc(snapshot='gmail', outcome='ignored')
+            return 204
+        PUSH_NOTIFICATIONS.inc(snapshot='gmail', outcome='accepted')
+        self._state['gmail']['notifications'] += 1
+        self.changed('gmail')
+        return 204
+
+    def changed(self, snapshot):
+        """Sync a snapshot soon; changes reported meanwhile share one more sync"""
+        self._dirty.add(snapshot)
+        if snapshot not in self._syncing:
+            self._syncing[snapshot] = asyncio.ensure_future(self._sync_changes(snapshot))
+
+    async def _sync_changes(self, snapshot):
+        state = self._state[snapshot]
+        failures = 0
+        try:
+            while snapshot in self._dirty:
+                self._dirty.discard(snapshot)
+                try:
+                    changed, history_id = await self.executor.run(
+                        instrumented('push_sync', _sync), snapshot, self.stores[snapshot]
+                    )
+                except Exception as e:
+                    state['last_error'] = f"sync failed: {e}"
+                    failures += 1
+                    if failures < SYNC_ATTEMPTS:
+                        self._dirty.add(snapshot)
+                        await asyncio.sleep(failures * 5)
+                    continue
+                failures = 0
+                state['syncs'] += 1
+                if history_id is not None:
+                    self._history_id = max(self._history_id, history_id)
+                if changed:
+                    state['changes'] += 1
+                    await self._publish(snapshot)
+        finally:
+            self._syncing.pop(snapshot, None)
+
+    async def _publish(self, snapshot):
+        if self.cache is not None:
+            self.cache.invalidate(*INVALIDATES[WRITE_TOOLS[snapshot]], account=DEFAULT_ACCOUNT)
+        for callback in self._listeners:
+            try:
+                await callback(snapshot)
+            except Exception:
+                pass
+
+    # -- HTTP --------------------------------------------------------------
+
+    def router(self):
+        """FastAPI routes taking the notifications"""
+        from fastapi import APIRouter, Request, Response
+
+        router = APIRouter()
+
+        @router.post(CALENDAR_PATH, include_in_schema=False)
+        async def calendar_webhook(request: Request):
+            return Response(status_code=self.calendar_notification(request.headers))
+
+        @router.post(GMAIL_PATH, include_in_schema=False)
+        async def gmail_webhook(request: Request):
+            status = self.gmail_notification(await request.body(), request.query_params.get('token'))
+            return Response(status_code=status)
+
+        return router
+
+    def listen(self, host=None, port=None):
+        """Bind the notifications' own listener socket.
+
+        Raises OSError when the port is taken, typically by another stdio
+        session; bound here rather than by uvicorn, which would exit the
+        whole process instead.
+        """
+        return socket.create_server((host or LISTEN_HOST, port or LISTEN_PORT))
+
+    async def serve(self, sock):
+        """Take the notifications on a socket from listen() until stop()"""
+        import uvicorn
+        from fastapi import FastAPI
+
+        app = FastAPI()
+        app.include_router(self.router())
+        # No access log: the stdio server's stdout carries the MCP protocol
+        self._listener = uvicorn.Server(uvicorn.Config(
+            app, log_config=None, access_log=False, lifespan='off'
+        ))
+        try:
+            await self._listener.serve(sockets=[sock])
+        finally:
+            sock.close()
+
+    def stats(self):
+        now = time.time()
+        return {
+            snapshot: {
+                'live': self.live(snapshot),
+                'expires_in': round(state['expires'] - now) if self.live(snapshot) else None,
+                'renews_in': round(max(0.0, state['renew_at'] - now)),
+                'sync_interval': self.stores[snapshot].sync_interval,
+                'notifications': state['notifications'],
+                'syncs': state['syncs'],
+                'changes': state['changes'],
+                'last_error': state['last_error'],
+            }
+            for snapshot, state in self._state.items()
+        }
@@ -0,0 +1,172 @@
+"""Tool results rendered as text for an LLM prompt.
+
+Formats:
+  json     indented JSON, as the servers always returned
+  compact  JSON without whitespace
+  table    one header row, then one row per item, columns joined by " | "
+  lines    one item per line as key=value pairs
+
+With a max_tokens budget the result is shrunk in a fixed order until it
+fits: optional fields are dropped (ELIDE_FIELDS, in order), long strings are
+cut with an ellipsis, and finally trailing list items are replaced by a
+"more omitted" note. Tokens are estimated at CHARS_PER_TOKEN characters each,
+which is close enough for Llama-style tokenizers on English text.
+"""
+import json
+import os
+
+FORMATS = ('json', 'compact', 'table', 'lines')
+DEFAULT_FORMAT = os.environ.get('TOOL_RESULT_FORMAT', 'compact')
+DEFAULT_MAX_TOKENS = int(os.environ.get('TOOL_RESULT_MAX_TOKENS', '0')) or None
+
+CHARS_PER_TOKEN = 4
+# Dropped first when over budget: references the model rarely needs to answer
+ELIDE_FIELDS = ('part_id', 'mime_type', 'attachment_id', 'size', 'end', 'date')
+# Strings are never cut shorter than this
+MIN_STRING_CHARS = 40
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _scalar(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def _cell(value):
+    return _scalar(value).replace('\n', ' ').replace('|', '/')
+
+
+def _columns(items):
+    columns = []
+    for item in items:
+        for key in item:
+            if key not in columns:
+                columns.append(key)
+    return columns
+
+
+def _is_table(value):
+    return isinstance(value, list) and value and all(isinstance(item, dict) for item in value)
+
+
+def _render_table(result):
+    if not _is_table(result):
+        return _render_lines(result)
+    columns = _columns(result)
+    rows = [' | '.join(columns)]
+    rows.extend(' | '.join(_cell(item.get(key)) for key in columns) for item in result)
+    return '\n'.join(rows)
+
+
+def _render_lines(result):
+    if isinstance(result, list):
+        return '\n'.join(
+            '; '.join(f'{k}={_cell(v)}' for k, v in item.items() if v not in (None, '', []))
+            if isinstance(item, dict) else _cell(item)
+            for item in result
+        )
+    if isinstance(result, dict):
+        lines = []
+        for key, value in result.items():
+            if value in (None, '', []):
+                continue
+            if _is_table(value):
+                lines.append(f'{key}:')
+                lines.extend('  ' + line for line in _render_lines(value).split('\n'))
+            elif isinstance(value, str) and '\n' in value:
+                lines.append(f'{key}:\n{value}')
+            else:
+                lines.append(f'{key}: {_scalar(value)}')
+        return '\n'.join(lines)
+    return _scalar(result)
+
+
+def _render(result, fmt):
+    if fmt == 'json':
+        return json.dumps(result, indent=2)
+    if fmt == 'compact':
+        return json.dumps(result, separators=(',', ':'), ensure_ascii=False)
+    if fmt == 'table':
+        return _render_table(result)
+    return _render_lines(result)
+
+
+def _drop_field(value, field):
+    if isinstance(value, list):
+        return [_drop_field(item, field) for item in value]
+    if isinstance(value, dict):
+        return {k: _drop_field(v, field) for k, v in value.items() if k != field}
+    return value
+
+
+def _cut_strings(value, limit):
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit - 1] + '…'
+    if isinstance(value, list):
+        return [_cut_strings(item, limit) for item in value]
+    if isinstance(value, dict):
+        return {k: _cut_strings(v, limit) for k, v in value.items()}
+    return value
+
+
+def _longest_string(value):
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list):
+        return max((_longest_string(item) for item in value), default=0)
+    if isinstance(value, dict):
+        return max((_longest_string(item) for item in value.values()), default=0)
+    return 0
+
+
+def render(result, fmt=None, max_tokens=None):
+    """Text for result in fmt, shrunk to about max_tokens if given"""
+    fmt = fmt or DEFAULT_FORMAT
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt} (expected one of {', '.join(FORMATS)})")
+    max_tokens = max_tokens or DEFAULT_MAX_TOKENS
+    text = _render(result, fmt)
+    if not max_tokens or estimate_tokens(text) <= max_tokens:
+        return text
+
+    for field in ELIDE_FIELDS:
+        result = _drop_field(result, field)
+        text = _render(result, fmt)
+        if estimate_tokens(text) <= max_tokens:
+            return text
+
+    limit = _longest_string(result)
+    while limit > MIN_STRING_CHARS:
+        limit = max(limit // 2, MIN_STRING_CHARS)
+        result = _cut_strings(result, limit)
+        text = _render(result, fmt)
+        if estimate_tokens(text) <= max_tokens:
+            return text
+
+    if isinstance(result, list):
+        total = len(result)
+        # Binary search for the longest prefix that fits with the note
+        lo, hi = 0, total
+        while lo < hi:
+            keep = (lo + hi + 1) // 2
+            if estimate_tokens(_with_note(result, keep, total, fmt)) <= max_tokens:
+                lo = keep
+            else:
+                hi = keep - 1
+        text = _with_note(result, lo, total, fmt)
+    return text
+
+
+def _with_note(items, keep, total, fmt):
+    note = f'[... {total - keep} more items omitted]'
+    if fmt in ('json', 'compact'):
+        return _render(items[:keep] + [note], fmt)
+    if not keep:
+        return note
+    return _render(items[:keep], fmt) + '\n' + note
@@ -0,0 +1,264 @@
+"""Quota-aware scheduling of every HTTP request to Google.
+
+ScheduledHttp sits in each worker's transport stack, so single calls, batch
+requests and page prefetches all pass through the shared Scheduler; streamed
+attachment downloads, which bypass httplib2, use Scheduler.streamed_get. It:
+
+- charges each request its quota cost (Gmail units per method, one unit per
+  Calendar request; a batch costs the sum of its parts) against a token
+  bucket per API and account, sleeping when the budget is used up;
+- retries 429s and 403 rate-limit errors, and 5xx for reads, with
+  full-jitter exponential backoff, honouring Retry-After;
+- lets identical GETs that are in flight at the same moment share one
+  response instead of each going to Google.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+from accounts import active_account
+from metrics import COALESCED, RETRIES, THROTTLE_SECONDS
+
+# Gmail allows 250 quota units per user per second; stay a little below it
+GMAIL_UNITS_PER_SECOND = float(os.environ.get('GMAIL_QUOTA_UNITS_PER_SECOND', '200'))
+# Calendar's default is 600 queries per user per minute
+CALENDAR_REQUESTS_PER_SECOND = float(os.environ.get('CALENDAR_REQUESTS_PER_SECOND', '8'))
+MAX_RETRIES = int(os.environ.get('GOOGLE_MAX_RETRIES', '5'))
+BACKOFF_BASE = float(os.environ.get('GOOGLE_BACKOFF_BASE', '0.5'))
+BACKOFF_MAX = float(os.environ.get('GOOGLE_BACKOFF_MAX', '32'))
+
+# (HTTP method, path suffix pattern, quota units), first match wins
+GMAIL_UNITS = [
+    ('POST', re.compile(r'/messages/send$'), 100),
+    ('POST', re.compile(r'/drafts/send$'), 100),
+    ('POST', re.compile(r'/watch$'), 100),
+    ('POST', re.compile(r'/drafts$'), 10),
+    ('POST', re.compile(r'/messages/(import|insert)$'), 25),
+    ('GET', re.compile(r'/messages/[^/]+/attachments/[^/]+$'), 5),
+    ('GET', re.compile(r'/threads(/[^/]+)?$'), 10),
+    ('GET', re.compile(r'/messages(/[^/]+)?$'), 5),
+    ('GET', re.compile(r'/history$'), 2),
+    ('GET', re.compile(r'/(labels|profile)$'), 1),
+]
+DEFAULT_GMAIL_UNITS = 5
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+_SUB_REQUEST = re.compile(r'^(GET|POST|PUT|PATCH|DELETE) (\S+) HTTP/', re.MULTILINE)
+
+
+def _is_batch(path):
+    return path.rstrip('/').split('/')[-1] == 'batch' or path.startswith('/batch/')
+
+
+def _sub_requests(body):
+    text = body.decode('utf-8', 'replace') if isinstance(body, bytes) else (body or '')
+    return [(m.group(1), urlsplit(m.group(2)).path) for m in _SUB_REQUEST.finditer(text)]
+
+
+def _api(path):
+    if '/gmail/' in path:
+        return 'gmail'
+    if '/calendar/' in path:
+        return 'calendar'
+    return None
+
+
+def _units(api, method, path):
+    if api != 'gmail':
+        return 1
+    for rule_method, pattern, units in GMAIL_UNITS:
+        if method == rule_method and pattern.search(path):
+            return units
+    return DEFAULT_GMAIL_UNITS
+
+
+def request_cost(method, uri, body=None):
+    """(api, quota units) of one HTTP request; a batch costs all of its parts"""
+    path = urlsplit(uri).path
+    if _is_batch(path):
+        parts = _sub_requests(body)
+        if parts:
+            api = _api(parts[0][1])
+            return api, sum(_units(api, m, p) for m, p in parts)
+    api = _api(path)
+    return api, _units(api, method, path)
+
+
+def is_idempotent(method, uri, body=None):
+    """GETs, and batches made only of GETs, can be repeated safely"""
+    if method == 'GET':
+        return True
+    path = urlsplit(uri).path
+    if _is_batch(path):
+        return {m for m, _ in _sub_requests(body)} == {'GET'}
+    return False
+
+
+def is_retryable(status, content=None):
+    """True for throttling and transient server errors"""
+    if status in RETRY_STATUSES:
+        return True
+    if status != 403 or not content:
+        return False
+    try:
+        error = json.loads(content)['error']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return any(e.get('reason') in RATE_LIMIT_REASONS for e in error.get('errors', []))
+
+
+def is_retryable_error(exc):
+    resp = getattr(exc, 'resp', None)
+    return resp is not None and is_retryable(getattr(resp, 'status', None), getattr(exc, 'content', None))
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to one second's worth.
+
+    Callers take their tokens straight away and, if that leaves the bucket in
+    debt, sleep until the debt is repaid. Requests costing more than the
+    whole bucket (a big batch) still go through, just after a longer wait.
+    """
+
+    def __init__(self, rate, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = rate
+        self._tokens = rate
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Take tokens; returns the seconds to wait before using them"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+
+class Scheduler:
+    def __init__(self, rates=None, max_retries=MAX_RETRIES, base_delay=BACKOFF_BASE,
+                 max_delay=BACKOFF_MAX, coalesce=True, sleep=time.sleep):
+        rates = rates or {'gmail': GMAIL_UNITS_PER_SECOND, 'calendar': CALENDAR_REQUESTS_PER_SECOND}
+        self.rates = {api: rate for api, rate in rates.items() if rate > 0}
+        # (api, account) -> TokenBucket; the quotas are per user
+        self.buckets = {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.coalesce = coalesce
+        self.sleep = sleep
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, api, units):
+        rate = self.rates.get(api)
+        if rate is None:
+            return
+        key = (api, active_account())
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(rate)
+        wait = bucket.reserve(units)
+        if wait > 0:
+            THROTTLE_SECONDS.inc(wait, api=api)
+            self.sleep(wait)
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt + 1"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def request(self, http, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        if method != 'GET' or not self.coalesce:
+            return self._send(http, uri, method, body, headers, *args, **kwargs)
+
+        # Same URL with the same credentials: the same answer
+        key = (uri, (headers or {}).get('authorization'))
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Future()
+        if not leader:
+            COALESCED.inc(level='http')
+            return flight.result()
+
+        try:
+            result = self._send(http, uri, method, body, headers, *args, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _send(self, http, uri, method, body, headers, *args, **kwargs):
+        api, units = request_cost(method, uri, body)
+        idempotent = is_idempotent(method, uri, body)
+        attempt = 0
+        while True:
+            self.acquire(api, units)
+            resp, content = http.request(uri, method, body, headers, *args, **kwargs)
+            # A write that hit a 5xx may have been applied; only throttling is safe to repeat
+            retry = is_retryable(resp.status, content) and (idempotent or resp.status < 500)
+            if attempt >= self.max_retries or not retry:
+                return resp, content
+            RETRIES.inc(api=api or 'other', status=resp.status)
+            self.sleep(self.delay(attempt, resp.get('retry-after')))
+            attempt += 1
+
+
+    def streamed_get(self, uri, send):
+        """Response of send(), a streamed requests GET of uri, scheduled like request().
+
+        Charged against the same quota bucket and retried with the same
+        backoff; the body of a response is only read when it is an error.
+        """
+        api, units = request_cost('GET', uri)
+        attempt = 0
+        while True:
+            self.acquire(api, units)
+            response = send()
+            status = response.status_code
+            retry = status >= 300 and is_retryable(status, response.content)
+            if attempt >= self.max_retries or not retry:
+                return response
+            RETRIES.inc(api=api or 'other', status=status)
+            response.close()
+            self.sleep(self.delay(attempt, response.headers.get('retry-after')))
+            attempt += 1
+
+
+shared = Scheduler()
+
+
+class ScheduledHttp:
+    """httplib2.Http wrapper that sends every request through a Scheduler"""
+
+    def __init__(self, http, scheduler=None):
+        self.http = http
+        self.scheduler = scheduler or shared
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        return self.scheduler.request(self.http, uri, method, body, headers, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
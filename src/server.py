@@ -1,78 +1,87 @@
 #!/usr/bin/env python3
 import asyncio
 import json
-from datetime import datetime
+import sys
 from typing import Any
 from mcp.server.models import InitializationOptions
 from mcp.server import NotificationOptions, Server
+from mcp.server.lowlevel.helper_types import ReadResourceContents
 from mcp.server.stdio import stdio_server
-from mcp.types import Tool, TextContent
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from mcp.types import Tool, TextContent, InitializedNotification, Resource
+from pydantic import AnyUrl
 import os.path
-import pickle
-import base64
-from email.mime.text import MIMEText
 
-SCOPES = [
-    'https://www.googleapis.com/auth/calendar',
-    'https://www.googleapis.com/auth/gmail.modify'
-]
+import metrics
+import tools
+from cache import cache_from_env
+from calendar_store import store_from_env
+from accounts import SCOPES, AccountPool, current_account, validate
+from credential_manager import default_token_dir
+from dispatch import ToolDispatcher
+from executor import GoogleExecutor
+from gmail_mirror import mirror_from_env
+from outbox import outbox_from_env
+from pagination import Page
+from push import push_from_env
+from render import render
+from tools import STREAMING_TOOLS, TOOLS
+
+# token.pickle, credentials.json and local caches live in TOKEN_DIR
+# (GOOGLE_TOKEN_DIR, defaulting to the project root)
+TOKEN_DIR = default_token_dir()
+TOKEN_PATH = os.path.join(TOKEN_DIR, 'token.pickle')
+CREDS_PATH = os.path.join(TOKEN_DIR, 'credentials.json')
+
+# Tokens per account (token.pickle by default), each loaded once and
+# refreshed in the background before it expires. The user runs this server,
+# so a missing or revoked token opens the browser sign-in.
+credentials = AccountPool(TOKEN_DIR, CREDS_PATH, SCOPES, interactive=True)
 
 
 def get_google_creds():
     """Get or create Google API credentials"""
-    # Use absolute paths
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    token_path = os.path.join(os.path.dirname(base_dir), 'token.pickle')
-    creds_path = os.path.join(os.path.dirname(base_dir), 'credentials.json')
-    
-    creds = None
-    if os.path.exists(token_path):
-        with open(token_path, 'rb') as token:
-            creds = pickle.load(token)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                creds_path, SCOPES)
-            creds = flow.run_local_server(port=0)
+    return credentials.get()
+
+
+# Google calls run on worker threads, each with its own HTTP transport
+executor = GoogleExecutor(credentials.authorized)
 
-        with open(token_path, 'wb') as token:
-            pickle.dump(creds, token)
+# Local metadata mirror for gmail_list_messages (enable with GMAIL_MIRROR=1)
+tools.gmail_mirror = mirror_from_env(TOKEN_DIR)
 
-    return creds
+# In-memory index of the primary calendar (enable with CALENDAR_STORE=1)
+tools.calendar_store = store_from_env()
 
 
-# Global service instances (initialized lazily)
-_calendar_service = None
-_gmail_service = None
+# Cached reads in front of the worker pool (disable with TOOL_CACHE=0)
+dispatcher = ToolDispatcher(executor, cache_from_env())
 
+# SQLite queue behind the bulk write tools, drained in the background
+# (disable with OUTBOX=0)
+tools.outbox = outbox_from_env(TOKEN_DIR, executor, dispatcher.cache)
 
-def get_services():
-    """Get or initialize Google services"""
-    global _calendar_service, _gmail_service
-    if _calendar_service is None or _gmail_service is None:
-        creds = get_google_creds()
-        _calendar_service = build('calendar', 'v3', credentials=creds)
-        _gmail_service = build('gmail', 'v1', credentials=creds)
-    return _calendar_service, _gmail_service
+# Calendar and Gmail push notifications keep the store and the mirror fresh
+# (enable with PUSH_WEBHOOK_URL, see push.py). stdout carries the protocol,
+# so the webhooks are served on PUSH_HOST:PUSH_PORT
+push = push_from_env(executor, tools.calendar_store, tools.gmail_mirror, dispatcher.cache)
 
 
 # Create MCP server
 server = Server("google-services-mcp")
 
+# Accepted by every tool; GOOGLE_ACCOUNT sets the default
+ACCOUNT_ARGUMENT = {
+    "type": "string",
+    "description": "Account to act as (uses token-<account>.pickle); default account if omitted"
+}
+
 
 @server.list_tools()
 async def handle_list_tools() -> list[Tool]:
-    return [
+    listed = [
         Tool(
             name="calendar_list_events",
-            description="List upcoming calendar events",
+            description="List calendar events, upcoming or within a time range",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -80,6 +89,26 @@ async def handle_list_tools() -> list[Tool]:
                         "type": "number",
                         "description": "Max events to return",
                         "default": 10
+                    },
+                    "time_min": {
+                        "type": "string",
+                        "description": "Only events ending after this time (ISO 8601, default now)"
+                    },
+                    "time_max": {
+                        "type": "string",
+                        "description": "Only events starting before this time (ISO 8601)"
+                    },
+                    "calendars": {
+                        "oneOf": [
+                            {"type": "string"},
+                            {"type": "array", "items": {"type": "string"}}
+                        ],
+                        "description": "\"all\", \"selected\" or calendar IDs to merge "
+                                       "(default: the primary calendar only)"
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "next_cursor from a previous call, to continue the listing"
                     }
                 }
             }
@@ -99,6 +128,68 @@ async def handle_list_tools() -> list[Tool]:
                 "required": ["summary", "start_time", "end_time"]
             }
         ),
+        Tool(
+            name="calendar_create_events",
+            description="Queue many calendar events; returns a job ID at once, check it with outbox_job_status",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "events": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "idempotency_key": {
+                                    "type": "string",
+                                    "description": "Your unique ID for this event; a repeat is never created twice"
+                                },
+                                "summary": {"type": "string"},
+                                "description": {"type": "string"},
+                                "start_time": {"type": "string", "description": "ISO 8601"},
+                                "end_time": {"type": "string", "description": "ISO 8601"},
+                                "attendees": {"type": "array", "items": {"type": "string"}}
+                            },
+                            "required": ["idempotency_key", "summary", "start_time", "end_time"]
+                        }
+                    }
+                },
+                "required": ["events"]
+            }
+        ),
+        Tool(
+            name="calendar_find_free_slots",
+            description="Find times when everyone is free, within working hours",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "calendars": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Calendar IDs or attendee emails (default: your primary calendar)"
+                    },
+                    "duration_minutes": {
+                        "type": "number",
+                        "description": "Shortest slot worth returning",
+                        "default": 30
+                    },
+                    "time_min": {
+                        "type": "string",
+                        "description": "Start of the search (ISO 8601, default now)"
+                    },
+                    "time_max": {
+                        "type": "string",
+                        "description": "End of the search (ISO 8601, default a week later)"
+                    },
+                    "working_hours": {"type": "string", "description": "e.g. 09:00-17:00"},
+                    "time_zone": {
+                        "type": "string",
+                        "description": "IANA name for working hours and results (default: your calendar's)"
+                    },
+                    "include_weekends": {"type": "boolean", "default": False},
+                    "max_results": {"type": "number", "default": 10}
+                }
+            }
+        ),
         Tool(
             name="gmail_list_messages",
             description="List recent Gmail messages",
@@ -106,13 +197,17 @@ async def handle_list_tools() -> list[Tool]:
                 "type": "object",
                 "properties": {
                     "max_results": {"type": "number", "default": 10},
-                    "query": {"type": "string", "description": "Search query"}
+                    "query": {"type": "string", "description": "Search query"},
+                    "cursor": {
+                        "type": "string",
+                        "description": "next_cursor from a previous call, to continue the listing"
+                    }
                 }
             }
         ),
         Tool(
             name="gmail_read_message",
-            description="Read a specific Gmail message",
+            description="Read a specific Gmail message: text body and attachment list",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -121,6 +216,50 @@ async def handle_list_tools() -> list[Tool]:
                 "required": ["message_id"]
             }
         ),
+        Tool(
+            name="gmail_list_threads",
+            description="List Gmail conversations with subject, senders and message count",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "max_results": {"type": "number", "default": 10},
+                    "query": {"type": "string", "description": "Search query"},
+                    "cursor": {
+                        "type": "string",
+                        "description": "next_cursor from a previous call, to continue the listing"
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="gmail_read_thread",
+            description="Read a whole Gmail conversation: every message's text body and attachments",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "thread_id": {"type": "string"},
+                    "strip_quotes": {
+                        "type": "boolean",
+                        "description": "Hide earlier messages quoted in replies",
+                        "default": True
+                    }
+                },
+                "required": ["thread_id"]
+            }
+        ),
+        Tool(
+            name="gmail_get_attachment",
+            description="Download an attachment listed by gmail_read_message and return its local path",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "message_id": {"type": "string"},
+                    "attachment_id": {"type": "string"},
+                    "filename": {"type": "string", "description": "Name to save the file under"}
+                },
+                "required": ["message_id", "attachment_id"]
+            }
+        ),
         Tool(
             name="gmail_send_message",
             description="Send an email via Gmail",
@@ -133,146 +272,213 @@ async def handle_list_tools() -> list[Tool]:
                 },
                 "required": ["to", "subject", "body"]
             }
+        ),
+        Tool(
+            name="gmail_send_messages",
+            description="Queue many emails; returns a job ID at once, check it with outbox_job_status",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "messages": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "idempotency_key": {
+                                    "type": "string",
+                                    "description": "Your unique ID for this email; a repeat is never sent twice"
+                                },
+                                "to": {"type": "string"},
+                                "subject": {"type": "string"},
+                                "body": {"type": "string"}
+                            },
+                            "required": ["idempotency_key", "to", "subject", "body"]
+                        }
+                    }
+                },
+                "required": ["messages"]
+            }
+        ),
+        Tool(
+            name="outbox_job_status",
+            description="Progress of a calendar_create_events or gmail_send_messages job, item by item",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {"type": "string"}
+                },
+                "required": ["job_id"]
+            }
         )
     ]
+    for tool in listed:
+        tool.inputSchema["properties"]["account"] = ACCOUNT_ARGUMENT
+    return listed
+
+
+def _format_result(name: str, result: Any) -> str:
+    """Render a tool result as the text returned to the MCP client
+
+    The format and token budget come from TOOL_RESULT_FORMAT and
+    TOOL_RESULT_MAX_TOKENS (see render.py).
+    """
+    if name == "calendar_create_event":
+        return f"Event created: {result['event_link']}"
+    if name == "gmail_send_message":
+        return f"Message sent: {result['message_id']}"
+    return render(result)
 
 
 @server.call_tool()
 async def handle_call_tool(name: str, arguments: dict) -> list[TextContent]:
     try:
-        calendar_service, gmail_service = get_services()
-
-        if name == "calendar_list_events":
-            max_results = arguments.get("max_results", 10)
-            now = datetime.utcnow().isoformat() + 'Z'
-
-            events_result = calendar_service.events().list(
-                calendarId='primary',
-                timeMin=now,
-                maxResults=max_results,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-            events = events_result.get('items', [])
-            formatted = [{
-                'id': e.get('id'),
-                'summary': e.get('summary'),
-                'start': e.get('start', {}).get('dateTime', e.get('start', {}).get('date')),
-                'end': e.get('end', {}).get('dateTime', e.get('end', {}).get('date'))
-            } for e in events]
-
-            return [TextContent(type="text", text=json.dumps(formatted, indent=2))]
-
-        elif name == "calendar_create_event":
-            event = {
-                'summary': arguments['summary'],
-                'description': arguments.get('description', ''),
-                'start': {'dateTime': arguments['start_time'], 'timeZone': 'UTC'},
-                'end': {'dateTime': arguments['end_time'], 'timeZone': 'UTC'},
-            }
-
-            if 'attendees' in arguments:
-                event['attendees'] = [{'email': e} for e in arguments['attendees']]
-
-            created = calendar_service.events().insert(
-                calendarId='primary', body=event
-            ).execute()
-
-            return [TextContent(type="text", text=f"Event created: {created.get('htmlLink')}")]
-
-        elif name == "gmail_list_messages":
-            max_results = arguments.get("max_results", 10)
-            query = arguments.get("query", "")
-
-            results = gmail_service.users().messages().list(
-                userId='me',
-                maxResults=max_results,
-                q=query
-            ).execute()
-
-            messages = results.get('messages', [])
-            detailed = []
-
-            for msg in messages[:max_results]:
-                m = gmail_service.users().messages().get(
-                    userId='me', id=msg['id'], format='metadata',
-                    metadataHeaders=['From', 'Subject', 'Date']
-                ).execute()
-
-                headers = {h['name']: h['value'] for h in m.get('payload', {}).get('headers', [])}
-                detailed.append({
-                    'id': m['id'],
-                    'from': headers.get('From'),
-                    'subject': headers.get('Subject'),
-                    'date': headers.get('Date')
-                })
-
-            return [TextContent(type="text", text=json.dumps(detailed, indent=2))]
-
-        elif name == "gmail_read_message":
-            msg_id = arguments['message_id']
-            message = gmail_service.users().messages().get(
-                userId='me', id=msg_id, format='full'
-            ).execute()
-
-            payload = message.get('payload', {})
-            headers = {h['name']: h['value'] for h in payload.get('headers', [])}
-
-            body = ""
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        body = base64.urlsafe_b64decode(
-                            part['body']['data']
-                        ).decode('utf-8')
-                        break
-            else:
-                body = base64.urlsafe_b64decode(
-                    payload['body']['data']
-                ).decode('utf-8')
-
-            return [TextContent(type="text", text=json.dumps({
-                'from': headers.get('From'),
-                'subject': headers.get('Subject'),
-                'date': headers.get('Date'),
-                'body': body
-            }, indent=2))]
-
-        elif name == "gmail_send_message":
-            message = MIMEText(arguments['body'])
-            message['to'] = arguments['to']
-            message['subject'] = arguments['subject']
-
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            sent = gmail_service.users().messages().send(
-                userId='me',
-                body={'raw': raw}
-            ).execute()
-
-            return [TextContent(type="text", text=f"Message sent: {sent['id']}")]
+        if name not in TOOLS:
+            return [TextContent(type="text", text=f"Unknown tool: {name}")]
 
+        arguments = dict(arguments or {})
+        account = arguments.pop("account", None)
+        if account:
+            # Each request runs in its own task, so this only affects this call
+            current_account.set(validate(account))
+
+        context = server.request_context
+        progress_token = context.meta.progressToken if context.meta else None
+        if progress_token is not None and name in STREAMING_TOOLS:
+            # Report each event/message as it arrives, then return the full list
+            result = Page()
+            async for _ in dispatcher.stream(name, arguments, result):
+                await context.session.send_progress_notification(
+                    progress_token, len(result), total=arguments.get("max_results", 10)
+                )
         else:
-            return [TextContent(type="text", text=f"Unknown tool: {name}")]
+            result = await dispatcher.call(name, arguments)
+        contents = [TextContent(type="text", text=_format_result(name, result))]
+        next_cursor = getattr(result, "next_cursor", None)
+        if next_cursor:
+            # Pass this back as "cursor" to get the next items
+            contents.append(TextContent(type="text", text=json.dumps({"next_cursor": next_cursor})))
+        return contents
 
     except Exception as e:
         return [TextContent(type="text", text=f"Error: {str(e)}")]
 
 
+# Tool results offered as resources: uri -> (snapshot, tool, arguments, name,
+# description). With push, a change to the snapshot sends resources/updated
+# to the sessions subscribed to the uri.
+RESOURCES = {
+    "calendar://primary/upcoming": (
+        "calendar", "calendar_list_events", {"max_results": 25},
+        "Upcoming events", "The next events in the primary calendar"
+    ),
+    "gmail://me/recent": (
+        "gmail", "gmail_list_messages", {"max_results": 25},
+        "Recent email", "The newest messages in the mailbox"
+    ),
+}
+
+# uri -> sessions subscribed to it
+subscriptions = {}
+
+
+@server.list_resources()
+async def handle_list_resources() -> list[Resource]:
+    return [
+        Resource(uri=uri, name=name, description=description, mimeType="text/plain")
+        for uri, (_, _, _, name, description) in RESOURCES.items()
+    ]
+
+
+@server.read_resource()
+async def handle_read_resource(uri: AnyUrl) -> list[ReadResourceContents]:
+    if str(uri) not in RESOURCES:
+        raise ValueError(f"Unknown resource: {uri}")
+    _, name, arguments, _, _ = RESOURCES[str(uri)]
+    # The default account's reads, answered from the snapshot when it is on
+    result = await dispatcher.call(name, dict(arguments))
+    return [ReadResourceContents(content=_format_result(name, result), mime_type="text/plain")]
+
+
+@server.subscribe_resource()
+async def handle_subscribe_resource(uri: AnyUrl) -> None:
+    if str(uri) not in RESOURCES:
+        raise ValueError(f"Unknown resource: {uri}")
+    subscriptions.setdefault(str(uri), set()).add(server.request_context.session)
+
+
+@server.unsubscribe_resource()
+async def handle_unsubscribe_resource(uri: AnyUrl) -> None:
+    subscriptions.get(str(uri), set()).discard(server.request_context.session)
+
+
+async def notify_subscribers(snapshot: str) -> None:
+    """Send resources/updated for the resources a changed snapshot backs"""
+    for uri, (resource_snapshot, *_) in RESOURCES.items():
+        if resource_snapshot != snapshot:
+            continue
+        for session in list(subscriptions.get(uri, ())):
+            try:
+                await session.send_resource_updated(AnyUrl(uri))
+            except Exception:
+                # The client went away
+                subscriptions[uri].discard(session)
+
+
+async def handle_initialized(notification: InitializedNotification) -> None:
+    """Warm the Google clients in the background once the client is connected"""
+    if os.environ.get('GOOGLE_WARM_START', '1').lower() in ('0', 'false', 'no', 'off'):
+        return
+    # Without a saved token, loading credentials would start the browser flow
+    executor.warm(credentials=os.path.exists(TOKEN_PATH))
+
+
+server.notification_handlers[InitializedNotification] = handle_initialized
+
+
 async def main():
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="google-services-mcp",
-                server_version="1.0.0",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={}
+    # stdout carries the MCP protocol, so metrics go to a file instead
+    metrics_file = os.environ.get('METRICS_FILE')
+    if metrics_file:
+        metrics.start_file_dump(
+            metrics_file, float(os.environ.get('METRICS_INTERVAL', '15')), dispatcher.cache
+        )
+    if tools.outbox is not None:
+        # Also resumes the items a previous run left unfinished
+        tools.outbox.start()
+    webhooks = None
+    if push is not None:
+        try:
+            listener = push.listen()
+        except OSError as e:
+            # Another session takes the notifications; the snapshots poll here
+            sys.stderr.write(f"Push notifications off in this session: {e}\n")
+        else:
+            push.add_listener(notify_subscribers)
+            await push.start()
+            webhooks = asyncio.ensure_future(push.serve(listener))
+
+    capabilities = server.get_capabilities(
+        notification_options=NotificationOptions(),
+        experimental_capabilities={}
+    )
+    # get_capabilities() never announces subscriptions, though they are handled above
+    capabilities.resources.subscribe = True
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="google-services-mcp",
+                    server_version="1.0.0",
+                    capabilities=capabilities
                 )
             )
-        )
+    finally:
+        if webhooks is not None:
+            await push.stop()
+            await asyncio.wait({webhooks}, timeout=5)
+            webhooks.cancel()
 
 
 if __name__ == "__main__":
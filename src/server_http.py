@@ -1,64 +1,95 @@
 #!/usr/bin/env python3
+import asyncio
 import json
-from datetime import datetime
-from fastapi import FastAPI, HTTPException
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Any
 import uvicorn
 import os
 
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-import pickle
-import base64
-from email.mime.text import MIMEText
+import chat
+import metrics
+import payload
+import tools
+from accounts import SCOPES, AccountPool, authorize, current_account, validate
+from cache import cache_from_env
+from calendar_store import store_from_env
+from credential_manager import default_token_dir
+from dispatch import ToolDispatcher
+from executor import GoogleExecutor
+from gmail_mirror import mirror_from_env
+from outbox import outbox_from_env
+from pagination import Page
+from push import push_from_env
+from render import render
+from tools import TOOLS
 
-SCOPES = [
-    'https://www.googleapis.com/auth/calendar',
-    'https://www.googleapis.com/auth/gmail.modify'
-]
+# token.pickle, credentials.json and local caches live in TOKEN_DIR
+# (GOOGLE_TOKEN_DIR, defaulting to the project root)
+TOKEN_DIR = default_token_dir()
+TOKEN_PATH = os.path.join(TOKEN_DIR, 'token.pickle')
+CREDS_PATH = os.path.join(TOKEN_DIR, 'credentials.json')
+
+# Tokens per account (token.pickle by default), each loaded once and
+# refreshed in the background before it expires. Requests never start the
+# browser sign-in; an unusable token fails the call instead.
+credentials = AccountPool(TOKEN_DIR, CREDS_PATH, SCOPES)
 
 def get_google_creds():
     """Get or create Google API credentials"""
-    TOKEN_PATH = '/home/yiorgos/Documents/local repos/MCP-mvp/token.pickle'
-    CREDS_PATH = '/home/yiorgos/Documents/local repos/MCP-mvp/credentials.json'
-    
-    creds = None
-    if os.path.exists(TOKEN_PATH):
-        with open(TOKEN_PATH, 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDS_PATH, SCOPES)
-            creds = flow.run_local_server(port=0)
-        
-        with open(TOKEN_PATH, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return creds
+    return credentials.get()
+
+# Google calls run on worker threads, each with its own HTTP transport
+executor = GoogleExecutor(credentials.authorized)
+# Local metadata mirror for gmail_list_messages (enable with GMAIL_MIRROR=1)
+tools.gmail_mirror = mirror_from_env(TOKEN_DIR)
+# In-memory index of the primary calendar (enable with CALENDAR_STORE=1)
+tools.calendar_store = store_from_env()
+
+# Cached reads in front of the worker pool (disable with TOOL_CACHE=0)
+dispatcher = ToolDispatcher(executor, cache_from_env())
+# SQLite queue behind the bulk write tools, drained in the background
+# (disable with OUTBOX=0)
+tools.outbox = outbox_from_env(TOKEN_DIR, executor, dispatcher.cache)
+# Calendar and Gmail push notifications keep the store and the mirror fresh
+# (enable with PUSH_WEBHOOK_URL, see push.py)
+push = push_from_env(executor, tools.calendar_store, tools.gmail_mirror, dispatcher.cache)
 
-# Initialize services
-_calendar_service = None
-_gmail_service = None
+# Ollama for /chat, over one keep-alive connection pool
+ollama = chat.OllamaClient()
 
-def get_services():
-    """Get or initialize Google services"""
-    global _calendar_service, _gmail_service
-    if _calendar_service is None or _gmail_service is None:
-        creds = get_google_creds()
-        _calendar_service = build('calendar', 'v3', credentials=creds)
-        _gmail_service = build('gmail', 'v1', credentials=creds)
-    return _calendar_service, _gmail_service
+async def _warm_ollama():
+    try:
+        await ollama.warm()
+    except Exception as e:
+        print(f"⚠️  Could not load {ollama.model} in Ollama yet: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    """Load the chat model, start the outbox workers and push channels; stop them on exit"""
+    warming = None
+    if os.environ.get('OLLAMA_WARM_START', '1').lower() not in ('0', 'false', 'no', 'off'):
+        warming = asyncio.ensure_future(_warm_ollama())
+    if tools.outbox is not None:
+        # Also resumes the items a previous run left unfinished
+        tools.outbox.start()
+    if push is not None:
+        await push.start()
+    yield
+    if warming is not None:
+        warming.cancel()
+    await ollama.close()
+    if tools.outbox is not None:
+        tools.outbox.close()
+    if push is not None:
+        await push.stop()
 
 # FastAPI app
-app = FastAPI(title="MCP Google Services")
+app = FastAPI(title="MCP Google Services", lifespan=lifespan)
 
 # Add CORS
 app.add_middleware(
@@ -69,13 +100,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# POST /webhooks/calendar and /webhooks/gmail
+if push is not None:
+    app.include_router(push.router())
+
+@app.middleware("http")
+async def select_account(request: Request, call_next):
+    """Run the request as the account named in the X-Account header, if any"""
+    account = request.headers.get("x-account")
+    if account:
+        try:
+            current_account.set(validate(account))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+    return await call_next(request)
+
 class ToolCall(BaseModel):
     name: str
     arguments: dict
+    # Also return the result as prompt-ready text (see render.py)
+    format: Optional[str] = None
+    max_tokens: Optional[int] = None
 
 class ToolResponse(BaseModel):
     result: Any
     error: Optional[str] = None
+    # Set when a list tool has more items; pass it back as the "cursor" argument
+    next_cursor: Optional[str] = None
+    # The rendered result, when the call asked for a format
+    text: Optional[str] = None
+
+class ToolCallBatch(BaseModel):
+    calls: List[ToolCall]
+    timeout: Optional[float] = None  # overall deadline in seconds
+
+class ChatRequest(BaseModel):
+    message: str
+    # Earlier turns as Ollama chat messages: {"role": "user"/"assistant", "content": ...}
+    history: Optional[List[dict]] = None
 
 @app.get("/")
 async def root():
@@ -88,9 +150,14 @@ async def list_tools():
         "tools": [
             {
                 "name": "calendar_list_events",
-                "description": "List upcoming calendar events",
+                "description": "List calendar events, upcoming or within a time range",
                 "parameters": {
-                    "max_results": {"type": "number", "default": 10}
+                    "max_results": {"type": "number", "default": 10},
+                    "time_min": {"type": "string", "description": "ISO 8601, default now"},
+                    "time_max": {"type": "string", "description": "ISO 8601"},
+                    "calendars": {"type": ["string", "array"],
+                                  "description": "\"all\", \"selected\" or calendar IDs"},
+                    "cursor": {"type": "string", "description": "next_cursor of a previous call"}
                 }
             },
             {
@@ -104,21 +171,71 @@ async def list_tools():
                     "attendees": {"type": "array"}
                 }
             },
+            {
+                "name": "calendar_create_events",
+                "description": "Queue many calendar events; returns a job ID at once, check it with outbox_job_status",
+                "parameters": {
+                    "events": {"type": "array", "required": True,
+                               "description": "objects with idempotency_key, summary, start_time, end_time, "
+                                              "description, attendees"}
+                }
+            },
+            {
+                "name": "calendar_find_free_slots",
+                "description": "Find times when everyone is free, within working hours",
+                "parameters": {
+                    "calendars": {"type": "array", "description": "calendar IDs or emails, default primary"},
+                    "duration_minutes": {"type": "number", "default": 30},
+                    "time_min": {"type": "string", "description": "ISO 8601, default now"},
+                    "time_max": {"type": "string", "description": "ISO 8601, default a week later"},
+                    "working_hours": {"type": "string", "description": "e.g. 09:00-17:00"},
+                    "time_zone": {"type": "string", "description": "IANA name, default the calendar's"},
+                    "include_weekends": {"type": "boolean", "default": False},
+                    "max_results": {"type": "number", "default": 10}
+                }
+            },
             {
                 "name": "gmail_list_messages",
                 "description": "List recent Gmail messages",
                 "parameters": {
                     "max_results": {"type": "number", "default": 10},
-                    "query": {"type": "string"}
+                    "query": {"type": "string"},
+                    "cursor": {"type": "string", "description": "next_cursor of a previous call"}
                 }
             },
             {
                 "name": "gmail_read_message",
-                "description": "Read a specific Gmail message",
+                "description": "Read a specific Gmail message: text body and attachment list",
                 "parameters": {
                     "message_id": {"type": "string", "required": True}
                 }
             },
+            {
+                "name": "gmail_list_threads",
+                "description": "List Gmail conversations with subject, senders and message count",
+                "parameters": {
+                    "max_results": {"type": "number", "default": 10},
+                    "query": {"type": "string"},
+                    "cursor": {"type": "string", "description": "next_cursor of a previous call"}
+                }
+            },
+            {
+                "name": "gmail_read_thread",
+                "description": "Read a whole Gmail conversation: every message's text body and attachments",
+                "parameters": {
+                    "thread_id": {"type": "string", "required": True},
+                    "strip_quotes": {"type": "boolean", "default": True}
+                }
+            },
+            {
+                "name": "gmail_get_attachment",
+                "description": "Download an attachment listed by gmail_read_message and return its local path",
+                "parameters": {
+                    "message_id": {"type": "string", "required": True},
+                    "attachment_id": {"type": "string", "required": True},
+                    "filename": {"type": "string"}
+                }
+            },
             {
                 "name": "gmail_send_message",
                 "description": "Send an email via Gmail",
@@ -127,134 +244,159 @@ async def list_tools():
                     "subject": {"type": "string", "required": True},
                     "body": {"type": "string", "required": True}
                 }
+            },
+            {
+                "name": "gmail_send_messages",
+                "description": "Queue many emails; returns a job ID at once, check it with outbox_job_status",
+                "parameters": {
+                    "messages": {"type": "array", "required": True,
+                                 "description": "objects with idempotency_key, to, subject, body"}
+                }
+            },
+            {
+                "name": "outbox_job_status",
+                "description": "Progress of a calendar_create_events or gmail_send_messages job, item by item",
+                "parameters": {
+                    "job_id": {"type": "string", "required": True}
+                }
             }
         ]
     }
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the tool response cache"""
+    if dispatcher.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **dispatcher.cache.stats()}
+
+@app.get("/accounts/stats")
+async def account_stats():
+    """Accounts with loaded credentials and LRU evictions so far"""
+    return credentials.stats()
+
+@app.get("/outbox/stats")
+async def outbox_stats():
+    """Queued, running, done and failed bulk write items per tool"""
+    if tools.outbox is None:
+        return {"enabled": False}
+    return {"enabled": True, **tools.outbox.stats()}
+
+@app.get("/push/stats")
+async def push_stats():
+    """Push channel state, notifications and syncs per snapshot"""
+    if push is None:
+        return {"enabled": False}
+    return {"enabled": True, **push.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Tool, Google API, cache and payload metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        metrics.exposition(dispatcher.cache), media_type="text/plain; version=0.0.4"
+    )
+
+@app.get("/payload/stats")
+async def payload_stats():
+    """Google API response bytes and JSON decode time per tool"""
+    return {"tools": payload.stats.snapshot()}
+
+def _response(result, tool_call):
+    text = None
+    if tool_call.format or tool_call.max_tokens:
+        text = render(result, tool_call.format, tool_call.max_tokens)
+    return ToolResponse(result=result, next_cursor=getattr(result, 'next_cursor', None), text=text)
+
 @app.post("/call_tool")
 async def call_tool(tool_call: ToolCall) -> ToolResponse:
     """Execute an MCP tool"""
     try:
-        calendar_service, gmail_service = get_services()
         name = tool_call.name
         args = tool_call.arguments
         
-        if name == "calendar_list_events":
-            max_results = args.get("max_results", 10)
-            now = datetime.utcnow().isoformat() + 'Z'
-            
-            events_result = calendar_service.events().list(
-                calendarId='primary',
-                timeMin=now,
-                maxResults=max_results,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
-            formatted = [{
-                'id': e.get('id'),
-                'summary': e.get('summary'),
-                'start': e.get('start', {}).get('dateTime', e.get('start', {}).get('date')),
-                'end': e.get('end', {}).get('dateTime', e.get('end', {}).get('date'))
-            } for e in events]
-            
-            return ToolResponse(result=formatted)
-        
-        elif name == "calendar_create_event":
-            event = {
-                'summary': args['summary'],
-                'description': args.get('description', ''),
-                'start': {'dateTime': args['start_time'], 'timeZone': 'UTC'},
-                'end': {'dateTime': args['end_time'], 'timeZone': 'UTC'},
-            }
-            
-            if 'attendees' in args:
-                event['attendees'] = [{'email': e} for e in args['attendees']]
-            
-            created = calendar_service.events().insert(
-                calendarId='primary', body=event
-            ).execute()
-            
-            return ToolResponse(result={"event_link": created.get('htmlLink'), "id": created.get('id')})
-        
-        elif name == "gmail_list_messages":
-            max_results = args.get("max_results", 10)
-            query = args.get("query", "")
-            
-            results = gmail_service.users().messages().list(
-                userId='me',
-                maxResults=max_results,
-                q=query
-            ).execute()
-            
-            messages = results.get('messages', [])
-            detailed = []
-            
-            for msg in messages[:max_results]:
-                m = gmail_service.users().messages().get(
-                    userId='me', id=msg['id'], format='metadata',
-                    metadataHeaders=['From', 'Subject', 'Date']
-                ).execute()
-                
-                headers = {h['name']: h['value'] for h in m.get('payload', {}).get('headers', [])}
-                detailed.append({
-                    'id': m['id'],
-                    'from': headers.get('From'),
-                    'subject': headers.get('Subject'),
-                    'date': headers.get('Date')
-                })
-            
-            return ToolResponse(result=detailed)
-        
-        elif name == "gmail_read_message":
-            msg_id = args['message_id']
-            message = gmail_service.users().messages().get(
-                userId='me', id=msg_id, format='full'
-            ).execute()
-            
-            payload = message.get('payload', {})
-            headers = {h['name']: h['value'] for h in payload.get('headers', [])}
-            
-            body = ""
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        body = base64.urlsafe_b64decode(
-                            part['body']['data']
-                        ).decode('utf-8')
-                        break
-            else:
-                body = base64.urlsafe_b64decode(
-                    payload['body']['data']
-                ).decode('utf-8')
-            
-            return ToolResponse(result={
-                'from': headers.get('From'),
-                'subject': headers.get('Subject'),
-                'date': headers.get('Date'),
-                'body': body
-            })
-        
-        elif name == "gmail_send_message":
-            message = MIMEText(args['body'])
-            message['to'] = args['to']
-            message['subject'] = args['subject']
-            
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            sent = gmail_service.users().messages().send(
-                userId='me',
-                body={'raw': raw}
-            ).execute()
-            
-            return ToolResponse(result={"message_id": sent['id']})
-        
-        else:
+        if name not in TOOLS:
             raise HTTPException(status_code=400, detail=f"Unknown tool: {name}")
+        
+        result = await dispatcher.call(name, args)
+        return _response(result, tool_call)
     
     except Exception as e:
         return ToolResponse(result=None, error=str(e))
 
+def _stream_record(record, sse):
+    if sse:
+        return f"event: {record['type']}\ndata: {json.dumps(record['data'] if record['type'] == 'item' else record)}\n\n"
+    return json.dumps(record) + "\n"
+
+@app.post("/stream_tool")
+async def stream_tool(tool_call: ToolCall, request: Request):
+    """Execute an MCP tool, streaming each listed item as soon as it is fetched
+    
+    Answers NDJSON by default, or Server-Sent Events when the client sends
+    Accept: text/event-stream. The last record is always a summary.
+    """
+    sse = 'text/event-stream' in request.headers.get('accept', '')
+    name = tool_call.name
+    args = tool_call.arguments
+    
+    async def records():
+        started = time.perf_counter()
+        count, error = 0, None
+        page = Page()
+        if name not in TOOLS:
+            error = f"Unknown tool: {name}"
+        else:
+            try:
+                async for item in dispatcher.stream(name, args, page):
+                    count += 1
+                    yield _stream_record({'type': 'item', 'data': item}, sse)
+            except Exception as e:
+                error = str(e)
+        yield _stream_record({
+            'type': 'summary',
+            'tool': name,
+            'count': count,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+            'next_cursor': page.next_cursor,
+            'error': error
+        }, sse)
+    
+    return StreamingResponse(
+        records(), media_type='text/event-stream' if sse else 'application/x-ndjson'
+    )
+
+@app.post("/call_tools")
+async def call_tools(batch: ToolCallBatch) -> List[ToolResponse]:
+    """Execute independent MCP tools concurrently, answering in request order"""
+    outcomes = await dispatcher.call_many(
+        [(call.name, call.arguments) for call in batch.calls],
+        timeout=batch.timeout or executor.timeout
+    )
+    return [
+        ToolResponse(result=None, error=str(outcome)) if isinstance(outcome, Exception)
+        else _response(outcome, call)
+        for call, outcome in zip(batch.calls, outcomes)
+    ]
+
+@app.post("/chat")
+async def chat_message(chat_request: ChatRequest):
+    """Answer a chat message, streaming tool progress and tokens as Server-Sent Events
+    
+    Events: "tool" per finished tool call, "token" per piece of the answer,
+    then "done" with timings, or "error".
+    """
+    tool_specs = chat.ollama_tools((await list_tools())["tools"])
+    
+    async def events():
+        async for event, data in chat.chat(
+            dispatcher, ollama, chat_request.message, chat_request.history, tool_specs
+        ):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    return StreamingResponse(
+        events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'}
+    )
+
 if __name__ == "__main__":
     print("🚀 Starting MCP Google Services HTTP Server...")
     print("📍 Server will be available at: http://localhost:8000")
@@ -262,4 +404,17 @@ if __name__ == "__main__":
     print("   - GET  /         - Server status")
     print("   - GET  /tools    - List available tools")
     print("   - POST /call_tool - Execute a tool")
+    print("   - POST /call_tools - Execute several tools concurrently")
+    print("   - POST /stream_tool - Execute a tool, streaming results as NDJSON/SSE")
+    print("   - POST /chat     - Chat with Ollama using the tools, streamed as SSE")
+    print("   - GET  /cache/stats - Response cache hit/miss counters")
+    print("   - GET  /payload/stats - Google API response bytes per tool")
+    print("   - GET  /accounts/stats - Accounts with loaded credentials")
+    print("   - GET  /outbox/stats - Bulk write items by status")
+    print("   - GET  /push/stats - Push channels and notifications")
+    print("   - POST /webhooks/calendar, /webhooks/gmail - Google push notifications")
+    print("   - GET  /metrics  - Prometheus metrics")
+    # Started from a terminal: the first sign-in happens here, before serving
+    if not os.path.exists(TOKEN_PATH):
+        authorize(TOKEN_DIR)
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
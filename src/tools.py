@@ -0,0 +1,391 @@
+"""Google tool implementations shared by the stdio and HTTP servers.
+
+Every tool is a plain blocking function taking (calendar_service, gmail_service,
+arguments) and returning JSON-serializable data, so the servers can run them
+on the executor's worker threads and render the result however they like.
+"""
+import base64
+from datetime import datetime
+from email.mime.text import MIMEText
+
+from accounts import is_default
+from availability import find_free_slots
+from calendar_store import EVENT_LIST_FIELDS, format_event, to_rfc3339
+from calendars import CALENDAR_PAGE_MAX, list_merged_events
+from attachments import download_attachment
+from gmail_batch import (
+    DEFAULT_BATCH_SIZE, LIST_FIELDS, THREAD_LIST_FIELDS, batch_get_messages, fetch_message_summaries,
+    fetch_thread_summaries
+)
+from mime import extract_body, header_map, list_attachments, message_fields
+from pagination import (
+    MAX_TOTAL_ITEMS, Page, collect_pages, decode_cursor, encode_cursor, iter_page_items
+)
+
+# Largest page the Gmail list API hands out (CALENDAR_PAGE_MAX for events)
+GMAIL_PAGE_MAX = 500
+# Parts format_message reads, at any nesting mime.py can follow
+READ_FIELDS = message_fields()
+THREAD_FIELDS = f'id,messages({READ_FIELDS})'
+
+# Size of the first Gmail batch when streaming, to get results out quickly
+STREAM_FIRST_BATCH = 5
+
+# Optional local stores, installed by the servers at startup; they hold the
+# default account's data and are skipped for calls by other accounts
+gmail_mirror = None
+calendar_store = None
+# Durable queue of the bulk write tools (see outbox.py), also installed at startup
+outbox = None
+
+
+def _local_page(items, max_results, arguments):
+    """Up to max_results + 1 items from a local snapshot as a Page.
+
+    The extra item only shows that more exist; the cursor then resumes the
+    listing on the API, past the items returned here.
+    """
+    if len(items) <= max_results:
+        return Page(items)
+    return Page(items[:max_results], encode_cursor(None, max_results, arguments))
+
+
+def _iter_event_pages(calendar_service, args):
+    """Yield (events, next_cursor) per events.list page of a calendar_list_events call.
+
+    A merged listing or an answer from the calendar store comes as a single
+    chunk.
+    """
+    max_results = min(int(args.get("max_results", 10)), MAX_TOTAL_ITEMS)
+    cursor = args.get("cursor")
+    requested = {'time_min': args.get("time_min"), 'time_max': args.get("time_max")}
+    now = datetime.utcnow().isoformat() + 'Z'
+
+    # A cursor of a merged listing carries the calendars it was issued for
+    selection = args.get("calendars")
+    if not selection and cursor:
+        selection = decode_cursor(cursor, {})[2].get('calendars')
+    if selection:
+        merged = list_merged_events(calendar_service, selection, requested, max_results, cursor, now)
+        yield merged, merged.next_cursor
+        return
+
+    if calendar_store is not None and not cursor and is_default():
+        try:
+            calendar_store.sync(calendar_service)
+            local = calendar_store.query(
+                requested['time_min'] or now, requested['time_max'], max_results + 1
+            )
+        except Exception:
+            local = None
+        if local is not None:
+            arguments = {'time_min': requested['time_min'] or now, 'time_max': requested['time_max']}
+            page = _local_page(local, max_results, arguments)
+            yield page, page.next_cursor
+            return
+
+    def make_request(page_token, page_size, arguments):
+        params = {'timeMin': to_rfc3339(arguments['time_min'])}
+        if arguments['time_max']:
+            params['timeMax'] = to_rfc3339(arguments['time_max'])
+        return calendar_service.events().list(
+            calendarId='primary',
+            maxResults=page_size,
+            singleEvents=True,
+            orderBy='startTime',
+            pageToken=page_token,
+            fields=EVENT_LIST_FIELDS,
+            **params
+        )
+
+    for events, next_cursor, _ in iter_page_items(
+        make_request, 'items', max_results, cursor, requested,
+        CALENDAR_PAGE_MAX, defaults={'time_min': now}
+    ):
+        yield [format_event(e) for e in events], next_cursor
+
+
+def calendar_list_events(calendar_service, gmail_service, args):
+    events, next_cursor = Page(), None
+    for chunk, next_cursor in _iter_event_pages(calendar_service, args):
+        events.extend(chunk)
+    events.next_cursor = next_cursor
+    return events
+
+
+def event_body(args):
+    """events.insert body for calendar_create_event arguments"""
+    event = {
+        'summary': args['summary'],
+        'description': args.get('description', ''),
+        'start': {'dateTime': args['start_time'], 'timeZone': 'UTC'},
+        'end': {'dateTime': args['end_time'], 'timeZone': 'UTC'},
+    }
+
+    if 'attendees' in args:
+        event['attendees'] = [{'email': e} for e in args['attendees']]
+    return event
+
+
+def calendar_create_event(calendar_service, gmail_service, args):
+    created = calendar_service.events().insert(
+        calendarId='primary', body=event_body(args), fields='id,htmlLink'
+    ).execute()
+
+    return {"event_link": created.get('htmlLink'), "id": created.get('id')}
+
+
+def _outbox():
+    if outbox is None:
+        raise ValueError("The bulk write tools are turned off (OUTBOX=0)")
+    return outbox
+
+
+def calendar_create_events(calendar_service, gmail_service, args):
+    return _outbox().submit('calendar_create_events', args.get('events'))
+
+
+def calendar_find_free_slots(calendar_service, gmail_service, args):
+    return find_free_slots(
+        calendar_service,
+        args.get("calendars") or ['primary'],
+        args.get("time_min") or datetime.utcnow().isoformat() + 'Z',
+        args.get("time_max"),
+        args.get("duration_minutes", 30),
+        working_hours=args.get("working_hours"),
+        time_zone=args.get("time_zone"),
+        weekends=bool(args.get("include_weekends")),
+        max_results=min(int(args.get("max_results", 10)), MAX_TOTAL_ITEMS)
+    )
+
+
+def _local_messages(gmail_service, query, max_results):
+    """Answer from the Gmail mirror, or None when the API is needed"""
+    if gmail_mirror is None or not is_default():
+        return None
+    try:
+        gmail_mirror.sync(gmail_service)
+        local = gmail_mirror.query(query, max_results + 1)
+    except Exception:
+        # The mirror is only an accelerator; the API is always authoritative
+        return None
+    if local is None:
+        return None
+    return _local_page(local, max_results, {'query': query})
+
+
+def _iter_message_id_pages(gmail_service, args):
+    """(message IDs, next cursor) per messages.list page.
+
+    The next page is listed on a helper thread while the caller fetches
+    metadata for the current one.
+    """
+    requested = {'query': args.get("query")}
+
+    def make_request(page_token, page_size, arguments):
+        return gmail_service.users().messages().list(
+            userId='me',
+            maxResults=page_size,
+            q=arguments['query'],
+            pageToken=page_token,
+            fields=LIST_FIELDS
+        )
+
+    for messages, next_cursor, _ in iter_page_items(
+        make_request, 'messages', args.get("max_results", 10), args.get("cursor"),
+        requested, GMAIL_PAGE_MAX, defaults={'query': ''}
+    ):
+        yield [msg['id'] for msg in messages], next_cursor
+
+
+def gmail_list_messages(calendar_service, gmail_service, args):
+    max_results = min(int(args.get("max_results", 10)), MAX_TOTAL_ITEMS)
+    query = args.get("query", "")
+
+    if not args.get("cursor"):
+        local = _local_messages(gmail_service, query, max_results)
+        if local is not None:
+            return local
+
+    detailed, next_cursor = Page(), None
+    for ids, next_cursor in _iter_message_id_pages(gmail_service, args):
+        detailed.extend(fetch_message_summaries(gmail_service, ids))
+    detailed.next_cursor = next_cursor
+    return detailed
+
+
+def iter_gmail_list_messages(calendar_service, gmail_service, args):
+    """gmail_list_messages as Page chunks, one per batch as it arrives.
+
+    Batches start small so the first results show up after one short round
+    trip, then grow to the normal batch size. The last chunk carries the
+    cursor for the rest.
+    """
+    max_results = min(int(args.get("max_results", 10)), MAX_TOTAL_ITEMS)
+    query = args.get("query", "")
+
+    if not args.get("cursor"):
+        local = _local_messages(gmail_service, query, max_results)
+        if local is not None:
+            yield Page(local, getattr(local, 'next_cursor', None))
+            return
+
+    size = STREAM_FIRST_BATCH
+    for ids, next_cursor in _iter_message_id_pages(gmail_service, args):
+        start = 0
+        while start < len(ids):
+            end = start + size
+            yield Page(
+                fetch_message_summaries(gmail_service, ids[start:end]),
+                next_cursor if end >= len(ids) else None
+            )
+            start = end
+            size = min(size * 4, DEFAULT_BATCH_SIZE)
+
+
+def iter_calendar_list_events(calendar_service, gmail_service, args):
+    """calendar_list_events as Page chunks, one per page as it arrives"""
+    for events, next_cursor in _iter_event_pages(calendar_service, args):
+        yield Page(events, next_cursor)
+
+
+def format_message(message, strip_quotes=False):
+    """Headers, plain-text body and attachment references of a format='full' message"""
+    payload = message.get('payload', {})
+    headers = header_map(payload)
+
+    return {
+        'from': headers.get('From'),
+        'subject': headers.get('Subject'),
+        'date': headers.get('Date'),
+        'body': extract_body(payload, strip_quotes=strip_quotes),
+        'attachments': list_attachments(payload)
+    }
+
+
+def gmail_read_message(calendar_service, gmail_service, args):
+    msg_id = args['message_id']
+    message = gmail_service.users().messages().get(
+        userId='me', id=msg_id, format='full', fields=READ_FIELDS
+    ).execute()
+    return format_message(message)
+
+
+def gmail_read_messages(calendar_service, gmail_service, message_ids):
+    """gmail_read_message for several IDs in one batch round trip.
+
+    Returns one entry per ID, either the formatted message or the exception
+    raised while fetching or decoding it.
+    """
+    results = []
+    fetched = batch_get_messages(
+        gmail_service, message_ids, format='full', fields=READ_FIELDS
+    )
+    for message in fetched:
+        if isinstance(message, Exception):
+            results.append(message)
+            continue
+        try:
+            results.append(format_message(message))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def gmail_list_threads(calendar_service, gmail_service, args):
+    """Conversations matching a query, with subject, senders and message count"""
+    requested = {'query': args.get("query")}
+
+    def make_request(page_token, page_size, arguments):
+        return gmail_service.users().threads().list(
+            userId='me',
+            maxResults=page_size,
+            q=arguments['query'],
+            pageToken=page_token,
+            fields=THREAD_LIST_FIELDS
+        )
+
+    threads, _ = collect_pages(
+        make_request, 'threads', args.get("max_results", 10), args.get("cursor"),
+        requested, GMAIL_PAGE_MAX, defaults={'query': ''}
+    )
+    return Page(fetch_thread_summaries(gmail_service, [t['id'] for t in threads]), threads.next_cursor)
+
+
+def gmail_read_thread(calendar_service, gmail_service, args):
+    """Every message of a conversation, oldest first, in one round trip.
+
+    Quoted earlier messages are stripped from replies unless strip_quotes
+    is false, since the thread already holds them in full.
+    """
+    thread = gmail_service.users().threads().get(
+        userId='me', id=args['thread_id'], format='full', fields=THREAD_FIELDS
+    ).execute()
+    strip_quotes = args.get("strip_quotes", True)
+
+    messages = []
+    for message in thread.get('messages', []):
+        formatted = format_message(message, strip_quotes=strip_quotes)
+        messages.append(dict(id=message.get('id'), **formatted))
+    subject = messages[0]['subject'] if messages else None
+    for formatted in messages:
+        # Repeated as "Re: ..." on every reply; the thread's subject says it once
+        del formatted['subject']
+    return {'id': thread.get('id'), 'subject': subject, 'messages': messages}
+
+
+def gmail_get_attachment(calendar_service, gmail_service, args):
+    return download_attachment(
+        gmail_service, args['message_id'], args['attachment_id'], args.get('filename')
+    )
+
+
+def raw_message(args, message_id=None):
+    """base64url RFC 2822 text of a gmail_send_message email"""
+    message = MIMEText(args['body'])
+    message['to'] = args['to']
+    message['subject'] = args['subject']
+    if message_id:
+        message['Message-ID'] = message_id
+    return base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+
+
+def gmail_send_message(calendar_service, gmail_service, args):
+    sent = gmail_service.users().messages().send(
+        userId='me',
+        body={'raw': raw_message(args)},
+        fields='id'
+    ).execute()
+
+    return {"message_id": sent['id']}
+
+
+def gmail_send_messages(calendar_service, gmail_service, args):
+    return _outbox().submit('gmail_send_messages', args.get('messages'))
+
+
+def outbox_job_status(calendar_service, gmail_service, args):
+    return _outbox().job(args['job_id'])
+
+
+TOOLS = {
+    'calendar_list_events': calendar_list_events,
+    'calendar_create_event': calendar_create_event,
+    'calendar_create_events': calendar_create_events,
+    'calendar_find_free_slots': calendar_find_free_slots,
+    'gmail_list_messages': gmail_list_messages,
+    'gmail_read_message': gmail_read_message,
+    'gmail_list_threads': gmail_list_threads,
+    'gmail_read_thread': gmail_read_thread,
+    'gmail_get_attachment': gmail_get_attachment,
+    'gmail_send_message': gmail_send_message,
+    'gmail_send_messages': gmail_send_messages,
+    'outbox_job_status': outbox_job_status,
+}
+
+# Generator versions of the list tools, yielding Page chunks as they are
+# fetched; only the last one may carry a next_cursor
+STREAMING_TOOLS = {
+    'calendar_list_events': iter_calendar_list_events,
+    'gmail_list_messages': iter_gmail_list_messages,
+}
@@ -0,0 +1,152 @@
+"""Gmail tools make one round trip per batch of messages, not one per message.
+
+The services run on a fake httplib2 transport that answers messages.list,
+messages.get and batch requests locally and counts every request it gets.
+"""
+import json
+import os
+import sys
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import tools  # noqa: E402
+from discovery import build_service  # noqa: E402
+from gmail_batch import DEFAULT_BATCH_SIZE, fetch_message_summaries  # noqa: E402
+
+MESSAGES = 120
+BOUNDARY = 'batch_boundary'
+
+
+def _message(message_id):
+    return {
+        'id': message_id,
+        'threadId': message_id,
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': [
+                {'name': 'From', 'value': 'sender@example.com'},
+                {'name': 'Subject', 'value': f'Subject {message_id}'},
+                {'name': 'Date', 'value': 'Mon, 2 Mar 2026 10:00:00 +0000'},
+            ],
+            'body': {'data': 'SGVsbG8='},
+        },
+    }
+
+
+class CountingHttp:
+    """httplib2.Http stand-in serving a small mailbox; round_trips counts requests"""
+
+    def __init__(self, messages=MESSAGES):
+        self.ids = [f'm{i:04d}' for i in range(messages)]
+        self.round_trips = 0
+        self.batches = []
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        self.round_trips += 1
+        url = urlparse(uri)
+        if url.path in ('/batch', '/batch/gmail/v1'):
+            return self._batch(body, headers)
+        status, payload = self._call(method, url.path, parse_qs(url.query))
+        return httplib2.Response({'status': str(status), 'content-type': 'application/json'}), \
+            json.dumps(payload).encode()
+
+    def _call(self, method, path, query):
+        prefix = '/gmail/v1/users/me/messages'
+        if path == prefix:
+            size = int(query.get('maxResults', ['100'])[0])
+            start = int(query.get('pageToken', ['0'])[0])
+            page = {'messages': [{'id': i} for i in self.ids[start:start + size]]}
+            if start + size < len(self.ids):
+                page['nextPageToken'] = str(start + size)
+            return 200, page
+        message_id = path[len(prefix) + 1:]
+        if path.startswith(prefix + '/') and message_id in self.ids:
+            return 200, _message(message_id)
+        return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+
+    def _batch(self, body, headers):
+        if isinstance(body, str):
+            body = body.encode()
+        content_type = {k.lower(): v for k, v in headers.items()}['content-type']
+        multipart = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+        )
+        parts = list(multipart.iter_parts())
+        self.batches.append(len(parts))
+        out = []
+        for part in parts:
+            request_line = part.get_payload().lstrip().split('\n', 1)[0]
+            method, target, _ = request_line.split(' ', 2)
+            url = urlparse(target)
+            status, payload = self._call(method, url.path, parse_qs(url.query))
+            content_id = part['Content-ID'].strip('<>')
+            out.append(
+                f'--{BOUNDARY}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n'
+                f'{json.dumps(payload)}\r\n'
+            )
+        out.append(f'--{BOUNDARY}--\r\n')
+        response = httplib2.Response({
+            'status': '200', 'content-type': f'multipart/mixed; boundary={BOUNDARY}'
+        })
+        return response, ''.join(out).encode()
+
+
+@pytest.fixture
+def http(monkeypatch):
+    # Straight to the API: no mirror in front of the listing
+    monkeypatch.setattr(tools, 'gmail_mirror', None)
+    return CountingHttp()
+
+
+@pytest.fixture
+def gmail(http):
+    return build_service('gmail', 'v1', http)
+
+
+def _batches(count):
+    return -(-count // DEFAULT_BATCH_SIZE)
+
+
+def test_list_messages_batches_metadata_fetches(http, gmail):
+    result = tools.gmail_list_messages(None, gmail, {'max_results': MESSAGES})
+
+    assert [m['id'] for m in result] == http.ids
+    assert all(m['subject'] == f"Subject {m['id']}" for m in result)
+    # One list page, then one batch per DEFAULT_BATCH_SIZE messages instead of one get each
+    assert http.round_trips == 1 + _batches(MESSAGES)
+    assert sum(http.batches) == MESSAGES
+
+
+def test_summaries_keep_order_around_a_missing_message(http, gmail):
+    ids = http.ids[:10]
+    ids[3] = 'gone'
+    result = fetch_message_summaries(gmail, ids)
+
+    assert [m['id'] for m in result] == ids
+    assert 'error' in result[3] and 'error' not in result[4]
+    assert http.round_trips == 1
+
+
+def test_read_message_is_one_round_trip(http, gmail):
+    result = tools.gmail_read_message(None, gmail, {'message_id': 'm0007'})
+
+    assert result['subject'] == 'Subject m0007'
+    assert result['body'] == 'Hello'
+    assert http.round_trips == 1
+
+
+def test_read_messages_shares_one_batch(http, gmail):
+    ids = http.ids[:20]
+    result = tools.gmail_read_messages(None, gmail, ids)
+
+    assert [m['subject'] for m in result] == [f'Subject {i}' for i in ids]
+    assert http.round_trips == _batches(len(ids))
+    assert http.batches == [len(ids)]